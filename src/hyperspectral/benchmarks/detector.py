@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+Measure matched filter throughput, in megapixels per second, before and after
+compiling the detector into a DetectorOperator.
+
+    python benchmarks/detector.py --bands 224 --size 512
+
+'whitened cube' is the previous normalized_matched_filter (whiten every pixel with a
+b×b product, then take dot products); 'activator' is the previous per-window kernel
+of the target detection activator, and 'activator, fused' the folded version.
+"""
+
+import argparse
+import math
+from time import time
+
+import numpy as np
+
+from hyperspectral.math.whitening import whitening_operator
+from hyperspectral.target.detector import DetectorOperator
+
+
+def whitened_cube(image, target, cov):
+    white = whitening_operator(cov)
+    X̃ = np.einsum('ij,rcj->rci', white.matrix, image)
+    s̃ = white.apply(target)
+    return np.divide(np.einsum('i,rci->rc', s̃, X̃),
+                     np.sqrt(np.einsum('rci,rci->rc', X̃, X̃))) / math.sqrt(np.inner(s̃, s̃))
+
+
+def activator(data, W, spectrum):
+    data = np.transpose(data, (1, 2, 0)).astype(np.float32)
+    data /= np.linalg.norm(data, ord=2, axis=2)[..., None].astype(np.float32)
+    shape = data.shape
+    data = np.matmul(data.reshape(-1, shape[-1]), W).reshape(*shape)
+    return np.dot(data, spectrum)
+
+
+def throughput(fn, pixels, trials):
+    fn()
+    start = time()
+    for _ in range(trials):
+        fn()
+    return pixels * trials / (time() - start) / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bands', type=int, default=224)
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--rank', type=int, default=32)
+    parser.add_argument('--trials', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    b, n = args.bands, args.size
+    mixing = rng.normal(size=(b, b)) * np.exp(-np.arange(b) / 16.0)
+    cov = np.matmul(mixing, mixing.transpose()) + 0.01 * np.eye(b)
+    image = np.matmul(rng.normal(size=(n, n, b)), mixing.transpose())
+    bands = np.ascontiguousarray(np.transpose(image, (2, 0, 1)))
+    target = rng.normal(size=b)
+    W = whitening_operator(cov).matrix.astype(np.float32)
+    spectrum = target.astype(np.float32)
+
+    float64 = DetectorOperator.matched_filter(target, cov, dtype=np.float64)
+    float32 = DetectorOperator.matched_filter(target, cov)
+    low_rank = DetectorOperator.matched_filter(target, cov, rank=args.rank)
+    fused = DetectorOperator.from_whitening_matrix(W, spectrum)
+    bands32 = bands.astype(np.float32)
+
+    cases = [
+        ('whitened cube', lambda: whitened_cube(image, target, cov)),
+        ('fused, float64', lambda: float64.apply_bands(bands)),
+        ('fused, float32', lambda: float32.apply_bands(bands32)),
+        ('fused, rank {}'.format(args.rank), lambda: low_rank.apply_bands(bands32)),
+        ('activator', lambda: activator(bands32, W, spectrum)),
+        ('activator, fused', lambda: fused.apply_bands(bands32)),
+    ]
+    for (name, fn) in cases:
+        print('{:>20}: {:8.2f} Mpx/s'.format(name, throughput(fn, n * n, args.trials)))
+
+    expected = whitened_cube(image, target, cov)
+    error = np.max(np.abs(float32.apply_bands(bands32)[0] - expected))
+    print('max |Δ| float32: {:.3g}'.format(error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+"""
+Time the rpca_grid dispersion scorers against the exact mad scorer.
+
+    python benchmarks/dispersion.py --sizes 1000 10000 100000 1000000
+
+For each sample count the inputs are n×n_g matrices of projections like the ones
+rpca_grid scores, and each scorer is reported with its time per call, its largest
+relative deviation from mad, and how often it selects the same best column as mad.
+"""
+
+import argparse
+from time import time
+
+import numpy as np
+
+from hyperspectral.math.dispersion import HistogramMAD, PartitionMAD, Qn, Sn, SubsampleMAD
+from hyperspectral.math.rpca import mad
+
+
+def projections(n, n_g, rng):
+    """Heavy-tailed samples with slightly different scales in each column"""
+    scales = 1 + 0.2 * rng.random(n_g)
+    return rng.standard_t(3, size=(n, n_g)) * scales
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--n-g', type=int, default=11)
+    parser.add_argument('--trials', type=int, default=5)
+    args = parser.parse_args()
+
+    scorers = [
+        ('mad', mad),
+        ('PartitionMAD', PartitionMAD()),
+        ('SubsampleMAD', SubsampleMAD()),
+        ('HistogramMAD', HistogramMAD()),
+        ('Qn', Qn()),
+        ('Sn', Sn()),
+    ]
+
+    rng = np.random.default_rng(0)
+    print('{:>8} {:>14} {:>12} {:>12} {:>8}'.format('n', 'scorer', 'ms/call', 'max rel err',
+                                                   'argmax'))
+    for n in args.sizes:
+        trials = [projections(n, args.n_g, rng) for _ in range(args.trials)]
+        exact = [mad(M) for M in trials]
+        for (name, S) in scorers:
+            start = time()
+            scores = [S(M) for M in trials]
+            elapsed = (time() - start) / args.trials
+
+            err = max(np.max(np.abs(s - e) / e) for (s, e) in zip(scores, exact))
+            agree = np.mean([np.argmax(s) == np.argmax(e) for (s, e) in zip(scores, exact)])
+            print('{:>8} {:>14} {:>12.3f} {:>12.2e} {:>8.0%}'.format(
+                n, name, 1000 * elapsed, err, agree))
+
+
+if __name__ == '__main__':
+    main()
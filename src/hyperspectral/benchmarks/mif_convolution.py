@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Time one MIF sifting step (applying a (2k+1)×(2k+1) mask with mirrored boundaries)
+with each convolution backend, over a range of mask radii and image sizes.
+
+    python benchmarks/mif_convolution.py --sizes 128 512 2048 --radii 1 2 4 8 16 32
+
+Times are milliseconds per application, after the per-(k, shape) setup that imf pays
+once per IMF; the fastest exact backend is marked, and 'error' is the largest
+deviation of the separable approximation from direct correlation.
+"""
+
+import argparse
+from time import time
+
+import numpy as np
+
+from hyperspectral.decorrelation.convolution import BACKENDS, smoother
+from hyperspectral.decorrelation.mif import get_mask_2d
+
+
+def per_call(fn, f, trials):
+    fn(f)
+    start = time()
+    for _ in range(trials):
+        fn(f)
+    return (time() - start) / trials * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[128, 512, 2048])
+    parser.add_argument('--radii', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--trials', type=int, default=3)
+    parser.add_argument('--skip-direct-above', type=int, default=2 ** 22,
+                        help='Skip direct correlation when pixels × taps exceeds this '
+                             '(in millions)')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    names = list(BACKENDS)
+    print('{:>6} {:>4} '.format('size', 'k') + ' '.join('{:>12}'.format(n) for n in names)
+          + ' {:>10}'.format('error'))
+    for n in args.sizes:
+        f = rng.normal(size=(n, n))
+        for k in args.radii:
+            if 2 * k + 1 > n:
+                continue
+            kernel = get_mask_2d(k)
+            times = {}
+            for name in names:
+                if name == 'direct' and n * n * kernel.size > args.skip_direct_above * 1e6:
+                    continue
+                times[name] = per_call(smoother(kernel, f.shape, name), f, args.trials)
+
+            reference = smoother(kernel, f.shape, 'fft')(f)
+            error = np.max(np.abs(smoother(kernel, f.shape, 'separable')(f) - reference))
+            exact = {name: t for (name, t) in times.items() if name != 'separable'}
+            best = min(exact, key=exact.get)
+            cells = []
+            for name in names:
+                if name not in times:
+                    cells.append('{:>12}'.format('-'))
+                else:
+                    mark = '*' if name == best else ' '
+                    cells.append('{:>11.2f}{}'.format(times[name], mark))
+            print('{:>6} {:>4} '.format(n, k) + ' '.join(cells) + ' {:>10.1e}'.format(error))
+
+
+if __name__ == '__main__':
+    main()
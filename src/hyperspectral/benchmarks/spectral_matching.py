@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""
+Time SpectralMatcher on synthetic pixels against synthetic libraries, with and without
+the clustered index, and check that both give the same matches.
+
+    python benchmarks/spectral_matching.py --sizes 3000 20000 --pixels 16384 --k 1 3
+
+'families' libraries are noisy variants of a few dozen base spectra, as material
+libraries tend to be, and are where the index prunes well; 'lowrank' libraries are
+spread evenly over a low-dimensional subspace, and are close to its worst case.
+"""
+
+import argparse
+from time import time
+
+import numpy as np
+
+from hyperspectral.spectra import SpectralLibrary, SpectralMatcher
+
+
+def make_library(kind, bands, n, rng):
+    if kind == 'families':
+        base = np.abs(np.cumsum(rng.normal(size=(bands, 60)), axis=0)) + 1
+        S = base[:, rng.integers(0, 60, n)] * (1 + 0.05 * rng.normal(size=(bands, n)))
+    else:
+        B = rng.normal(size=(bands, 20))
+        S = np.abs(np.matmul(B, rng.normal(size=(20, n))) + 0.1 * rng.normal(size=(bands, n)))
+    return S, SpectralLibrary.from_arrays(np.linspace(0.4, 2.4, bands), S.transpose(),
+                                          ['s'] * n, ['t'] * n, ['c'] * n, [{}] * n)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[3000, 20000])
+    parser.add_argument('--bands', type=int, default=200)
+    parser.add_argument('--pixels', type=int, default=16384)
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 3])
+    parser.add_argument('--components', type=int, default=16)
+    parser.add_argument('--metric', default='sam')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print('{:>9} {:>6} {:>3} {:>9} {:>9} {:>9} {:>7}'.format(
+        'library', 'n', 'k', 'exact', 'index', 'build', 'agree'))
+    for kind in ['families', 'lowrank']:
+        for n in args.sizes:
+            S, lib = make_library(kind, args.bands, n, rng)
+            truth = rng.integers(0, n, args.pixels)
+            X = S[:, truth] * rng.uniform(0.5, 2, args.pixels)
+            X = (X + 0.05 * rng.normal(size=X.shape)).astype(np.float32)
+            for k in args.k:
+                matcher = SpectralMatcher(lib, args.metric, k)
+                start = time()
+                ix, _ = matcher.apply(X)
+                exact = time() - start
+
+                start = time()
+                matcher = SpectralMatcher(lib, args.metric, k, components=args.components)
+                build = time() - start
+                start = time()
+                ix_index, _ = matcher.apply(X)
+                index = time() - start
+                print('{:>9} {:>6} {:>3} {:>8.2f}s {:>8.2f}s {:>8.2f}s {:>7.4f}'.format(
+                    kind, n, k, exact, index, build, np.mean(ix == ix_index)))
+
+
+if __name__ == '__main__':
+    main()
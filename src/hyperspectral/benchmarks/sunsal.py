@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+"""
+Measure SUnSAL unmixing throughput on a synthetic scene with spatially smooth
+abundances, as pixels per second for a range of endmember counts.
+
+    python benchmarks/sunsal.py --endmembers 50 200 400 --rows 64 --cols 512
+
+The scene is unmixed a row of pixels at a time, as for a striped raster, once with
+every row started cold and once with each row started from the row above.  'loop' is
+the same solver applied one pixel at a time, for a handful of pixels.
+"""
+
+import argparse
+from time import time
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from hyperspectral.unmixing import SparseUnmixer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--endmembers', type=int, nargs='+', default=[50, 200, 400])
+    parser.add_argument('--bands', type=int, default=224)
+    parser.add_argument('--rows', type=int, default=32)
+    parser.add_argument('--cols', type=int, default=512)
+    parser.add_argument('--loop-pixels', type=int, default=32)
+    parser.add_argument('--lam', type=float, default=0.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print('{:>5} {:>12} {:>12} {:>12} {:>10}'.format('m', 'loop px/s', 'cold px/s',
+                                                   'warm px/s', 'warm iters'))
+    for m in args.endmembers:
+        R = np.abs(np.cumsum(rng.normal(size=(args.bands, m)), axis=0)) + 1
+        # A few active endmembers per pixel, varying smoothly across the scene
+        active = rng.choice(m, size=min(m, 8), replace=False)
+        F = np.zeros((m, args.rows, args.cols))
+        for i in active:
+            F[i] = gaussian_filter(rng.exponential(size=(args.rows, args.cols)), 8, mode='wrap')
+        F /= np.sum(F, axis=0, keepdims=True)
+        scene = np.tensordot(R, F, 1) + 0.001 * rng.normal(size=(args.bands, args.rows, args.cols))
+        scene = scene.astype(np.float32)
+
+        unmixer = SparseUnmixer(R, λ=args.lam)
+        start = time()
+        for j in range(args.loop_pixels):
+            unmixer.apply(scene[:, 0, j:j + 1])
+        loop = args.loop_pixels / (time() - start)
+
+        rates = []
+        for warm in [False, True]:
+            state, iterations = None, []
+            start = time()
+            for r in range(args.rows):
+                _, next_state = unmixer.apply(scene[:, r, :], state if warm else None)
+                state = next_state
+                iterations.append(unmixer.iterations)
+            rates.append(args.rows * args.cols / (time() - start))
+        print('{:>5} {:>12.0f} {:>12.0f} {:>12.0f} {:>10.0f}'.format(
+            m, loop, rates[0], rates[1], np.mean(iterations)))
+
+
+if __name__ == '__main__':
+    main()
@@ -30,4 +30,6 @@
 
 from .models import MatchedFilter
 from .selection import argsort
-from .train import vanilla_train
+from .subset import sequential_selection
+from .train import minibatch_train, vanilla_train
+from .pixels import PixelStore
@@ -35,7 +35,7 @@ import torch.nn.functional as F
 
 class MatchedFilter(torch.nn.Module):
 
-    def __init__(self, W: np.array, bias: float):
+    def __init__(self, W: np.array, bias: float, dtype: type = np.float32):
         """Given a whitening (sphering) matrix and a bias, build a
         matched-filter target detection model in PyTorch.
 
@@ -52,15 +52,18 @@ class MatchedFilter(torch.nn.Module):
             matched-filter computation (the number subtracted from the
             dot product of the transformed pixel and the transformed
             spectrum).
+        dtype : type
+            The numpy floating point type of the parameters.  Inputs
+            of other types are converted to it in forward.
 
         """
         super(MatchedFilter, self).__init__()
 
-        _W = torch.from_numpy(W.astype(np.float)).unsqueeze(2)
+        _W = torch.from_numpy(W.astype(dtype)).unsqueeze(2)
         _W = torch.nn.parameter.Parameter(_W)
         self.register_parameter('W', _W)
 
-        _bias = torch.from_numpy(np.array(bias).astype(np.float)).reshape(1)
+        _bias = torch.from_numpy(np.array(bias).astype(dtype)).reshape(1)
         _bias = torch.nn.parameter.Parameter(_bias)
         self.register_parameter('bias', _bias)
 
@@ -92,6 +95,8 @@ class MatchedFilter(torch.nn.Module):
             bias).
 
         """
+        x = x.to(self.W.dtype)
+        y = y.to(self.W.dtype)
         x = F.conv1d(x, self.W)  # step 1
         y = F.conv1d(y, self.W)  # step 2
         x = F.conv1d(x, y, self.bias)  # step 3
@@ -0,0 +1,189 @@
+# Copyright 2021 Azavea
+#
+# Redistribution and use  in source and binary forms,  with or without
+# modification, are  permitted provided that the  following conditions
+# are met:
+#
+# 1. Redistributions  of source code  must retain the  above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions  and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither  the name of  the copyright holder  nor the names  of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY  THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS"  AND ANY EXPRESS  OR IMPLIED WARRANTIES, INCLUDING,  BUT NOT
+# LIMITED TO,  THE IMPLIED  WARRANTIES OF MERCHANTABILITY  AND FITNESS
+# FOR  A PARTICULAR  PURPOSE ARE  DISCLAIMED.  IN NO  EVENT SHALL  THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT  LIMITED TO,  PROCUREMENT OF  SUBSTITUTE GOODS  OR SERVICES;
+# LOSS OF  USE, DATA,  OR PROFITS;  OR BUSINESS  INTERRUPTION) HOWEVER
+# CAUSED AND ON  ANY THEORY OF LIABILITY, WHETHER  IN CONTRACT, STRICT
+# LIABILITY, OR  TORT (INCLUDING  NEGLIGENCE OR OTHERWISE)  ARISING IN
+# ANY WAY  OUT OF  THE USE OF  THIS SOFTWARE, EVEN  IF ADVISED  OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch as torch
+
+from hyperspectral.math.sampling import Reservoir, raster_blocks, valid_pixels
+
+
+class PixelStore:
+
+    def __init__(self, pixels: np.array, labels: np.array):
+        """Hold labelled pixels for streaming mini-batch training.
+
+        Pixels are kept as an n×c numpy array, which may be a
+        np.memmap, and only the pixels of each mini-batch are turned
+        into an n×c×1 tensor.
+
+        Parameters
+        ----------
+        pixels : np.array
+            An n×c array of n pixels, each of c channels.
+        labels : np.array
+            An n-element array of labels; 0 is for background and 1
+            is for target.
+
+        """
+        assert pixels.shape[0] == labels.shape[0], "One label is needed per pixel"
+        self.pixels = pixels
+        self.labels = labels
+
+    def __len__(self):
+        return self.pixels.shape[0]
+
+    @property
+    def channels(self):
+        return self.pixels.shape[1]
+
+    @staticmethod
+    def load(path: str):
+        """Memory-map a store saved with save.
+
+        Parameters
+        ----------
+        path : str
+            The directory the store was saved to.
+
+        Returns
+        -------
+        PixelStore
+            The store, backed by memory-mapped arrays.
+
+        """
+        return PixelStore(np.load(os.path.join(path, 'pixels.npy'), mmap_mode='r'),
+                          np.load(os.path.join(path, 'labels.npy'), mmap_mode='r'))
+
+    def save(self, path: str):
+        """Save the store as .npy files in a directory, for load."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'pixels.npy'), np.asarray(self.pixels, dtype=np.float32))
+        np.save(os.path.join(path, 'labels.npy'), np.asarray(self.labels, dtype=np.float32))
+
+    @staticmethod
+    def from_rasters(pairs: List[Tuple[str, str]],
+                     size: int,
+                     bands: Optional[List[int]] = None,
+                     nodata: Optional[float] = None,
+                     seed: Optional[int] = None):
+        """Sample labelled pixels directly from rasters.
+
+        Each image is paired with a single-band label raster on the
+        same grid, where 0 marks background, 1 marks target, and
+        anything else (including NaN) is unlabelled.  Up to size pixels
+        of each class are reservoir sampled from every pair, both
+        classes in one streaming pass over the image, so neither the scenes nor the full set of
+        labelled pixels are ever held in memory.
+
+        Parameters
+        ----------
+        pairs : List[Tuple[str, str]]
+            (image path, label path) pairs.
+        size : int
+            The largest number of pixels of each class to sample from
+            each pair.
+        bands : Optional[List[int]]
+            1-based indices of the image bands to read.
+        nodata : Optional[float]
+            Image value marking fill pixels, which are never sampled;
+            the nodata value of each image if omitted.
+        seed : Optional[int]
+            Seed for the random selection.
+
+        Returns
+        -------
+        PixelStore
+            The sampled pixels, as float32.
+
+        """
+        import rasterio as rio
+
+        rng = np.random.default_rng(seed)
+        pixels, labels = [], []
+        for image, label in pairs:
+            reservoirs = [Reservoir(size, seed=rng.integers(2 ** 32)) for _ in (0, 1)]
+            with rio.open(image, 'r') as image_ds, rio.open(label, 'r') as label_ds:
+                fill = image_ds.nodata if nodata is None else nodata
+                for window, data in raster_blocks(image, bands):
+                    valid = valid_pixels(data, fill)
+                    classes = label_ds.read(1, window=window).ravel()
+                    for cls, reservoir in enumerate(reservoirs):
+                        reservoir.update(window, data, valid & (classes == cls))
+
+            for cls, reservoir in enumerate(reservoirs):
+                sample, _ = reservoir.sample()
+                if sample is None:
+                    continue  # No pixels of this class
+                pixels.append(sample.transpose().astype(np.float32))
+                labels.append(np.full(sample.shape[1], cls, dtype=np.float32))
+
+        assert len(pixels) > 0, "No labelled pixels found"
+        return PixelStore(np.concatenate(pixels), np.concatenate(labels))
+
+    def batches(self,
+                indices: np.array,
+                batch_size: int,
+                device: torch.device,
+                dtype: torch.dtype = torch.float32,
+                rng: Optional[np.random.Generator] = None):
+        """Yield mini-batches of the given pixels as tensors.
+
+        Parameters
+        ----------
+        indices : np.array
+            Indices of the pixels to draw from.
+        batch_size : int
+            The number of pixels per batch.
+        device : torch.device
+            The device to place batches on.
+        dtype : torch.dtype
+            The type of the batch tensors.
+        rng : Optional[np.random.Generator]
+            Source of the shuffle; batches follow the order of indices
+            if omitted.
+
+        Yields
+        ------
+        Tuple[torch.tensor, torch.tensor]
+            A b×c×1 tensor of pixels and a b×1×1 tensor of labels.
+
+        """
+        if rng is not None:
+            indices = rng.permutation(indices)
+        for start in range(0, len(indices), batch_size):
+            # Sorted reads keep access to memory-mapped stores sequential
+            batch = np.sort(indices[start:start + batch_size])
+            ps = torch.from_numpy(np.asarray(self.pixels[batch], dtype=np.float32))
+            ls = torch.from_numpy(np.asarray(self.labels[batch], dtype=np.float32))
+            yield (ps.unsqueeze(2).to(device=device, dtype=dtype),
+                   ls.reshape((-1, 1, 1)).to(device=device, dtype=dtype))
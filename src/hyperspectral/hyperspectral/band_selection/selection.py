@@ -38,10 +38,19 @@ import torch.nn.functional as F
 def argsort(model: torch.nn.Module,
             ps: torch.tensor,
             v: torch.tensor,
-            inds: List[int]):
+            inds: List[int],
+            chunk_size: int = 4096,
+            stats: bool = False):
     """Given a model and some (positive) examples, return a list of band
     indices sorted according to salience.
 
+    The salience of a band is the mean gradient of the model output
+    with respect to that band over the positive pixels.  The model is
+    assumed to score each pixel independently (as MatchedFilter
+    does), so the gradients of all positives in a chunk come from a
+    single backward pass through the sum of their outputs, and only
+    the positive pixels are run through the model.
+
     Parameters
     ----------
     model : torch.nn.Module
@@ -56,11 +65,24 @@ def argsort(model: torch.nn.Module,
     inds : List[int]
         A list of indices (relative to the first dimension of ps)
         containing "positive" pixels.
+    chunk_size : int
+        The largest number of positive pixels passed through the
+        model (and its graph) at once.
+    stats : bool
+        Whether to also return per-band salience statistics.
 
     Returns
     -------
     np.array
         A list of band indices sorted by salience
+    dict
+        Only if stats is True: c×1 arrays of the 'mean' gradient, the
+        'mean_abs' gradient magnitude and the 'std' of the gradient
+        over the positive pixels.  All three weight each pixel by the
+        number of times it appears in inds.  The ordering weights a
+        repeated pixel by the square of that number instead, as
+        accumulated gradients did, so it follows stats['mean'] only
+        when inds has no repeats.
 
     """
 
@@ -68,18 +90,40 @@ def argsort(model: torch.nn.Module,
     model_train_state = model.training
     model.eval()
 
-    ps.requires_grad_()
-    pred = model(ps, v)
+    # Repeated indices are weighted as when each was back-propagated
+    # separately into one accumulated gradient
+    unique, counts = np.unique(np.asarray(inds, dtype=np.int64), return_counts=True)
+    c = ps.shape[1:]
+    total = np.zeros(c)
+    total_once = np.zeros(c)
+    total_abs = np.zeros(c)
+    total_sq = np.zeros(c)
+
+    for start in range(0, len(unique), chunk_size):
+        idx = torch.from_numpy(unique[start:start + chunk_size]).to(ps.device)
+        x = ps.detach().index_select(0, idx).requires_grad_()
+        pred = model(x, v)
+        grad, = torch.autograd.grad(pred[:, 0, 0].sum(), x)
+        grad = grad.cpu().numpy().astype(np.float64)
 
-    for ind in inds:
-        pred[ind, 0, 0].backward(retain_graph=True)
+        weights = counts[start:start + chunk_size].astype(np.float64)
+        weights = weights.reshape((-1,) + (1,) * len(c))
+        total += np.sum(grad * weights * weights, axis=0)
+        total_once += np.sum(grad * weights, axis=0)
+        total_abs += np.sum(np.abs(grad) * weights, axis=0)
+        total_sq += np.sum(grad * grad * weights, axis=0)
 
-    salience = ps.grad.data.cpu().detach().numpy()
-    salience = salience[inds, :, :]
-    salience = np.mean(salience, axis=0)
+    salience = total / len(inds)
     according_to_salience = np.argsort(np.abs(salience), axis=0)
 
     # Restore training state
     model.train(model_train_state)
 
+    if stats:
+        variance = total_sq / len(inds) - np.square(total_once / len(inds))
+        return according_to_salience, {
+            'mean': total_once / len(inds),
+            'mean_abs': total_abs / len(inds),
+            'std': np.sqrt(np.maximum(variance, 0)),
+        }
     return according_to_salience
@@ -0,0 +1,218 @@
+# Copyright 2021 Azavea
+#
+# Redistribution and use  in source and binary forms,  with or without
+# modification, are  permitted provided that the  following conditions
+# are met:
+#
+# 1. Redistributions  of source code  must retain the  above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions  and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither  the name of  the copyright holder  nor the names  of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY  THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS"  AND ANY EXPRESS  OR IMPLIED WARRANTIES, INCLUDING,  BUT NOT
+# LIMITED TO,  THE IMPLIED  WARRANTIES OF MERCHANTABILITY  AND FITNESS
+# FOR  A PARTICULAR  PURPOSE ARE  DISCLAIMED.  IN NO  EVENT SHALL  THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT  LIMITED TO,  PROCUREMENT OF  SUBSTITUTE GOODS  OR SERVICES;
+# LOSS OF  USE, DATA,  OR PROFITS;  OR BUSINESS  INTERRUPTION) HOWEVER
+# CAUSED AND ON  ANY THEORY OF LIABILITY, WHETHER  IN CONTRACT, STRICT
+# LIABILITY, OR  TORT (INCLUDING  NEGLIGENCE OR OTHERWISE)  ARISING IN
+# ANY WAY  OUT OF  THE USE OF  THIS SOFTWARE, EVEN  IF ADVISED  OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from typing import List, Optional
+
+import numpy as np
+
+
+def _auc(scores: np.array, labels: np.array):
+    """The area under the ROC curve of each column of scores, counting ties as half"""
+    negatives = np.sort(np.ascontiguousarray(scores[~labels].transpose()), axis=1)
+    positives = scores[labels]
+    below = np.empty(scores.shape[1])
+    for j in range(scores.shape[1]):
+        below[j] = np.sum(np.searchsorted(negatives[j], positives[:, j], side='left') +
+                          np.searchsorted(negatives[j], positives[:, j], side='right'))
+    return below / (2 * positives.shape[0] * negatives.shape[1])
+
+
+def _pd(scores: np.array, labels: np.array, pfa: float):
+    """The fraction of positives above the (1 - pfa) quantile of the negatives"""
+    threshold = np.quantile(scores[~labels], 1 - pfa, axis=0)
+    return np.mean(scores[labels] > threshold, axis=0)
+
+
+def _separation(scores: np.array, labels: np.array):
+    """The gap between the mean scores of positives and negatives, in negative std. devs."""
+    negatives = scores[~labels]
+    return (np.mean(scores[labels], axis=0) - np.mean(negatives, axis=0)) / \
+        np.std(negatives, axis=0)
+
+
+METRICS = ('auc', 'pd', 'separation')
+
+
+def _metric(name: str, scores: np.array, labels: np.array, pfa: float):
+    if name == 'auc':
+        return _auc(scores, labels)
+    elif name == 'pd':
+        return _pd(scores, labels, pfa)
+    else:
+        return _separation(scores, labels)
+
+
+def _removal_filters(Σ: np.array, s: np.array, B: np.array):
+    """Matched filters Σ⁻¹s on B with each band of B removed in turn
+
+    With P = Σ_BB⁻¹ and w = Ps, removing band j leaves the
+    inverse P₋ⱼ₋ⱼ - P₋ⱼⱼPⱼ₋ⱼ/Pⱼⱼ (a rank-one downdate), and so the
+    filter w₋ⱼ - P₋ⱼⱼwⱼ/Pⱼⱼ.  Column j of the result is the filter
+    for B without B[j], with a zero in row j.
+    """
+    P = np.linalg.inv(Σ[np.ix_(B, B)])
+    w = np.matmul(P, s[B])
+    W = w[:, None] - P * (w / np.diag(P))[None, :]
+    np.fill_diagonal(W, 0)
+    return W
+
+
+def _addition_filters(Σ: np.array, s: np.array, B: np.array, J: np.array):
+    """Matched filters Σ⁻¹s on B with each band of J added in turn
+
+    With P = Σ_BB⁻¹, w = Ps and u = Σ_Bj, the inverse on B ∪ {j}
+    follows from the Schur complement c = Σⱼⱼ - uᵀPu, giving the
+    filter (w - Puα, α) with α = (sⱼ - uᵀw)/c.  Returns the |B|×|J|
+    filter entries on B and the |J| entries on the added bands.
+    """
+    P = np.linalg.inv(Σ[np.ix_(B, B)]) if len(B) > 0 else np.zeros((0, 0))
+    w = np.matmul(P, s[B])
+    U = Σ[np.ix_(B, J)]
+    PU = np.matmul(P, U)
+    c = Σ[J, J] - np.einsum('ij,ij->j', U, PU)
+    α = (s[J] - np.matmul(w, U)) / c
+    return w[:, None] - PU * α[None, :], α
+
+
+def sequential_selection(covariance: np.array,
+                         target: np.array,
+                         pixels: np.array,
+                         labels: np.array,
+                         mean: Optional[np.array] = None,
+                         direction: str = 'backward',
+                         metric: str = 'auc',
+                         goal: Optional[float] = None,
+                         candidates: Optional[List[int]] = None,
+                         min_bands: int = 1,
+                         max_bands: Optional[int] = None,
+                         pfa: float = 1e-3):
+    """Greedily choose a subset of bands for a matched-filter detector.
+
+    Starting from no bands (forward) or all candidate bands
+    (backward), the band whose addition or removal gives the best
+    detection metric is added or removed at each step.  Every
+    candidate subset of a step is evaluated at once: the background
+    covariance of the current subset is inverted once per step, the
+    matched filters Σ⁻¹s of all candidate subsets follow from it by
+    rank-one updates (forward) or downdates (backward), and the
+    labelled pixels are scored against all of them with a single
+    matrix product.  The metrics used are invariant to the scale of a
+    filter, so filters are not normalized.
+
+    Forward selection stops once the goal is reached (or at
+    max_bands); backward selection stops before a removal would take
+    the metric below the goal (or at min_bands).
+
+    Parameters
+    ----------
+    covariance : np.array
+        The d×d background covariance, such as from a
+        CovarianceAccumulator.
+    target : np.array
+        The d-dimensional target spectrum.
+    pixels : np.array
+        A d×n matrix of labelled pixels, as columns.
+    labels : np.array
+        n labels for the pixels; nonzero marks a target.
+    mean : Optional[np.array]
+        The d-dimensional background mean, subtracted from the pixels.
+    direction : str
+        'forward' or 'backward'.
+    metric : str
+        One of METRICS: 'auc' for the area under the ROC curve, 'pd'
+        for the fraction of targets detected at a false alarm rate of
+        pfa, or 'separation' for the gap between the mean target and
+        background scores in background standard deviations.
+    goal : Optional[float]
+        The metric value to stop at.
+    candidates : Optional[List[int]]
+        0-based indices of the bands that may be chosen; all bands if
+        omitted.
+    min_bands : int
+        The smallest subset backward selection may reach.
+    max_bands : Optional[int]
+        The largest subset forward selection may reach.
+    pfa : float
+        The false alarm rate for the 'pd' metric.
+
+    Returns
+    -------
+    List[int]
+        The chosen band indices, sorted.
+    List[dict]
+        The steps taken: the 'band' added or removed, the number of
+        'bands' and the 'metric' after each step.  For backward
+        selection, the first entry is the full candidate set.
+
+    """
+    assert direction in ('forward', 'backward'), "Unrecognized direction: {}".format(direction)
+    assert metric in METRICS, "Unrecognized metric: {}".format(metric)
+
+    Σ = np.asarray(covariance, dtype=np.float64)
+    s = np.asarray(target, dtype=np.float64)
+    X = np.asarray(pixels, dtype=np.float64)
+    if mean is not None:
+        X = X - np.asarray(mean, dtype=np.float64)[:, None]
+    X = X.transpose()
+    labels = np.asarray(labels) != 0
+    assert np.any(labels) and not np.all(labels), "Both targets and background are needed"
+
+    J = np.array(candidates if candidates is not None else range(Σ.shape[0]))
+    history = []
+
+    if direction == 'backward':
+        B = J.copy()
+        W = np.linalg.solve(Σ[np.ix_(B, B)], s[B])
+        value = _metric(metric, np.matmul(X[:, B], W)[:, None], labels, pfa)[0]
+        history.append({'band': None, 'bands': len(B), 'metric': float(value)})
+        while len(B) > max(min_bands, 1):
+            W = _removal_filters(Σ, s, B)
+            values = _metric(metric, np.matmul(X[:, B], W), labels, pfa)
+            best = int(np.argmax(values))
+            if goal is not None and values[best] < goal:
+                break
+            history.append({'band': int(B[best]), 'bands': len(B) - 1,
+                            'metric': float(values[best])})
+            B = np.delete(B, best)
+        return sorted(B.tolist()), history
+
+    B = np.zeros(0, dtype=J.dtype)
+    max_bands = len(J) if max_bands is None else min(max_bands, len(J))
+    while len(B) < max_bands:
+        rest = np.setdiff1d(J, B)
+        W, α = _addition_filters(Σ, s, B, rest)
+        scores = np.matmul(X[:, B], W) + X[:, rest] * α[None, :]
+        values = _metric(metric, scores, labels, pfa)
+        best = int(np.argmax(values))
+        B = np.append(B, rest[best])
+        history.append({'band': int(rest[best]), 'bands': len(B), 'metric': float(values[best])})
+        if goal is not None and values[best] >= goal:
+            break
+    return sorted(B.tolist()), history
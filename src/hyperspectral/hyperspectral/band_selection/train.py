@@ -28,10 +28,19 @@
 # ANY WAY  OUT OF  THE USE OF  THIS SOFTWARE, EVEN  IF ADVISED  OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import copy
+import logging
+import time
+from typing import Optional
+
 import numpy as np
 import torch as torch
 import torch.nn.functional as F
 
+from hyperspectral.band_selection.pixels import PixelStore
+
+log = logging.getLogger(__name__)
+
 
 def vanilla_train(model: torch.nn.Module,
                   ps: torch.tensor,
@@ -79,8 +88,133 @@ def vanilla_train(model: torch.nn.Module,
     for i in range(0, num_epochs):
         opt.zero_grad()
         pred = model(ps, v)
-        loss = obj(pred, ls)
+        loss = obj(pred, ls.to(pred.dtype))
         loss.backward()
         opt.step()
 
     return model
+
+
+def minibatch_train(model: torch.nn.Module,
+                    store: PixelStore,
+                    v: torch.tensor,
+                    device: torch.device,
+                    batch_size: int = 4096,
+                    max_epochs: int = 100,
+                    lr: float = 1e-4,
+                    momentum: float = 0.9,
+                    validation: float = 0.1,
+                    patience: int = 5,
+                    min_delta: float = 0.0,
+                    threads: Optional[int] = None,
+                    seed: Optional[int] = None):
+    """Train a model on labelled pixels streamed in shuffled mini-batches.
+
+    This is vanilla_train for pixel sets too large to train on in a
+    single batch.  Pixels stay in the store (in memory or memory
+    mapped) and are converted to float32 tensors one mini-batch at a
+    time.  A fraction of the pixels is held out, and training stops
+    once the loss on them has not improved by min_delta for patience
+    epochs; the parameters with the best validation loss are kept.
+    Throughput is logged, in pixels per second, after every epoch.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        A PyTorch representation of a model, typically a
+        MatchedFilter.
+    store : PixelStore
+        The labelled pixels; see PixelStore.from_rasters to sample
+        them from rasters.
+    v : torch.tensor
+        A 1×c×1 tensor containing the target spectrum.
+    device : torch.device
+        The device to train on.
+    batch_size : int
+        The number of pixels per mini-batch.
+    max_epochs : int
+        The largest number of passes over the training pixels.
+    lr : float
+        The SGD learning rate.
+    momentum : float
+        The SGD momentum.
+    validation : float
+        The fraction of pixels held out for early stopping; 0 trains
+        on all pixels for max_epochs.
+    patience : int
+        The number of epochs without improvement before stopping.
+    min_delta : float
+        The smallest decrease in validation loss that counts as an
+        improvement.
+    threads : Optional[int]
+        The number of CPU threads for torch to use while training.
+    seed : Optional[int]
+        Seed for the validation split and the shuffles.
+
+    Returns
+    -------
+    torch.nn.Module
+        The trained model.
+
+    """
+    previous_threads = torch.get_num_threads()
+    if threads is not None:
+        torch.set_num_threads(threads)
+
+    dtype = next(model.parameters()).dtype
+    v = v.to(device=device, dtype=dtype)
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(store))
+    held_out = int(len(store) * validation)
+    validate, train = order[:held_out], order[held_out:]
+
+    for parameter in model.parameters():
+        parameter.requires_grad = True
+
+    obj = torch.nn.BCEWithLogitsLoss(reduction='sum').to(device)
+    opt = torch.optim.SGD(model.parameters(), lr=lr, momentum=momentum)
+
+    best_loss, best_state, stale = np.inf, None, 0
+    try:
+        for epoch in range(max_epochs):
+            model.train()
+            start = time.time()
+            train_loss = 0.0
+            for ps, ls in store.batches(train, batch_size, device, dtype, rng):
+                opt.zero_grad()
+                loss = obj(model(ps, v), ls)
+                # Gradients of the batch mean, as vanilla_train takes
+                (loss / ps.shape[0]).backward()
+                opt.step()
+                train_loss += loss.item()
+            elapsed = time.time() - start
+            train_loss /= max(len(train), 1)
+
+            if held_out == 0:
+                log.info('epoch %d: training loss %.6g, %.0f px/s', epoch, train_loss,
+                         len(train) / elapsed)
+                continue
+
+            model.eval()
+            val_loss = 0.0
+            with torch.no_grad():
+                for ps, ls in store.batches(validate, batch_size, device, dtype):
+                    val_loss += obj(model(ps, v), ls).item()
+            val_loss /= held_out
+            log.info('epoch %d: training loss %.6g, validation loss %.6g, %.0f px/s', epoch,
+                     train_loss, val_loss, len(train) / elapsed)
+
+            if val_loss < best_loss - min_delta:
+                best_loss, stale = val_loss, 0
+                best_state = copy.deepcopy(model.state_dict())
+            else:
+                stale += 1
+                if stale >= patience:
+                    log.info('stopping early: no improvement in %d epochs', patience)
+                    break
+    finally:
+        torch.set_num_threads(previous_threads)
+
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    return model
@@ -1 +1,4 @@
-from .mif import imf, imf_torch, mif, mif_torch, mif_decorrelate
+from .mif import (imf, imf_torch, imf_torch_batched, mif, mif_torch, mif_torch_batched,
+                  mif_decorrelate)
+from .convolution import smoother
+from .tiled import apply_schedule, mif_decorrelate_tiled, mif_schedule, seam_error
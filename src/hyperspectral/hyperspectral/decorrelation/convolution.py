@@ -0,0 +1,170 @@
+from collections import OrderedDict
+import hashlib
+
+import numpy as np
+import scipy.fft
+import scipy.ndimage
+from scipy.signal import correlate2d, oaconvolve
+
+# Smoothers built by a backend apply a fixed (2k+1)×(2k+1) kernel to images of a fixed
+# shape, as correlate2d(f, kernel, mode='same', boundary='symm') does: the image is
+# extended by mirroring about its edges (…c b a | a b c…), and the output has the
+# shape of the input.
+
+_kernel_fft_cache = OrderedDict()
+KERNEL_FFT_CACHE_SIZE = 16
+
+# Above this many kernel taps, 'auto' moves from direct correlation to the FFT; see
+# benchmarks/mif_convolution.py, where the FFT is already ahead at k = 2 for all but
+# the smallest images
+DIRECT_MAX_TAPS = 3 * 3
+# Above this many pixels, 'auto' uses overlap-add, which is slower than a single FFT
+# but bounds the size of the transforms (and their scratch memory) by the kernel size
+OVERLAP_ADD_MIN_PIXELS = 4096 * 4096
+
+
+def _half_width(kernel):
+    h, w = kernel.shape
+    assert h % 2 == 1 and w % 2 == 1, "Kernels must have odd dimensions"
+    return h // 2, w // 2
+
+
+def _pad(f, kernel):
+    kr, kc = _half_width(kernel)
+    return np.pad(f, ((kr, kr), (kc, kc)), mode='symmetric')
+
+
+def direct_smoother(kernel, shape):
+    """
+    Smooth by direct correlation; O(K) work per pixel for a K-tap kernel
+    """
+    return lambda f: correlate2d(f, kernel, mode='same', boundary='symm')
+
+
+def kernel_fft(kernel, shape):
+    """
+    Return the real FFT of a kernel, flipped for correlation, zero-padded to shape
+
+    Transforms are kept in a least-recently-used cache keyed by the kernel contents and
+    the transform shape, so every sifting iteration, and every band of the same size
+    that uses the same kernel, shares one transform.
+    """
+    kernel = np.ascontiguousarray(kernel, dtype=np.float64)
+    key = (hashlib.sha1(kernel.tobytes()).hexdigest(), kernel.shape, tuple(shape))
+    if key in _kernel_fft_cache:
+        _kernel_fft_cache.move_to_end(key)
+        return _kernel_fft_cache[key]
+
+    transformed = scipy.fft.rfft2(kernel[::-1, ::-1], s=shape)
+    _kernel_fft_cache[key] = transformed
+    if len(_kernel_fft_cache) > KERNEL_FFT_CACHE_SIZE:
+        _kernel_fft_cache.popitem(last=False)
+    return transformed
+
+
+def fft_smoother(kernel, shape):
+    """
+    Smooth by FFT convolution of the mirror-padded image; O(log N) work per pixel
+
+    The image is padded by the kernel half-width on each side, so the mirrored
+    boundary matches correlate2d exactly, and transformed at the next fast FFT size.
+    The circular wrap-around of the FFT only reaches the padding, which is discarded.
+    """
+    kr, kc = _half_width(kernel)
+    h, w = shape
+    fft_shape = (scipy.fft.next_fast_len(h + 2 * kr, real=True),
+                 scipy.fft.next_fast_len(w + 2 * kc, real=True))
+    K = kernel_fft(kernel, fft_shape)
+
+    def smooth(f):
+        F = scipy.fft.rfft2(_pad(f, kernel), s=fft_shape)
+        F *= K
+        full = scipy.fft.irfft2(F, s=fft_shape)
+        return full[2 * kr:(2 * kr + h), 2 * kc:(2 * kc + w)]
+
+    return smooth
+
+
+def overlap_add_smoother(kernel, shape):
+    """
+    Smooth by overlap-add FFT convolution of the mirror-padded image
+
+    The padded image is convolved in blocks sized to the kernel, which bounds the size
+    of each transform and suits images much larger than the kernel.
+    """
+    flipped = np.ascontiguousarray(kernel[::-1, ::-1])
+    return lambda f: oaconvolve(_pad(f, kernel), flipped, mode='valid')
+
+
+def separable_smoother(kernel, shape, tol=1e-4, max_rank=None):
+    """
+    Smooth with a low-rank separable approximation of the kernel
+
+    The kernel is approximated by the truncated SVD Σᵢ σᵢuᵢvᵢᵀ with the fewest terms
+    whose discarded singular values sum to at most tol times the total, and each term
+    is applied as a pass of 1-d correlations down the columns and along the rows, for
+    O(r·√K) work per pixel at rank r.  MIF masks are radial rather than Gaussian, so
+    are not exactly separable, but their singular values decay quickly.
+
+    Arguments:
+        kernel (np.ndarray): A 2-d cross-correlation kernel
+        shape (tuple): The shape of the images to smooth
+        tol (float): Relative bound on the discarded singular values
+        max_rank (optional int): The largest number of separable terms to use
+    """
+    U, σ, Vt = np.linalg.svd(kernel)
+    tail = np.cumsum(σ[::-1])[::-1] / np.sum(σ)
+    rank = max(1, int(np.sum(tail > tol)))
+    if max_rank is not None:
+        rank = min(rank, max_rank)
+    # Split each singular value between the column and row filters
+    cols = U[:,:rank] * np.sqrt(σ[:rank])
+    rows = Vt[:rank].transpose() * np.sqrt(σ[:rank])
+
+    def smooth(f):
+        out = np.zeros(f.shape)
+        for i in range(rank):
+            # ndimage's 'reflect' mode is the …c b a | a b c… extension of correlate2d
+            g = scipy.ndimage.correlate1d(f, cols[:,i], axis=0, mode='reflect')
+            out += scipy.ndimage.correlate1d(g, rows[:,i], axis=1, mode='reflect')
+        return out
+
+    smooth.rank = rank
+    return smooth
+
+
+BACKENDS = {
+    'direct': direct_smoother,
+    'fft': fft_smoother,
+    'overlap-add': overlap_add_smoother,
+    'separable': separable_smoother,
+}
+
+
+def smoother(kernel, shape, backend='auto'):
+    """
+    Build a function that applies a kernel to images of a given shape
+
+    Arguments:
+        kernel (np.ndarray): A 2-d cross-correlation kernel with odd dimensions
+        shape (tuple): The shape of the images to smooth
+        backend (str or function): One of BACKENDS, 'auto' to choose between 'direct',
+            'fft' and 'overlap-add' by kernel and image size, or a function with the
+            signature of the functions in BACKENDS
+
+    Returns a function from an image to its smoothed image, as
+    correlate2d(f, kernel, mode='same', boundary='symm') up to rounding (or up to the
+    approximation error for 'separable')
+    """
+    if callable(backend):
+        return backend(kernel, shape)
+    if backend == 'auto':
+        if kernel.size <= DIRECT_MAX_TAPS:
+            backend = 'direct'
+        elif shape[0] * shape[1] >= OVERLAP_ADD_MIN_PIXELS:
+            backend = 'overlap-add'
+        else:
+            backend = 'fft'
+    if backend not in BACKENDS:
+        raise ValueError('Unrecognized convolution backend: {}'.format(backend))
+    return BACKENDS[backend](kernel, shape)
@@ -1,10 +1,11 @@
-from functools import partial
+from functools import lru_cache, partial
 import math
 from pkg_resources import resource_filename
 
 import numpy as np
 import scipy.io
-from scipy.signal import correlate2d
+
+from hyperspectral.decorrelation.convolution import smoother
 
 try:
     import torch
@@ -14,32 +15,40 @@ try:
 except:
     torch_available = False
 
+MASK_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=None)
+def _fokker_planck_kernel():
+    path = resource_filename('hyperspectral.resources', 'prefixed_double_filter.mat')
+    kernel = scipy.io.loadmat(path)['MM'].flatten()
+    kernel.flags.writeable = False
+    return kernel
+
+
 def fokker_planck_kernel():
     # This function depends on the preprocessed kernel provided by
     # https://github.com/Acicone/Iterative-Filtering-IF/blob/master/prefixed_double_filter.mat
-    return scipy.io.loadmat(resource_filename('hyperspectral.resources', 'prefixed_double_filter.mat'))['MM'].flatten()
-
-
-def get_mask(k, kernel=None):
-    assert isinstance(k, int), "Must provide integer-valued mask support width"
+    # The file is read once per process; the returned array is read-only
+    return _fokker_planck_kernel()
 
-    if kernel is None:
-        kernel = fokker_planck_kernel()
 
+def _build_mask(k, kernel):
     n = len(kernel)
     m = int((n - 1) / 2)
 
     if k < m:
-        mask = np.zeros(2 * k + 1)
+        # Average the kernel over 2k+1 equal-width cells, weighting the samples cut by
+        # each cell boundary by the fraction falling inside the cell
         stops = np.linspace(0, n, 2 * k + 2)
-        for i in range(2 * k + 1):
-            left_frac = math.ceil(stops[i]) - stops[i]
-            right_frac = stops[i+1] - math.floor(stops[i+1])
-            lidx = math.ceil(stops[i]) #if i >0 else 0
-            ridx = math.floor(stops[i+1]) #if i < 2 * k else n - 1
-            mask[i] = (left_frac * kernel[lidx-1] if lidx>0 else 0.0) + \
-                np.sum(kernel[lidx:ridx]) + \
-                (right_frac * kernel[ridx+1] if ridx < n-1 else 0.0)
+        lidx = np.ceil(stops[:-1]).astype(int)
+        ridx = np.floor(stops[1:]).astype(int)
+        left_frac = lidx - stops[:-1]
+        right_frac = stops[1:] - ridx
+        # Zero padding stands in for the samples beyond either end of the kernel
+        padded = np.concatenate([[0.0], kernel, [0.0, 0.0]])
+        sums = np.cumsum(np.concatenate([[0.0], kernel]))
+        mask = left_frac * padded[lidx] + (sums[ridx] - sums[lidx]) + right_frac * padded[ridx + 2]
     else:
         # Interpolate results
         dx = 0.01
@@ -49,30 +58,57 @@ def get_mask(k, kernel=None):
         b = np.interp(np.linspace(0, m, k + 1), range(m+1), f[m:n])
         mask = np.hstack([np.flip(b), b[1:]]) * dy
 
-    mask = mask / np.linalg.norm(mask, 1)
+    return mask / np.linalg.norm(mask, 1)
+
 
+@lru_cache(maxsize=MASK_CACHE_SIZE)
+def _cached_mask(k):
+    mask = _build_mask(k, fokker_planck_kernel())
+    mask.flags.writeable = False
     return mask
 
 
-def get_mask_2d(k, kernel_1d=None):
-    m = get_mask(k, kernel_1d)
+def get_mask(k, kernel=None):
+    """
+    Return the 2k+1 element 1-d MIF mask
 
-    cols = np.array(list(range(k,-1,-1)) * (k + 1)).reshape((k+1,k+1))
-    rows = cols.transpose()
-    rad = np.sqrt(np.power(rows, 2) + np.power(cols,2))
+    Masks for the default kernel are cached, so are read-only.
+    """
+    assert isinstance(k, int), "Must provide integer-valued mask support width"
 
-    xs = sorted(set(rad.flatten()))
-    ys = np.interp(xs, range(k+1), m[k:])
+    if kernel is None:
+        return _cached_mask(k)
+    return _build_mask(k, kernel)
 
-    lookup = {x: y for (x, y) in zip(xs, ys)}
 
-    ul = np.vectorize(lambda x: lookup[x])(rad)
-    top = np.hstack([ul, np.fliplr(ul)[:,1:]])
-    kernel = np.vstack([top, np.flipud(top)[1:,:]])
+def _build_mask_2d(k, m):
+    # Interpolate the 1-d mask radially, at the distance of each cell from the center
+    offsets = np.arange(-k, k + 1)
+    rad = np.hypot(offsets[:,None], offsets[None,:])
+    kernel = np.interp(rad, range(k+1), m[k:])
 
     return kernel / np.sum(kernel)
 
 
+@lru_cache(maxsize=MASK_CACHE_SIZE)
+def _cached_mask_2d(k):
+    kernel = _build_mask_2d(k, get_mask(k))
+    kernel.flags.writeable = False
+    return kernel
+
+
+def get_mask_2d(k, kernel_1d=None):
+    """
+    Return the (2k+1)×(2k+1) radially symmetric MIF mask
+
+    Masks for the default kernel are cached, and shared by the numpy and torch paths,
+    so are read-only.
+    """
+    if kernel_1d is None:
+        return _cached_mask_2d(k)
+    return _build_mask_2d(k, get_mask(k, kernel_1d))
+
+
 def spherical_radius(signal, χ):
     assert len(signal.shape) == 2
     l_row = 2 * np.mean(np.floor(χ * signal.shape[0] / count_extrema(signal, axis=0)))
@@ -81,7 +117,7 @@ def spherical_radius(signal, χ):
     return int((l_row + l_col) / 2)
 
 
-def imf(f, kernel, τ, max_iters):
+def imf(f, kernel, τ, max_iters, backend='auto'):
     """
     Find the next Intrinsic Mode Function of an image
 
@@ -90,6 +126,8 @@ def imf(f, kernel, τ, max_iters):
         kernel (np.ndarray): A 2-d cross-correlation kernel
         τ (float): The termination error threshold
         max_iters (int): The largest number of permissible iterations
+        backend (str or function): How to apply the kernel; see
+            hyperspectral.decorrelation.convolution.smoother
 
     Returns an np.ndarray and the final termination error value
     """
@@ -103,8 +141,9 @@ def imf(f, kernel, τ, max_iters):
         rng = range(max_iters)
         use_tqdm = False
 
+    smooth = smoother(kernel, f.shape, backend)
     for i in rng:
-        mva = correlate2d(f, kernel, mode='same', boundary='symm')
+        mva = smooth(f)
         last = f
         f = f - mva
         err.append(np.linalg.norm(f - last, 2) / np.linalg.norm(last, 2))
@@ -168,22 +207,20 @@ def count_extrema_torch(m, axis):
 
 
 def count_extrema(signal, axis=None):
-    def extrema1(sig):
-        lead = sig[2:]
-        lag = sig[:-2]
-        sig = sig[1:-1]
-
-        return np.sum(
-            np.logical_or(
-                np.logical_and(sig < lead, sig < lag),
-                np.logical_and(sig > lead, sig > lag)
-            )
-        )
+    """
+    Count the strict local extrema along an axis of an array
 
+    Returns the count for each 1-d slice along axis (with that axis removed), or for
+    the flattened array if axis is None
+    """
     if axis is None:
-        return extrema1(signal.flatten())
-    else:
-        return np.apply_along_axis(extrema1, axis, signal)
+        signal, axis = np.ravel(signal), 0
+    d = np.moveaxis(np.diff(signal, axis=axis), axis, 0)
+    rising = d > 0
+    falling = d < 0
+    # An interior sample is a strict extremum when the differences on either side of
+    # it have opposite signs
+    return np.sum((rising[:-1] & falling[1:]) | (falling[:-1] & rising[1:]), axis=0)
 
 
 # def count_extrema(m, axis):
@@ -213,8 +250,8 @@ def terminated_torch(m):
 
 
 def terminated(m):
-    return True if np.logical_or(np.min(count_extrema_torch(m, 0)) <= 1,
-                                 np.min(count_extrema_torch(m, 1)) <= 1) else False
+    return True if np.logical_or(np.min(count_extrema(m, 0)) <= 1,
+                                 np.min(count_extrema(m, 1)) <= 1) else False
 
 
 def spherical_radius_torch(signal, χ):
@@ -264,7 +301,108 @@ def mif_torch(dev, signal, χ=1.6, τ=0.001, max_iters=1000, max_imfs=25):
     return imfs, f
 
 
-def mif(signal, χ=1.6, τ=0.001, max_iters=1000, max_imfs=25):
+def imf_torch_batched(base, kernel, τ=0.001, max_iters=1000):
+    """
+    Sift a batch of images with the same kernel, each until its own convergence
+
+    Each image of the batch follows the same iteration and stopping rule as it would
+    in imf_torch, but the images still being sifted are smoothed together by a single
+    conv2d call per iteration.
+
+    Arguments:
+        base (torch.Tensor): A B×1×H×W batch of images, values have mean of zero
+        kernel (torch.Tensor): A 1×1×(2k+1)×(2k+1) cross-correlation kernel
+        τ (float): The termination error threshold
+        max_iters (int): The largest number of permissible iterations
+
+    Returns the B×1×H×W batch of IMFs
+    """
+    _,_,w,_ = kernel.shape
+    k = int((w - 1) / 2)
+
+    base = base.clone()
+    best = torch.full((base.shape[0],), math.inf, dtype=base.dtype, device=base.device)
+    active = torch.arange(base.shape[0], device=base.device)
+
+    for i in range(max_iters):
+        last = base[active]
+        padded = f.pad(last, (k,k,k,k), mode='reflect')
+        smoothed = f.conv2d(padded, kernel, stride=1)
+        sifted = last - smoothed
+        base[active] = sifted
+        # The same (spectral) norm of the same rounded difference as imf_torch,
+        # computed for every image at once
+        err = (torch.linalg.matrix_norm((sifted - last)[:,0,:,:], ord=2)
+               / torch.linalg.matrix_norm(last[:,0,:,:], ord=2))
+
+        # As in imf_torch, stop on convergence or as soon as the error grows
+        done = torch.logical_or(err < τ, err > best[active])
+        best[active] = torch.minimum(best[active], err)
+        active = active[~done]
+        if len(active) == 0:
+            break
+
+    return base
+
+
+def mif_torch_batched(dev, signals, χ=1.6, τ=0.001, max_iters=1000, max_imfs=25):
+    """
+    Multidimensional iterative filter applied to a stack of images at once
+
+    Each image follows the same sequence of IMFs as it would in mif_torch, but at
+    every step the images whose spherical radius is k are sifted together as one
+    B×1×H×W batch, so a b-band cube costs one conv2d per iteration per distinct k
+    rather than one per band.
+
+    On the CPU the residuals match mif_torch exactly. Other devices may pick a
+    different convolution algorithm for a batch than for a single image; the
+    rounding differences can then move an IMF's stopping iteration, after which
+    that band's later IMFs (and radii) differ too, so use mif_torch when exact
+    agreement on such a device matters.
+
+    Arguments:
+        dev: Torch device
+        signals (np.array): A b×H×W stack of images
+        Other arguments are as for mif
+
+    Returns the b×H×W residuals, as a torch tensor on dev
+    """
+    b, h, w = signals.shape
+    centered = signals - np.mean(signals, axis=(1, 2), keepdims=True)
+    residual = torch.from_numpy(np.ascontiguousarray(centered[:,None,:,:])).to(dev)
+    active = list(range(b))
+
+    try:
+        from tqdm.autonotebook import tqdm
+        rng = tqdm(range(max_imfs), leave=False)
+    except:
+        rng = range(max_imfs)
+
+    for i in rng:
+        groups = {}
+        for j in active:
+            k = spherical_radius_torch(residual[j,0,:,:], χ)
+            if k < min(h, w):
+                groups.setdefault(k, []).append(j)
+
+        active = []
+        for k, group in groups.items():
+            kernel = torch.from_numpy(get_mask_2d(k).astype(centered.dtype)).to(dev)
+            idx = torch.tensor(group, device=dev)
+            batch = residual[idx]
+            residual[idx] = batch - imf_torch_batched(batch, kernel[None,None,:,:], τ, max_iters)
+            active.extend(j for j in group if not terminated_torch(residual[j,0,:,:]))
+        if len(active) == 0:
+            break
+
+    return residual[:,0,:,:]
+
+
+def _mif_residual(signal, χ, τ, max_iters, max_imfs, backend):
+    return mif(signal, χ, τ, max_iters, max_imfs, backend)[1]
+
+
+def mif(signal, χ=1.6, τ=0.001, max_iters=1000, max_imfs=25, backend='auto'):
     """
     Multidimensional iterative filter
 
@@ -274,6 +412,8 @@ def mif(signal, χ=1.6, τ=0.001, max_iters=1000, max_imfs=25):
         τ: The error threshhold for IMF generation
         max_iters: Maximum allowable iterations for IMF generation
         max_imfs: Maximum allowable number of IMFs to generate
+        backend: Convolution backend for the sifting iterations; see
+            hyperspectral.decorrelation.convolution.smoother
 
     References:
         Cicone, A., & Zhou, H. (2017).  Multidimensional iterative filtering method
@@ -286,16 +426,18 @@ def mif(signal, χ=1.6, τ=0.001, max_iters=1000, max_imfs=25):
     try:
         from tqdm.autonotebook import tqdm
         rng = tqdm(range(max_imfs))
+        use_tqdm = True
     except:
         rng = range(max_imfs)
+        use_tqdm = False
 
     for i in rng:
         k = spherical_radius(f, χ)
         kernel = get_mask_2d(k)
-        imf_n, _ = imf(f, kernel, τ, max_iters)
+        imf_n, _ = imf(f, kernel, τ, max_iters, backend)
         imfs.append(imf_n)
         f = f - imf_n
-        if terminated(f[0,0,:,:]):
+        if terminated(f):
             if use_tqdm:
                 rng.update(max_imfs)
                 rng.close()
@@ -304,10 +446,14 @@ def mif(signal, χ=1.6, τ=0.001, max_iters=1000, max_imfs=25):
     return imfs, f
 
 
-def mif_decorrelate(img, χ=1.6, τ=0.001, max_iters=1000, max_imfs=25, dev=None):
+def mif_decorrelate(img, χ=1.6, τ=0.001, max_iters=1000, max_imfs=25, dev=None, backend='auto',
+                    batched=True, processes=None, threads=None):
     """
     Decorrelate an image with MIF
 
+    On the torch path the bands are decomposed together by mif_torch_batched unless
+    batched is False; on the numpy path bands may be spread over a pool of processes.
+
     Arguments:
         img (np.array or torch.tensor): The image to decorrelate; if using torch, also set dev
         χ: Spherical radius mutiplier
@@ -315,6 +461,12 @@ def mif_decorrelate(img, χ=1.6, τ=0.001, max_iters=1000, max_imfs=25, dev=None
         max_iters: Maximum allowable iterations for IMF generation
         max_imfs: Maximum allowable number of IMFs to generate
         dev: Torch device, if applicable
+        backend: Convolution backend for the numpy path; see
+            hyperspectral.decorrelation.convolution.smoother
+        batched (bool): Whether to sift all bands in one batch on the torch path
+        processes (optional int): Number of worker processes for the numpy path; bands
+            are processed one at a time in this process if not given
+        threads (optional int): Number of threads for torch to use on the CPU
 
     References:
         Cicone, A., Liu, J., & Zhou, H. (2016). Hyperspectral chemical plume
@@ -322,22 +474,44 @@ def mif_decorrelate(img, χ=1.6, τ=0.001, max_iters=1000, max_imfs=25, dev=None
         decomposition. Philosophical Transactions of the Royal Society A:
         Mathematical, Physical and Engineering Sciences, 374(2065), 20150196.
     """
+    use_torch = torch_available and dev is not None
+    if use_torch and threads is not None:
+        # The thread count is global to torch, so it is restored afterwards
+        previous = torch.get_num_threads()
+        torch.set_num_threads(threads)
+        try:
+            return mif_decorrelate(img, χ, τ, max_iters, max_imfs, dev, backend, batched,
+                                   processes)
+        finally:
+            torch.set_num_threads(previous)
+
+    if use_torch and batched:
+        resid = mif_torch_batched(dev, np.asarray(img), χ, τ, max_iters, max_imfs)
+        return img - resid.detach().cpu().numpy()
+
+    if not use_torch and processes is not None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        do_mif = partial(_mif_residual, χ=χ, τ=τ, max_iters=max_iters, max_imfs=max_imfs,
+                         backend=backend)
+        with ProcessPoolExecutor(processes) as pool:
+            resids = list(pool.map(do_mif, [img[i,:,:] for i in range(img.shape[0])]))
+        return img - np.array(resids)
+
     rng = range(img.shape[0])
     try:
         from tqdm.autonotebook import tqdm
         rng = tqdm(rng)
     except: pass
 
-    if torch_available and dev is not None:
+    if use_torch:
         do_mif = partial(mif_torch, dev)
-        use_torch = True
     else:
-        do_mif = mif
-        use_torch = False
+        do_mif = partial(mif, backend=backend)
 
     decorrelated = []
     for i in rng:
         _, r = do_mif(img[i,:,:], χ, τ, max_iters, max_imfs)
-        resid = r.detach().cpu().numpy() if use_torch else r
-        decorrelated.append(img[i,:,:] - resid[0,0,:,:])
+        resid = r.detach().cpu().numpy()[0,0,:,:] if use_torch else r
+        decorrelated.append(img[i,:,:] - resid)
     return np.array(decorrelated)
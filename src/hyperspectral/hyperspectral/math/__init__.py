@@ -1,2 +1,5 @@
 from .rpca import *
 from .covariance import *
+from .dispersion import *
+from .sampling import *
+from .whitening import *
@@ -1,21 +1,222 @@
 import math
 
 import numpy as np
+import scipy.linalg
+import scipy.optimize
 
-def shrinkage_covariance(data, regularizer='ridge', approx='mean-mahalanobis', tol=1e-6):
+
+class CovarianceAccumulator:
+    """
+    Streaming estimate of the mean and covariance of hyperspectral pixels
+
+    Pixels are ingested a block at a time with update(), using the pairwise (Chan et
+    al.) generalization of Welford's algorithm: each block is centered on its own mean
+    before its scatter matrix is formed, which keeps the accumulation numerically
+    stable for data with large means.  Accumulators built over separate windows or
+    processes can be combined with merge().  Memory use is O(b²) for b bands,
+    regardless of the number of pixels seen.
+
+    Arguments:
+        bands (int): The number of spectral bands
+        nodata (optional float): Pixels with this value in any band are ignored
+
+    References:
+
+      Chan, T. F., Golub, G. H., & LeVeque, R. J. (1983). Algorithms for computing the
+      sample variance: Analysis and recommendations. The American Statistician,
+      37(3), 242-247.
+    """
+    def __init__(self, bands, nodata=None):
+        self.bands = bands
+        self.nodata = nodata
+        self.count = 0
+        self.mean = np.zeros(bands)
+        self.scatter = np.zeros((bands, bands))
+
+    def update(self, block, mask=None):
+        """
+        Fold a block of pixels into the running statistics
+
+        Pixels containing NaN, or the nodata value in any band, are skipped.
+
+        Arguments:
+            block (np.array): An r×c×b image window or an n×b matrix of pixels
+            mask (optional np.array): An r×c (or n-element) boolean array that is True
+                for pixels to include
+
+        Returns this accumulator
+        """
+        assert block.shape[-1] == self.bands, "Block must have {} bands".format(self.bands)
+        X = block.reshape((-1, self.bands))
+        valid = ~np.any(np.isnan(X), axis=1)
+        if self.nodata is not None:
+            valid &= ~np.any(X == self.nodata, axis=1)
+        if mask is not None:
+            valid &= mask.reshape(-1)
+        X = X[valid].astype(np.float64)
+        m = X.shape[0]
+        if m == 0:
+            return self
+
+        μ = np.mean(X, axis=0)
+        X -= μ
+        return self._combine(m, μ, np.matmul(X.transpose(), X))
+
+    def merge(self, other):
+        """
+        Fold the statistics of another accumulator into this one
+
+        Returns this accumulator
+        """
+        assert other.bands == self.bands, "Accumulators must have matching band counts"
+        if other.count == 0:
+            return self
+        return self._combine(other.count, other.mean, other.scatter)
+
+    def _combine(self, m, μ, scatter):
+        n = self.count + m
+        δ = μ - self.mean
+        self.scatter += scatter + np.outer(δ, δ) * (self.count * m / n)
+        self.mean += δ * (m / n)
+        self.count = n
+        return self
+
+    @property
+    def covariance(self):
+        """The unbiased b×b sample covariance, as from np.cov"""
+        assert self.count > 1, "At least two pixels are required for a covariance"
+        return self.scatter / (self.count - 1)
+
+    def zca_whitening_matrix(self, ε=1e-6):
+        """
+        Construct a ZCA whitening matrix for the accumulated pixels
+
+        Returns the b×b whitening operator and the b-element mean; see
+        hyperspectral.math.zca_whitening_matrix
+        """
+        w, v = np.linalg.eigh(self.covariance)
+        W = np.matmul(v * (1 / np.sqrt(ε + w)), v.transpose())
+        return W, self.mean.copy()
+
+
+def _shrinkage_terms(S, regularizer, vectors=False):
+    """
+    Factor a sample covariance for evaluating shrinkage likelihoods
+
+    For the ridge regularizer T = cI and the eigenvectors V of S are orthonormal; for
+    cov_diag T = diag(S), c = 1, and V solves the generalized problem SV = TVΛ with
+    VᵀTV = I.  Either way, (aS + αT)⁻¹ = V(aΛ + αcI)⁻¹Vᵀ and
+    log det(aS + αT) = log det T' + Σ log(aλ + αc), with T' = I or T respectively.
+
+    Returns T, c, the eigenvalues λ, the eigenvectors V (or None) and log det T'
+    """
+    p = S.shape[0]
+    if regularizer=='ridge':
+        c = np.trace(S) / p
+        T = c * np.eye(p)
+        decomposition = scipy.linalg.eigh(S, eigvals_only=not vectors)
+        log_det_T = 0.0
+    elif regularizer=='cov_diag':
+        d = np.diag(S)
+        T = np.diag(d)
+        c = 1.0
+        decomposition = scipy.linalg.eigh(S, T, eigvals_only=not vectors)
+        log_det_T = np.sum(np.log(d))
+    else:
+        raise ValueError('Unrecognized regularizer: {}'.format(regularizer))
+
+    λ, V = decomposition if vectors else (decomposition, None)
+    return T, c, λ, V, log_det_T
+
+
+def _looc_likelihood(αs, centered, c, λ, V, log_det_T, chunk_size):
+    """Mean leave-one-out negative log likelihood for each α; see looc_likelihood"""
+    p, n = centered.shape
+    # Leaving out sample k gives Cₖ = (1-α)Sₖ + αT = A - γx̅ₖx̅ₖᵀ, with the residual
+    # of xₖ from the mean of the others equal to n/(n-1)·x̅ₖ; Sherman–Morrison reduces
+    # everything to rₖ = x̅ₖᵀA⁻¹x̅ₖ, which is a weighted sum of squared coordinates of
+    # x̅ₖ in the eigenbasis
+    a = (1 - αs) * (n - 1) / (n - 2)
+    γ = (1 - αs) * n / ((n - 1) * (n - 2))
+    g = a[:,None] * λ[None,:] + (αs * c)[:,None]
+    ginv = 1 / g
+    scale = (n / (n - 1)) ** 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total = np.zeros(len(αs))
+        for start in range(0, n, chunk_size):
+            Z = np.square(np.matmul(V.transpose(), centered[:,start:(start + chunk_size)]))
+            r = np.matmul(ginv, Z)
+            q = 1 - γ[:,None] * r
+            total += np.sum(np.log(q) + scale * r / q, axis=1)
+
+        L = (p * math.log(2 * math.pi) + log_det_T + np.sum(np.log(g), axis=1)
+             + total / n) / 2
+    return np.where(np.isnan(L), np.inf, L)
+
+
+def looc_likelihood(data, αs, regularizer='ridge', chunk_size=4096):
+    """
+    Leave-one-out negative log likelihood of shrinkage covariance estimates
+
+    Evaluates the Hoffbeck–Landgrebe leave-one-out covariance (LOOC) criterion for a
+    vector of shrinkage values at once, from one eigendecomposition of the sample
+    covariance.  Each sample is scored against the mean and shrunken covariance of
+    the other n - 1 samples, (1-α)Sₖ + αT, where the target T is computed once from
+    all samples.  Work is O(p²n) per evaluation and memory is O(p·chunk_size).
+
+    Arguments:
+        data (np.array): A p×n matrix describing the sampled values (p dims, n samples)
+        αs (np.array): Shrinkage values at which to evaluate the likelihood
+        regularizer (str): Either 'ridge' or 'cov_diag'
+        chunk_size (int): The number of samples processed at once
+
+    Returns the mean negative log likelihood for each α
+
+    References:
+
+    Hoffbeck, J. P., & Landgrebe, D. A. (1996). Covariance matrix estimation and
+    classification with limited training data. IEEE Transactions on Pattern Analysis
+    and Machine Intelligence, 18(7), 763-767.
+    """
+    assert data.shape[1] > 2, "At least three samples are required for leave-one-out estimates"
+    centered = data - np.mean(data, axis=1)[:,None]
+    _, c, λ, V, log_det_T = _shrinkage_terms(np.cov(data), regularizer, vectors=True)
+    return _looc_likelihood(np.asarray(αs, dtype=np.float64), centered, c, λ, V, log_det_T,
+                            chunk_size)
+
+
+def shrinkage_covariance(data, regularizer='ridge', approx='mean-mahalanobis', tol=1e-6,
+                         search='grid', n_samples=None, chunk_size=4096):
     """
     Compute an approximation to the covariance matrix.
 
     Computes a shrinkage estimator of the covariance matrix.  Avoids problems due to
     overfitting.
 
+    The approximate likelihood is evaluated for a whole vector of shrinkage values α
+    at once from a single eigendecomposition: for the ridge regularizer, the
+    eigenvalues of the sample covariance S give the determinant and trace terms in
+    closed form for every α, and for 'cov_diag' the same holds for the eigenvalues of
+    the generalized problem Sv = μ·diag(S)v.  The 'hl' approximation additionally
+    projects each sample onto the eigenvectors; see looc_likelihood.
+
     Arguments:
-        data (np.array): A p×n matrix describing the sampled values (p dims, n samples)
+        data (np.array or CovarianceAccumulator): A p×n matrix describing the sampled
+            values (p dims, n samples), accumulated statistics of the samples, or (if
+            n_samples is given) a p×p sample covariance matrix; the 'hl' approximation
+            requires the samples themselves
         regularizer (str): The name of the regularization strategy; either 'ridge' or
                            'cov_diag'
         approx (str): The log likelihood approximation to use; either 'mean-mahalanobis',
                       'hl' (Hoffbeck & Landgrebe) or None (defaults to 'hl')
         tol (float): Tolerance for likelihood optimization
+        search (str): The strategy for optimizing α; either 'grid' (a coarse-to-fine
+                      grid search) or 'brent' (bounded scalar minimization)
+        n_samples (optional int): The number of samples behind data when data is a
+                                  covariance matrix
+        chunk_size (int): The number of samples processed at once by the 'hl'
+                          approximation; see looc_likelihood
 
     References:
 
@@ -24,53 +225,61 @@ def shrinkage_covariance(data, regularizer='ridge', approx='mean-mahalanobis', t
     Photonics.
     """
 
-    p, n = data.shape
-    μ = np.mean(data, axis=1)
-    S = np.cov(data)
+    if isinstance(data, CovarianceAccumulator):
+        p, n = data.bands, data.count
+        S = data.covariance
+    elif n_samples is not None:
+        S = np.asarray(data)
+        p, n = S.shape[0], n_samples
+    else:
+        p, n = data.shape
+        S = np.cov(data)
 
-    # x̅ = data - np.repeat(μ, n).reshape(p,n)
-    # def Sk(k):
-    #     x̅k = x̅[:,k]
-    #     n1 = n - 1
-    #     return n1 / (n1 - 1) * S - n / ((n - 1) * (n1 - 1)) * np.outer(x̅k, x̅k)
+    hl = not approx or approx=='hl'
+    if hl:
+        assert n_samples is None and not isinstance(data, CovarianceAccumulator), \
+            "The Hoffbeck/Landgrebe approximation requires the samples"
+        centered = data - np.mean(data, axis=1)[:,None]
 
-    if regularizer=='ridge':
-        T = np.trace(S) / p * np.eye(p)
-    elif regularizer=='cov_diag':
-        T = np.diag(np.diag(S))
-    else:
-        raise ValueError('Unrecognized regularizer: {}'.format(regularizer))
+    T, c, λ, V, log_det_T = _shrinkage_terms(S, regularizer, vectors=hl)
 
-    def LMM(α):
-        β = (1 - α) / (n - 1)
-        Gα = n * β * S + α * T
-        Ginv = np.linalg.inv(Gα)
-        detG = np.linalg.det(Gα)
-        r0 = np.trace(np.dot(Ginv, S))
-        return (p * math.log(2 * math.pi) + math.log(detG)
-                + math.log(1 - β * r0) + r0 / (1 - β * r0)) / 2
+    def LMM(αs):
+        β = (1 - αs) / (n - 1)
+        g = n * β[:,None] * λ[None,:] + (αs * c)[:,None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r0 = np.sum(λ[None,:] / g, axis=1)
+            L = (p * math.log(2 * math.pi) + log_det_T + np.sum(np.log(g), axis=1)
+                 + np.log(1 - β * r0) + r0 / (1 - β * r0)) / 2
+        return np.where(np.isnan(L), np.inf, L)
 
-    def LHL(α):
-        # TODO: implement Hoffbeck/Landgrebe approximation
-        raise NotImplementedError('Hoffbeck/Landgrebe likelihood approximation not implemented')
+    def LHL(αs):
+        return _looc_likelihood(αs, centered, c, λ, V, log_det_T, chunk_size)
 
-    if not approx or approx=='hl':
+    if hl:
         approxL = LHL
     elif approx=='mean-mahalanobis':
         approxL = LMM
     else:
         raise ValueError('Approximation strategy must be \'hl\', \'mean-mahalanobis\' or None')
 
-    step = 0.1
-    lo = 0.0
-    hi = 1.0
-    while step > tol:
-        αs = np.arange(lo, hi + step, step)
-        likelihoods = np.array(list(map(approxL, αs)))
-        i = np.argmin(likelihoods)
-        best = αs[i]
-        lo = αs[max(i-1,0)]
-        hi = αs[min(i+1,len(αs))]
-        step = step / 10
+    if search=='grid':
+        step = 0.1
+        lo = 0.0
+        hi = 1.0
+        while step > tol:
+            αs = np.clip(np.arange(lo, hi + step / 2, step), 0.0, 1.0)
+            likelihoods = approxL(αs)
+            i = np.argmin(likelihoods)
+            best = αs[i]
+            lo = αs[max(i-1,0)]
+            hi = αs[min(i+1,len(αs)-1)]
+            step = step / 10
+    elif search=='brent':
+        result = scipy.optimize.minimize_scalar(lambda α: approxL(np.array([α]))[0],
+                                                bounds=(0.0, 1.0), method='bounded',
+                                                options={'xatol': tol})
+        best = result.x
+    else:
+        raise ValueError('Search strategy must be \'grid\' or \'brent\'')
 
     return (1 - best) * S + best * T
@@ -0,0 +1,256 @@
+import numpy as np
+
+
+# Ratios of the Gaussian consistency constants of Qn and Sn to that of the MAD, so that
+# the scorers below estimate the same quantity as mad for normally distributed data
+QN_TO_MAD = 2.2219 / 1.4826
+SN_TO_MAD = 1.1926 / 1.4826
+
+
+def _as_rows(M):
+    """View the columns of a matrix (or a single vector) as the rows of a matrix"""
+    if len(M.shape) == 1:
+        return M.reshape((1, -1)), True
+    return M.transpose(), False
+
+
+def _result(scores, squeeze):
+    return scores[0] if squeeze else scores
+
+
+def _median_rows(buf):
+    """Row-wise median of a g×n matrix; partitions the matrix in place"""
+    n = buf.shape[1]
+    half = n // 2
+    if n % 2 == 1:
+        buf.partition(half, axis=1)
+        return buf[:,half].copy()
+    else:
+        buf.partition([half - 1, half], axis=1)
+        return (buf[:,half - 1] + buf[:,half]) / 2
+
+
+def _histogram_rows(rows, bins):
+    """
+    Per-row histograms of a g×n matrix over the range of each row
+
+    Constant rows are given unit-width bins, so that every sample falls in the first;
+    callers should special-case them using the returned flags.
+
+    Returns the lower ends, bin widths, g×bins counts, and a flag per constant row
+    """
+    g, n = rows.shape
+    lo = np.min(rows, axis=1)
+    width = (np.max(rows, axis=1) - lo) / bins
+    constant = width == 0
+    width[constant] = 1.0
+
+    scaled = rows - lo[:,None]
+    scaled /= width[:,None]
+    idx = scaled.astype(np.intp)
+    np.minimum(idx, bins - 1, out=idx)
+    idx += (np.arange(g) * bins)[:,None]
+    counts = np.bincount(idx.ravel(), minlength=g * bins).reshape((g, bins))
+
+    return lo, width, counts, constant
+
+
+def _histogram_cdf(v, lo, width, counts, below):
+    """Number of samples in each row no larger than v, interpolating within bins"""
+    bins = counts.shape[1]
+    u = np.clip((v - lo) / width, 0, bins)
+    b = np.minimum(u.astype(np.intp), bins - 1)
+    r = np.arange(len(b))
+    return below[r,b] + counts[r,b] * (u - b)
+
+
+class PartitionMAD:
+    """
+    Median absolute deviation via in-place partial sorts
+
+    Gives exactly the same scores as mad, but computes both medians with a
+    quickselect over contiguous rows of a scratch buffer that is reused from call to
+    call, instead of allocating fresh copies for each np.median.  This matters when
+    the scorer is called thousands of times on same-sized inputs, as in rpca_grid.
+
+    Accuracy: exact
+    """
+    def __init__(self):
+        self.buf = None
+
+    def scratch(self, shape):
+        if self.buf is None or self.buf.shape != shape:
+            self.buf = np.empty(shape)
+        return self.buf
+
+    def __call__(self, M):
+        rows, squeeze = _as_rows(M)
+        buf = self.scratch(rows.shape)
+
+        np.copyto(buf, rows)
+        med = _median_rows(buf)
+        np.subtract(rows, med[:,None], out=buf)
+        np.abs(buf, out=buf)
+        return _result(_median_rows(buf), squeeze)
+
+
+class SubsampleMAD:
+    """
+    Median absolute deviation computed on a fixed random subsample of the rows
+
+    The subsample is drawn once for each input length and reused for every later call,
+    so all candidates scored by rpca_grid are compared on the same samples.  Inputs
+    with no more than `size` rows are scored exactly.
+
+    Accuracy: for Gaussian data the relative standard error of the sample MAD is about
+    1.17/√size (≈1.2% for size=10⁴), independent of the full sample count.
+
+    Arguments:
+        size (int): Number of samples to score
+        seed (int): Seed for the subsample selection
+    """
+    def __init__(self, size=10000, seed=0):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.subsamples = {}
+        self.exact = PartitionMAD()
+
+    def select(self, rows):
+        """Restrict the rows of a g×n matrix to the subsample for length n"""
+        n = rows.shape[1]
+        if n <= self.size:
+            return rows
+        if n not in self.subsamples:
+            self.subsamples[n] = np.sort(self.rng.choice(n, self.size, replace=False))
+        return rows[:,self.subsamples[n]]
+
+    def __call__(self, M):
+        rows, squeeze = _as_rows(M)
+        return _result(self.exact(self.select(rows).transpose()), squeeze)
+
+
+class HistogramMAD:
+    """
+    Median absolute deviation estimated from per-column histograms
+
+    Both medians are read off a `bins`-bucket histogram of each column, built in a
+    single vectorized pass with np.bincount, so the cost is linear in the number of
+    samples and the data are only read once.
+
+    Accuracy: the absolute error is bounded by 2·(max - min)/bins for each column, and
+    constant columns score exactly 0.
+    The bound is loose for heavy-tailed data, where the range is large relative to the
+    MAD; prefer SubsampleMAD there.
+
+    Arguments:
+        bins (int): Number of histogram buckets
+        iters (int): Number of bisection steps for the MAD; each halves the search
+            interval, which starts at the range of the column
+    """
+    def __init__(self, bins=4096, iters=48):
+        self.bins = bins
+        self.iters = iters
+
+    def __call__(self, M):
+        rows, squeeze = _as_rows(M)
+        g, n = rows.shape
+        lo, width, counts, constant = _histogram_rows(rows, self.bins)
+        cum = np.cumsum(counts, axis=1)
+        below = cum - counts
+
+        # Median: interpolate within the first bin reaching half the samples
+        b = np.argmax(cum >= n / 2, axis=1)
+        r = np.arange(g)
+        med = lo + width * (b + (n / 2 - below[r,b]) / counts[r,b])
+
+        # MAD: the t for which half the samples fall in [med - t, med + t], found by
+        # bisection on the interpolated CDF, so no second pass over the data is needed
+        t_lo = np.zeros(g)
+        t_hi = width * self.bins
+        for _ in range(self.iters):
+            t = (t_lo + t_hi) / 2
+            inside = (_histogram_cdf(med + t, lo, width, counts, below)
+                      - _histogram_cdf(med - t, lo, width, counts, below))
+            short = inside < n / 2
+            t_lo = np.where(short, t, t_lo)
+            t_hi = np.where(short, t_hi, t)
+
+        # Constant columns have no spread
+        mad = (t_lo + t_hi) / 2
+        mad[constant] = 0
+        return _result(mad, squeeze)
+
+
+class Qn:
+    """
+    Rousseeuw–Croux Qn scale estimator on a fixed random subsample
+
+    Qn is the k-th order statistic of the pairwise distances |xᵢ - xⱼ|, i < j, with
+    k = C(h, 2) and h = ⌊m/2⌋ + 1.  It is computed exactly on a subsample of m = `size`
+    rows, with O(m²) work per column, and scaled to agree with mad for Gaussian data.
+
+    Accuracy: Qn is a different estimator from the MAD; for Gaussian data it targets
+    the same value, with 82% efficiency (MAD: 37%), giving a relative standard error
+    of about 0.78/√size (≈3.5% for size=500).
+
+    Arguments:
+        size (int): Number of samples to score
+        seed (int): Seed for the subsample selection
+
+    References:
+
+      Rousseeuw, P. J., & Croux, C. (1993). Alternatives to the median absolute
+      deviation. Journal of the American Statistical Association, 88(424), 1273-1283.
+    """
+    def __init__(self, size=500, seed=0):
+        self.sub = SubsampleMAD(size, seed)
+
+    def __call__(self, M):
+        rows, squeeze = _as_rows(M)
+        rows = self.sub.select(rows)
+
+        m = rows.shape[1]
+        h = m // 2 + 1
+        k = h * (h - 1) // 2 - 1
+        # In the full m×m distance matrix the m zeros of the diagonal come first and
+        # every pairwise distance appears twice, so the k-th pair sits at m + 2k
+        kth = m + 2 * k
+        scores = np.empty(rows.shape[0])
+        for c in range(rows.shape[0]):
+            dists = np.abs(rows[c,:,None] - rows[c,None,:]).ravel()
+            scores[c] = np.partition(dists, kth)[kth]
+        return _result(QN_TO_MAD * scores, squeeze)
+
+
+class Sn:
+    """
+    Rousseeuw–Croux Sn scale estimator on a fixed random subsample
+
+    Sn = medᵢ medⱼ |xᵢ - xⱼ| is computed exactly on a subsample of m = `size` rows,
+    with O(m²) work per column, and scaled to agree with mad for Gaussian data.
+
+    Accuracy: Sn is a different estimator from the MAD; for Gaussian data it targets
+    the same value, with 58% efficiency (MAD: 37%), giving a relative standard error
+    of about 0.93/√size (≈4.2% for size=500).
+
+    Arguments:
+        size (int): Number of samples to score
+        seed (int): Seed for the subsample selection
+
+    References:
+
+      Rousseeuw, P. J., & Croux, C. (1993). Alternatives to the median absolute
+      deviation. Journal of the American Statistical Association, 88(424), 1273-1283.
+    """
+    def __init__(self, size=500, seed=0):
+        self.sub = SubsampleMAD(size, seed)
+
+    def __call__(self, M):
+        rows, squeeze = _as_rows(M)
+        rows = self.sub.select(rows)
+
+        scores = np.empty(rows.shape[0])
+        for c in range(rows.shape[0]):
+            dists = np.abs(rows[c,:,None] - rows[c,None,:])
+            scores[c] = np.median(_median_rows(dists))
+        return _result(SN_TO_MAD * scores, squeeze)
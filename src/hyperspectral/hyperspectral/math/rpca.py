@@ -3,14 +3,17 @@ import math
 import matplotlib.pyplot as plt
 import numpy as np
 import scipy
-from tqdm.autonotebook import tqdm
+import scipy.linalg
+
+from hyperspectral.math.covariance import CovarianceAccumulator
+from hyperspectral.math.whitening import whitening_operator
 
 
 def mad(M):
     return np.median(np.abs(M - np.median(M, axis=0)), axis=0)
 
 
-def rpca_grid(data, max_dim=None, n_c=5, n_g=11, S=mad, sufficient=None):
+def rpca_grid(data, max_dim=None, n_c=5, n_g=11, S=mad, sufficient=None, progress=None):
     """
     Produce a reduced basis for provided data using robust PCA
 
@@ -20,6 +23,13 @@ def rpca_grid(data, max_dim=None, n_c=5, n_g=11, S=mad, sufficient=None):
     absolute deviation.  This is in the class of projection pursuit algorithms.  See
     references for details.
 
+    Every candidate direction on the search grid is a combination cos(θ)â + sin(θ)e(j)
+    of the current estimate â and a coordinate vector e(j), so the projection of the
+    data onto all n_g candidates is a linear combination of the two projections Xᵀâ
+    and Xᵀe(j).  Those projections are kept in a preallocated buffer and the
+    candidates are scored with a single 2-column matrix product per coordinate, rather
+    than forming and projecting onto a p×n_g candidate matrix.
+
     Arguments:
         data (np.array): a p×n matrix giving n, p-dimensional samples as column vectors
         max_dim (optional int): The largest number of basis vectors to compute
@@ -30,10 +40,13 @@ def rpca_grid(data, max_dim=None, n_c=5, n_g=11, S=mad, sufficient=None):
             argument matrix is the projection of data onto a candidate direction;
             this function returns a row vector with each position scoring the
             data dispersion of each column of the argument; see mad above for an
-            illustration
+            illustration, and hyperspectral.math.dispersion for faster scorers
         sufficient (np.array ⇒ bool): An optional function to determine if the
             basis so far is sufficient for the user's needs; argument is matrix
             of column vectors in the current basis
+        progress (optional (int, int, float) ⇒ None): An optional function called
+            at the end of each refinement pass with the index of the basis vector
+            being computed, the index of the pass, and the best score so far
 
     Returns:
         p × d matrix of basis columns; d is less than or equal max_dim
@@ -52,38 +65,51 @@ def rpca_grid(data, max_dim=None, n_c=5, n_g=11, S=mad, sufficient=None):
     p, n = data.shape
     max_dim = max_dim if max_dim else p
 
-    # Order samples so that S(e(i)) >= S(e(j)) when i < j
+    # Order samples so that S(e(i)) >= S(e(j)) when i < j (ties broken by larger index)
     row_scores = np.array([S(data[i,:]) for i in range(p)])
-    var_order = [y[1] for y in sorted([(x[1], x[0]) for x in enumerate(row_scores)], reverse=True)]
-    rev_order = [y[1] for y in sorted([(x[1], x[0]) for x in enumerate(var_order)])]
-    Xt = data[var_order,:].transpose()
+    var_order = np.lexsort((np.arange(p), row_scores))[::-1]
+    rev_order = np.argsort(var_order)
+
+    # Working copy of the (reordered) data, deflated in place after each basis vector
+    X = np.array(data[var_order,:], dtype=np.float64)
+    ger = scipy.linalg.blas.get_blas_funcs('ger', (X,))
+
+    grid = [np.linspace(-math.pi/math.pow(2, i+1), math.pi/math.pow(2, i+1), n_g)
+            for i in range(n_c)]
+    cos = [np.cos(th) for th in grid]
+    sin = [np.sin(th) for th in grid]
+    cos_sin = [2 * c * s for (c, s) in zip(cos, sin)]
 
-    def e(j):
-        x = np.zeros((p,1))
-        x[j] = 1.0
-        return x
+    pair = np.empty((2, n))      # Rows hold Xᵀâ and Xᵀe(j)
+    proj = np.empty((n_g, n))    # Rows hold the projections onto each candidate
+    weights = np.empty((n_g, 2))
 
     A = np.zeros((p, max_dim))
-    for k in tqdm(range(max_dim), desc="Vector"):
-        for i in tqdm(range(n_c), leave=False, desc="Iteration"):
-            prev = float('nan')
-            with tqdm(total=p, bar_format="{percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} {postfix[0]} {postfix[1][value]:>6.4g} [{elapsed}<{remaining}]",
-              postfix=["Score", dict(value=float('nan'))], leave=False) as t:
-                for j in range(p):
-                    if i==0 and j==0:
-                        â = e(0)
-                        t.update()
-                        continue
-                    th = np.linspace(-math.pi/math.pow(2, i+1), math.pi/math.pow(2, i+1), n_g)
-                    cands = np.outer(â, np.cos(th)) + np.outer(e(j), np.sin(th))
-                    cands = cands / np.linalg.norm(cands, ord=2, axis=0)
-                    scores = S(np.dot(Xt, cands))
-                    best = np.argmax(scores)
-                    â = cands[:,best]
-                    t.postfix[1]["value"] = scores[best]
-                    t.update()
-        A[:,k] = â
-        Xt = Xt - np.outer(np.dot(Xt, â), â)
+    for k in range(max_dim):
+        â = np.zeros(p)
+        â[0] = 1.0
+        for i in range(n_c):
+            # Refresh Xᵀâ once per pass to avoid accumulating rounding error
+            np.matmul(â, X, out=pair[0])
+            score = float('nan')
+            for j in range(1 if i==0 else 0, p):
+                # ‖cos(θ)â + sin(θ)e(j)‖ for every θ on the grid
+                norms = np.sqrt(np.dot(â, â) * cos[i]**2 + cos_sin[i] * â[j] + sin[i]**2)
+                np.divide(cos[i], norms, out=weights[:,0])
+                np.divide(sin[i], norms, out=weights[:,1])
+                pair[1] = X[j]
+                np.matmul(weights, pair, out=proj)
+                scores = S(proj.transpose())
+                best = np.argmax(scores)
+                â *= weights[best,0]
+                â[j] += weights[best,1]
+                pair[0] = proj[best]
+                score = scores[best]
+            if progress is not None:
+                progress(k, i, score)
+        A[:,k] = â
+        # X ← X - â(Xᵀâ)ᵀ, in place on the Fortran-ordered view of X
+        ger(-1.0, np.matmul(â, X), â, a=X.transpose(), overwrite_a=True)
 
         result = A[rev_order,0:(k+1)]
         if sufficient is not None and sufficient(result):
@@ -107,19 +133,87 @@ def goodness_of_fit(basis, target, ax=None):
     return r2, proj
 
 
-def basis_for_target(samples, target, max_dim=None, min_r2=0.9):
-    def fit_criteria(signal, r2):
-        def test(B):
-            r2_actual, _ = goodness_of_fit(B, signal)
-            return r2_actual > r2
+class IncrementalFit:
+    """
+    Track the least-squares fit of a target spectrum as basis vectors are added
 
-        return test
+    Maintains a QR factorization of the basis by (twice-iterated) Gram–Schmidt, along
+    with the residual of the target after projection onto the basis.  Adding a basis
+    vector costs O(p·k) for a basis of k vectors, instead of the O(p·k²) needed to
+    refit from scratch with goodness_of_fit.
 
-    assert len(samples.shape == 2), "Input samples must be delivered as matrix of column vectors"
-    p,n = samples.shape
-    max_dim = max_dim if max_dim else p
+    Instances may be passed as the `sufficient` argument of rpca_grid; each call
+    folds in any basis columns not yet seen and reports whether the fit has exceeded
+    min_r2.
+
+    Arguments:
+        target (np.array): A p-dimensional target spectrum
+        min_r2 (float): The R² above which the basis is deemed sufficient
+    """
+    def __init__(self, target, min_r2=0.9):
+        p = len(target)
+        self.min_r2 = min_r2
+        self.Q = np.zeros((p, p))
+        self.R = np.zeros((p, p))
+        self.k = 0
+        self.residual = np.array(target, dtype=np.float64)
+        dev = target - np.mean(target)
+        self.total = np.inner(dev, dev)
+        self.r2 = 1 - np.inner(self.residual, self.residual) / self.total
+
+    def add(self, a):
+        """Extend the basis by one vector and return the updated R²"""
+        Q = self.Q[:,:self.k]
+        r = np.matmul(Q.transpose(), a)
+        q = a - np.matmul(Q, r)
+        correction = np.matmul(Q.transpose(), q)
+        q -= np.matmul(Q, correction)
+        r += correction
+
+        norm = np.linalg.norm(q)
+        self.Q[:,self.k] = q / norm
+        self.R[:self.k,self.k] = r
+        self.R[self.k,self.k] = norm
+
+        self.residual -= np.inner(self.Q[:,self.k], self.residual) * self.Q[:,self.k]
+        self.r2 = 1 - np.inner(self.residual, self.residual) / self.total
+        self.k += 1
+        return self.r2
+
+    def __call__(self, basis):
+        for j in range(self.k, basis.shape[1]):
+            self.add(basis[:,j])
+        return self.r2 > self.min_r2
+
+    @property
+    def projection(self):
+        """The k×p pseudo-inverse of the basis, from R⁻¹Qᵀ"""
+        return scipy.linalg.solve_triangular(self.R[:self.k,:self.k], self.Q[:,:self.k].transpose())
+
+
+def basis_for_target(samples, target, max_dim=None, min_r2=0.9, **kwargs):
+    """
+    Compute a robust PCA basis that is just large enough to represent a target
+
+    Basis vectors are added with rpca_grid until the least-squares fit of the target
+    onto the basis has an R² above min_r2 (or max_dim vectors have been found).  The
+    fit is updated incrementally as each vector is found; see IncrementalFit.
+
+    Arguments:
+        samples (np.array): a p×n matrix giving n, p-dimensional samples as column vectors
+        target (np.array): A p-dimensional target spectrum
+        max_dim (optional int): The largest number of basis vectors to compute
+        min_r2 (float): The R² of the target fit at which to stop
+        kwargs: Additional arguments for rpca_grid
+
+    Returns the p×d basis and its d×p projection (pseudo-inverse) matrix, suitable for
+    project_data
+    """
+    assert len(samples.shape) == 2, "Input samples must be delivered as matrix of column vectors"
+    fit = IncrementalFit(target, min_r2)
+    basis = rpca_grid(samples, max_dim, sufficient=fit, **kwargs)
 
-    return pca_grid(samples, max_dim, sufficient=fit_criteria(target, min_r2))
+    return basis, fit.projection
 
 
 def project_data(data, basis=None, proj=None):
@@ -159,23 +253,19 @@ def zca_whitening_matrix(m: np.array):
         channel (used for centering data).
 
     """
-    old_shape = m.shape
-    m = m.reshape(-1, old_shape[-1])
-    mean = np.mean(m, axis=0)
-    cov = np.cov(m - mean, rowvar=False)
-    w, v = np.linalg.eig(cov)
-    W = np.matmul(np.matmul(v, np.diag(1 / np.sqrt(1e-6 + w))), v.T)
-    return W, mean
+    acc = CovarianceAccumulator(m.shape[-1])
+    acc.update(m)
+    return acc.zca_whitening_matrix()
 
 
 def whitening_matrix(vcov):
-    return scipy.linalg.sqrtm(scipy.linalg.inv(vcov))
+    return whitening_operator(vcov).matrix
 
 
 def whiten(centered_data, vcov=None, white_matrix=None):
     if white_matrix is None:
         assert vcov is not None, "Must provide a variance-covariance matrix if no whitening matrix is provided"
-        white_matrix = whitening_matrix(vcov)
+        return whitening_operator(vcov).apply(centered_data)
 
     if len(centered_data.shape)==3:
         return np.einsum('ij,rcj->rci', white_matrix, centered_data)
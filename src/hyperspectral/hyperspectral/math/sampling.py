@@ -0,0 +1,174 @@
+import os
+
+import numpy as np
+
+from hyperspectral.math.rpca import rpca_grid
+
+
+def raster_blocks(filename, bands=None):
+    """
+    Read a raster one internal block at a time
+
+    Windows follow the block layout of the first band, so every read is aligned with
+    the on-disk tiling (or striping) of the file.
+
+    Arguments:
+        filename (str): Path or URI of the raster
+        bands (optional int list): 1-based indices of the bands to read; all bands are
+            read if omitted
+
+    Yields (rasterio.windows.Window, np.array) pairs; arrays are b×h×w
+    """
+    import rasterio as rio
+
+    with rio.open(filename, 'r') as ds:
+        for _, window in ds.block_windows(1):
+            yield window, ds.read(bands, window=window)
+
+
+class Reservoir:
+    """
+    A uniform random sample of pixels, updated one window at a time
+
+    Implements reservoir sampling (Algorithm R) vectorized over each window, so memory
+    use is bounded by the reservoir and a single window.  Several reservoirs can be
+    filled from one pass over a raster by giving each its own mask of eligible pixels.
+
+    Arguments:
+        size (int): Number of pixels to sample
+        seed (optional int): Seed for the random selection
+
+    References:
+
+      Vitter, J. S. (1985). Random sampling with a reservoir. ACM Transactions on
+      Mathematical Software, 11(1), 37-57.
+    """
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.reservoir = None
+        self.pixels = np.zeros((size, 2), dtype=np.int64)
+        self.seen = 0
+
+    def update(self, window, data, valid):
+        """
+        Offer the pixels of a window to the sample
+
+        Arguments:
+            window (rasterio.windows.Window): The offset of the window
+            data (np.array): The b×h×w contents of the window
+            valid (np.array): An h·w boolean mask of the pixels eligible for sampling
+        """
+        b, h, w = data.shape
+        flat = data.reshape((b, h * w))
+        idx = np.flatnonzero(valid)
+        if len(idx) == 0:
+            return
+
+        size, seen = self.size, self.seen
+        if self.reservoir is None:
+            self.reservoir = np.zeros((b, size), dtype=data.dtype)
+        coords = np.stack([window.row_off + idx // w, window.col_off + idx % w], axis=1)
+
+        # Fill the reservoir directly until it is full
+        fill = min(size - min(seen, size), len(idx))
+        if fill > 0:
+            self.reservoir[:,seen:(seen + fill)] = flat[:,idx[:fill]]
+            self.pixels[seen:(seen + fill)] = coords[:fill]
+
+        # The t-th pixel (0-based) replaces a random slot with probability size/(t+1)
+        t = seen + np.arange(fill, len(idx))
+        slots = self.rng.integers(0, t + 1) if len(t) > 0 else t
+        replace = np.flatnonzero(slots < size) + fill
+        if len(replace) > 0:
+            slots = slots[replace - fill]
+            # Only the last pixel to land in a slot survives, as in the sequential
+            # algorithm
+            _, first = np.unique(slots[::-1], return_index=True)
+            last = len(slots) - 1 - first
+            self.reservoir[:,slots[last]] = flat[:,idx[replace[last]]]
+            self.pixels[slots[last]] = coords[replace[last]]
+
+        self.seen += len(idx)
+
+    def sample(self):
+        """
+        Return a b×m matrix of sampled pixels as column vectors and an m×2 matrix of
+        their (row, column) raster coordinates, where m is the smaller of size and the
+        number of pixels seen; the matrix is None if no pixels were seen
+        """
+        m = min(self.seen, self.size)
+        if self.reservoir is None:
+            return None, self.pixels[:0]
+        return self.reservoir[:,:m], self.pixels[:m]
+
+
+def valid_pixels(data, nodata=None):
+    """
+    Flag the pixels of a b×h×w window holding no NaN, and no nodata if given, in any
+    band; returns an h·w boolean mask
+    """
+    b, h, w = data.shape
+    flat = data.reshape((b, h * w))
+    valid = ~np.any(np.isnan(flat), axis=0) if np.issubdtype(flat.dtype, np.floating) \
+        else np.ones(h * w, dtype=bool)
+    if nodata is not None:
+        valid &= ~np.any(flat == nodata, axis=0)
+    return valid
+
+
+def reservoir_sample(blocks, size, nodata=None, seed=None):
+    """
+    Draw a uniform random sample of pixels in one pass over a stream of windows
+
+    Uses a Reservoir, so memory use is bounded by the reservoir and a single window,
+    regardless of scene size.  Pixels containing NaN in any band are always skipped;
+    pixels equal to `nodata` in any band are skipped if `nodata` is given.
+
+    Arguments:
+        blocks (iterable): (rasterio.windows.Window, np.array) pairs giving the offset
+            and the b×h×w contents of each window; see raster_blocks
+        size (int): Number of pixels to sample
+        nodata (optional float): Value marking invalid pixels
+        seed (optional int): Seed for the random selection
+
+    Returns a b×m matrix of sampled pixels as column vectors and an m×2 matrix of the
+    (row, column) raster coordinates of each sample, where m is the smaller of size
+    and the number of valid pixels.
+    """
+    reservoir = Reservoir(size, seed)
+    for window, data in blocks:
+        reservoir.update(window, data, valid_pixels(data, nodata))
+
+    samples, pixels = reservoir.sample()
+    if samples is None:
+        raise ValueError("No valid pixels found")
+    return samples, pixels
+
+
+def rpca_raster(source, sample_size=100000, bands=None, nodata=None, seed=None, **kwargs):
+    """
+    Compute a robust PCA basis for a scene too large to hold in memory
+
+    Pixels are reservoir sampled in a single streaming pass over the scene, and the
+    basis is fit to that sample with rpca_grid.  Peak memory is set by sample_size
+    rather than the size of the scene.
+
+    Arguments:
+        source (str or iterable): Path of a raster to read block by block, or an
+            iterable of (rasterio.windows.Window, np.array) pairs as produced by
+            raster_blocks
+        sample_size (int): Number of pixels to fit the basis to
+        bands (optional int list): 1-based band indices to read if source is a path
+        nodata (optional float): Value marking invalid pixels, which are not sampled
+        seed (optional int): Seed for the pixel sample
+        kwargs: Additional arguments for rpca_grid
+
+    Returns the p×d basis from rpca_grid and the m×2 matrix of (row, column)
+    coordinates of the pixels it was fit to, so that the fit can be reproduced.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        source = raster_blocks(source, bands)
+
+    samples, pixels = reservoir_sample(source, sample_size, nodata=nodata, seed=seed)
+    return rpca_grid(samples, **kwargs), pixels
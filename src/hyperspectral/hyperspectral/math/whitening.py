@@ -0,0 +1,111 @@
+from collections import OrderedDict
+import hashlib
+
+import numpy as np
+import scipy.linalg
+
+
+class WhiteningOperator:
+    """
+    A factored whitening (sphering) transform for a covariance matrix
+
+    The covariance Σ is factored once, and the factors are used to apply W (with
+    WΣWᵀ = I) or its inverse to vectors, matrices of column vectors, or r×c×b image
+    cubes.  Two factorizations are available:
+
+      'eigh': symmetric eigendecomposition Σ = VΛVᵀ, giving the symmetric (ZCA)
+          operator W = VΛ^(-1/2)Vᵀ, which is the real matrix square root of Σ⁻¹;
+          eigenvalues are floored so near-singular covariances stay well-conditioned
+      'cholesky': Σ = LLᵀ, giving W = L⁻¹, applied by triangular solves; cheaper to
+          build, but only defined for positive definite Σ
+
+    Both operators give the same inner products between whitened vectors, so either
+    may be used for matched filtering.
+
+    Arguments:
+        cov (np.array): A b×b symmetric covariance matrix
+        method (str): Either 'eigh' or 'cholesky'
+        floor (optional float): Smallest eigenvalue retained by the 'eigh' method;
+            defaults to a multiple of machine precision relative to the largest
+        regularization (float): Value added to the diagonal of cov before factoring
+    """
+    def __init__(self, cov, method='eigh', floor=None, regularization=0.0):
+        cov = np.asarray(cov, dtype=np.float64)
+        b = cov.shape[0]
+        assert cov.shape == (b, b), "Covariance must be a square matrix"
+        if regularization:
+            cov = cov + regularization * np.eye(b)
+
+        self.method = method
+        self.bands = b
+        if method == 'eigh':
+            w, V = np.linalg.eigh(cov)
+            if floor is None:
+                floor = max(np.max(w), 0) * b * np.finfo(np.float64).eps
+            w = np.maximum(w, floor)
+            self.eigenvalues = w
+            self.eigenvectors = V
+            self.matrix = np.matmul(V / np.sqrt(w), V.transpose())
+            self.inverse_matrix = np.matmul(V * np.sqrt(w), V.transpose())
+        elif method == 'cholesky':
+            self.factor = np.linalg.cholesky(cov)
+            self.matrix = scipy.linalg.solve_triangular(self.factor, np.eye(b), lower=True)
+            self.inverse_matrix = self.factor
+        else:
+            raise ValueError('Unrecognized whitening method: {}'.format(method))
+
+    def _transform(self, data, M):
+        if len(data.shape) == 3:
+            return np.matmul(data, M.transpose())
+        elif len(data.shape) < 3:
+            return np.matmul(M, data)
+        else:
+            raise ValueError("Data must be single vector, matrix of column vectors, "
+                             "or r × c × b image")
+
+    def apply(self, data):
+        """
+        Whiten a vector, a b×n matrix of column vectors, or an r×c×b image
+        """
+        if self.method == 'cholesky':
+            if len(data.shape) == 3:
+                r, c, b = data.shape
+                flat = data.reshape((r * c, b)).transpose()
+                solved = scipy.linalg.solve_triangular(self.factor, flat, lower=True)
+                return solved.transpose().reshape((r, c, b))
+            elif len(data.shape) < 3:
+                return scipy.linalg.solve_triangular(self.factor, data, lower=True)
+        return self._transform(data, self.matrix)
+
+    def inverse_apply(self, data):
+        """
+        Map whitened vectors, b×n matrices or r×c×b images back to the original space
+        """
+        return self._transform(data, self.inverse_matrix)
+
+
+_operator_cache = OrderedDict()
+OPERATOR_CACHE_SIZE = 32
+
+
+def whitening_operator(cov, method='eigh', floor=None, regularization=0.0):
+    """
+    Return a WhiteningOperator for a covariance matrix, reusing previous factorizations
+
+    Operators are kept in a least-recently-used cache keyed by a hash of the contents
+    of the covariance matrix and the factorization options, so repeated detectors run
+    against the same background model never refactor the matrix.
+
+    Arguments are as for WhiteningOperator
+    """
+    cov = np.ascontiguousarray(cov, dtype=np.float64)
+    key = (hashlib.sha1(cov.tobytes()).hexdigest(), cov.shape, method, floor, regularization)
+    if key in _operator_cache:
+        _operator_cache.move_to_end(key)
+        return _operator_cache[key]
+
+    op = WhiteningOperator(cov, method=method, floor=floor, regularization=regularization)
+    _operator_cache[key] = op
+    if len(_operator_cache) > OPERATOR_CACHE_SIZE:
+        _operator_cache.popitem(last=False)
+    return op
@@ -1 +1,4 @@
 from .spectra import Spectrum, SpectralLibrary
+from .ecostress import load_ECOSTRESS, parse_ECOSTRESS_fast
+from .sensors import SensorModel, SENSORS, get_sensor, register_sensor
+from .matching import SpectralMatcher
@@ -0,0 +1,209 @@
+import json
+import os
+import warnings
+
+import numpy as np
+
+from hyperspectral.spectra.spectra import Spectrum, SpectralLibrary
+
+# Bumped whenever the layout of the cache changes, so stale caches are rebuilt
+CACHE_VERSION = 1
+CACHE_DIR = '.spectra_cache'
+
+
+def parse_ECOSTRESS_fast(filename):
+    """
+    Parse an ECOSTRESS spectrum file into its header and sample arrays
+
+    The header is scanned line by line as 'Key: value' pairs (lines without a colon
+    continue the previous value) up to the first blank line, and the whole sample
+    block is converted to floats by numpy in one call.  Files that do not fit this
+    layout fall back to Spectrum.parse_ECOSTRESS.
+
+    Returns a (header dict, x np.array, y np.array) triple; the header keeps every
+    field, including Name, Type and Class
+    """
+    with open(filename, 'r', encoding='iso-8859-1') as f:
+        text = f.read()
+
+    header = {}
+    key = None
+    lines = text.split('\n')
+    for i, line in enumerate(lines):
+        if not line.strip():
+            if header:
+                break
+            continue
+        if ':' in line:
+            key, value = line.split(':', 1)
+            key = key.strip()
+            header[key] = value.strip()
+        elif key is not None:
+            header[key] = (header[key] + ' ' + line.strip()).strip()
+        else:
+            return _parse_slow(filename)
+    else:
+        return _parse_slow(filename)
+
+    try:
+        values = np.array('\n'.join(lines[i + 1:]).split(), dtype=np.float64)
+    except ValueError:
+        return _parse_slow(filename)
+    if len(values) % 2 != 0 or not {'Name', 'Type', 'Class'} <= header.keys():
+        return _parse_slow(filename)
+    samples = values.reshape(-1, 2)
+    return header, samples[:,0], samples[:,1]
+
+
+def _parse_slow(filename):
+    s = Spectrum.parse_ECOSTRESS(filename)
+    header = dict(s.info)
+    header.update({
+        'Name': s.name,
+        'Type': s.type_,
+        'Class': s.class_,
+        'First X Value': str(s.x_range[0]),
+        'Last X Value': str(s.x_range[1]),
+        'Number of X Values': s.n_samples,
+    })
+    return header, s.x, s.y
+
+
+def _listing(directory):
+    """The (file name, mtime in ns, size) of each spectrum file in a directory, sorted"""
+    listing = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith('.spectrum.txt'):
+                stat = entry.stat()
+                listing.append([entry.name, stat.st_mtime_ns, stat.st_size])
+    return sorted(listing)
+
+
+def _parse_all(directory, names, processes):
+    files = [os.path.join(directory, name) for name in names]
+    if processes == 1 or len(files) < 2:
+        return list(map(parse_ECOSTRESS_fast, files))
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(processes) as pool:
+        chunksize = max(1, len(files) // (4 * (processes or os.cpu_count() or 1)))
+        return list(pool.map(parse_ECOSTRESS_fast, files, chunksize=chunksize))
+
+
+def _write_cache(cache, listing, parsed):
+    """
+    Write parsed spectra as flat x/y arrays with row offsets, and a JSON table of the
+    headers and the file listing they were parsed from
+    """
+    os.makedirs(cache, exist_ok=True)
+    lengths = np.array([len(x) for (_, x, _) in parsed], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    np.save(os.path.join(cache, 'x.npy'),
+            np.concatenate([x for (_, x, _) in parsed] + [np.empty(0)]))
+    np.save(os.path.join(cache, 'y.npy'),
+            np.concatenate([y for (_, _, y) in parsed] + [np.empty(0)]).astype(np.float32))
+    np.save(os.path.join(cache, 'offsets.npy'), offsets)
+    # The table is written last, so an interrupted write leaves no valid cache
+    table = {
+        'version': CACHE_VERSION,
+        'files': listing,
+        'headers': [header for (header, _, _) in parsed],
+    }
+    tmp = os.path.join(cache, 'table.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(table, f)
+    os.replace(tmp, os.path.join(cache, 'table.json'))
+
+
+def _read_cache(cache, listing):
+    """Read a cache if it was built from exactly the given file listing, else None"""
+    try:
+        with open(os.path.join(cache, 'table.json'), 'r') as f:
+            table = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if table.get('version') != CACHE_VERSION or table.get('files') != listing:
+        return None
+    x = np.load(os.path.join(cache, 'x.npy'), mmap_mode='r')
+    y = np.load(os.path.join(cache, 'y.npy'), mmap_mode='r')
+    offsets = np.load(os.path.join(cache, 'offsets.npy'))
+    return table['headers'], x, y, offsets
+
+
+def load_ECOSTRESS(directory, cache=None, processes=None, select=None):
+    """
+    Load a directory of ECOSTRESS spectrum files as a SpectralLibrary
+
+    Files are parsed by a pool of processes with parse_ECOSTRESS_fast, and the result
+    is cached on disk as flat sample arrays with a JSON table of headers.  Later loads
+    memory-map the cached arrays instead of parsing; the cache is rebuilt whenever a
+    *.spectrum.txt file in the directory is added, removed, or changes size or
+    modification time.
+
+    Arguments:
+        directory (str): The unpacked ECOSTRESS library
+        cache (str or bool): Directory of the cache; defaults to a hidden subdirectory
+            of the library directory, and False disables caching.  If the cache cannot
+            be written (for example, on a read-only mount), the spectra are loaded
+            without one, with a warning
+        processes (optional int): Number of worker processes for parsing; all cores if
+            omitted, and 1 parses in this process
+        select (function): A predicate on the header of each file (a dict of its
+            'Key: value' fields), choosing the spectra to include, e.g.
+            lambda h: h['Wavelength Range'] != 'TIR'
+
+    Returns a SpectralLibrary; the metadata of each spectrum are as for
+    Spectrum.parse_ECOSTRESS
+    """
+    listing = _listing(directory)
+    if cache is None:
+        cache = os.path.join(directory, CACHE_DIR)
+
+    cached = _read_cache(cache, listing) if cache else None
+    if cached is None:
+        parsed = _parse_all(directory, [name for (name, _, _) in listing], processes)
+        if cache:
+            try:
+                _write_cache(cache, listing, parsed)
+                cached = _read_cache(cache, listing)
+            except OSError as e:
+                # Such as a library on a read-only mount; load without a cache
+                warnings.warn('Could not write spectra cache {}: {}'.format(cache, e))
+        if cached is None:
+            lengths = [len(x) for (_, x, _) in parsed]
+            cached = ([header for (header, _, _) in parsed],
+                      np.concatenate([x for (_, x, _) in parsed] + [np.empty(0)]),
+                      np.concatenate([y for (_, _, y) in parsed] + [np.empty(0)]),
+                      np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+    headers, flat_x, flat_y, offsets = cached
+
+    rows = [i for (i, header) in enumerate(headers) if select is None or select(header)]
+    assert len(rows) > 0, 'No spectra selected'
+    rows = np.array(rows)
+
+    # Scatter the selected rows of the flat arrays into NaN-padded matrices
+    starts, lengths = offsets[rows], offsets[rows + 1] - offsets[rows]
+    m = np.max(lengths)
+    within = np.arange(m)[None,:] < lengths[:,None]
+    ix = (starts[:,None] + np.arange(m)[None,:])[within]
+    x = np.full((len(rows), m), np.nan)
+    y = np.full((len(rows), m), np.nan, dtype=np.float32)
+    x[within] = flat_x[ix]
+    y[within] = flat_y[ix]
+
+    names, types, classes, infos, x_ranges, n_samples = [], [], [], [], [], []
+    for i in rows:
+        info = dict(headers[i])
+        names.append(info.pop('Name'))
+        types.append(info.pop('Type'))
+        classes.append(info.pop('Class'))
+        x0 = float(info.pop('First X Value'))
+        x1 = float(info.pop('Last X Value'))
+        x_ranges.append([min(x0, x1), max(x0, x1)])
+        n_samples.append(info.pop('Number of X Values'))
+        infos.append(info)
+
+    return SpectralLibrary.from_arrays(x, y, names, types, classes, infos, x_ranges=x_ranges,
+                                       n_samples=n_samples)
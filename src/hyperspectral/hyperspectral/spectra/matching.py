@@ -0,0 +1,249 @@
+import numpy as np
+
+from hyperspectral.target.raster import score_raster
+
+METRICS = ('sam', 'correlation')
+
+# Up to this many matches, each block of scores is reduced by repeated argmax rather
+# than np.argpartition
+ARGMAX_MAX_K = 8
+
+
+def _top_k(best_scores, best_ix, scores, offset, k):
+    """
+    Merge an n×c block of scores for candidates offset..offset+c into a running top-k
+
+    Scores are laid out with one pixel per row, so that selection runs along contiguous
+    memory.  Only the pixels for which some new score beats their current k-th best are
+    merged.
+
+    Returns the updated n×k (unordered) scores and candidate indices; scores is
+    overwritten
+    """
+    n, c = scores.shape
+    if c > k and k <= ARGMAX_MAX_K:
+        # A few argmax passes are much cheaper than a partition of every row
+        ix = np.empty((n, k), dtype=np.int64)
+        new_scores = np.empty((n, k), dtype=scores.dtype)
+        rows = np.arange(n)
+        for j in range(k):
+            ix[:,j] = np.argmax(scores, axis=1)
+            new_scores[:,j] = scores[rows, ix[:,j]]
+            scores[rows, ix[:,j]] = -np.inf
+        new_ix = ix + offset
+    elif c > k:
+        ix = np.argpartition(-scores, k - 1, axis=1)[:,:k]
+        new_scores, new_ix = np.take_along_axis(scores, ix, axis=1), ix + offset
+    else:
+        new_scores = scores
+        new_ix = np.broadcast_to(np.arange(offset, offset + c), (n, c))
+    if best_scores is None:
+        return new_scores, np.array(new_ix)
+
+    # NaN comparisons are false, so pixels with NaN scores are never merged
+    rows = np.flatnonzero(np.max(new_scores, axis=1) > np.min(best_scores, axis=1))
+    if len(rows) > 0:
+        merged = np.concatenate([best_scores[rows], new_scores[rows]], axis=1)
+        merged_ix = np.concatenate([best_ix[rows], new_ix[rows]], axis=1)
+        keep = np.argpartition(-merged, k - 1, axis=1)[:,:k]
+        best_scores[rows] = np.take_along_axis(merged, keep, axis=1)
+        best_ix[rows] = np.take_along_axis(merged_ix, keep, axis=1)
+    return best_scores, best_ix
+
+
+def _spherical_kmeans(Z, groups, iterations=10, seed=0):
+    """Cluster the unit columns of Z by cosine similarity; returns a label per column"""
+    n = Z.shape[1]
+    rng = np.random.default_rng(seed)
+    C = Z[:, rng.choice(n, size=groups, replace=False)]
+    for _ in range(iterations):
+        labels = np.argmax(np.matmul(C.transpose(), Z), axis=0)
+        sums = np.zeros((Z.shape[0], groups))
+        np.add.at(sums.transpose(), labels, Z.transpose())
+        norms = np.linalg.norm(sums, axis=0)
+        # Empty clusters keep their previous centre
+        C = np.where(norms > 0, sums / np.where(norms > 0, norms, 1), C)
+    return np.argmax(np.matmul(C.transpose(), Z), axis=0)
+
+
+class SpectralMatcher:
+    """
+    Find the closest spectra of a library to every pixel of a scene
+
+    The library's model matrix is normalized once, so scoring a block of pixels
+    against every library spectrum is a single matrix product, taken over chunks of
+    the library so that only a running top-k per pixel is held.  Two similarity
+    measures are available:
+
+      'sam': spectral angle, arccos(sᵀx / ‖s‖‖x‖), in radians; smaller is closer
+      'correlation': Pearson correlation of s and x across bands; larger is closer
+
+    For large libraries, candidates can be pruned with a coarse index.  The
+    normalized spectra are clustered in the space of their leading principal
+    components, and each cluster is summarized by its central direction c and its
+    angular radius ρ, the largest angle between c and a member.  No member of a
+    cluster can be closer to a pixel x than cos(max(∠(x, c) - ρ, 0)), so, visiting the
+    clusters from the most promising, a cluster is only scored for the pixels where
+    that bound beats their current k-th best match.  The pruning is exact: the matches
+    are the same as without the index, up to rounding.
+
+    Arguments:
+        library (SpectralLibrary): A regular library without invalid or zero spectra
+            (nor, for correlation, constant ones); its source_bands give the image
+            bands the spectra are sampled at
+        metric (str): One of METRICS
+        k (int): Number of matches kept per pixel
+        components (optional int): Number of principal components the index is built
+            in; no index if omitted
+        clusters (optional int): Number of clusters in the index; √n for a library of
+            n spectra if omitted
+        chunk (int): Number of library spectra scored per matrix product, bounding the
+            scratch memory to chunk × pixels scores
+        dtype (np.dtype): The floating point type for computation
+    """
+    def __init__(self, library, metric='sam', k=1, components=None, clusters=None,
+                 chunk=1024, dtype=np.float32):
+        assert metric in METRICS, "Unrecognized metric: {}".format(metric)
+        S = np.asarray(library.model_matrix, dtype=np.float64)
+        assert not np.any(np.isnan(S)), "Drop invalid spectra from the library first"
+        d, n = S.shape
+        assert 1 <= k <= n, "k must be between 1 and the library size"
+        assert chunk >= k, "chunk must be at least k"
+
+        self.metric = metric
+        self.k = k
+        self.bands = d
+        self.source_bands = list(library.source_bands)
+        self.chunk = chunk
+        self.dtype = dtype
+
+        L = self._normalize(S)
+        # A zero-norm spectrum (or, for correlation, a constant one) normalizes to NaN,
+        # which argmax would select for every pixel
+        assert not np.any(np.isnan(L)), \
+            "Drop zero (or, for correlation, constant) spectra from the library first"
+        self.index = components is not None
+        if self.index:
+            U, _, _ = np.linalg.svd(L, full_matrices=False)
+            Z = np.matmul(U[:,:components].transpose(), L)
+            Z /= np.maximum(np.linalg.norm(Z, axis=0), np.finfo(np.float64).tiny)
+            clusters = min(clusters or int(np.ceil(np.sqrt(n))), n)
+            labels = _spherical_kmeans(Z, clusters)
+
+            # Store the library cluster by cluster; order maps rows back to spectra
+            self.order = np.argsort(labels, kind='stable')
+            L = L[:,self.order]
+            counts = np.bincount(labels, minlength=clusters)
+            self.offsets = np.concatenate([[0], np.cumsum(counts)])
+            centers, radii = [], []
+            for i in range(clusters):
+                members = L[:,self.offsets[i]:self.offsets[i + 1]]
+                c = np.sum(members, axis=1)
+                c /= max(np.linalg.norm(c), np.finfo(np.float64).tiny)
+                centers.append(c)
+                radii.append(np.max(np.arccos(np.clip(np.matmul(c, members), -1, 1)),
+                                    initial=0))
+            self.centers = np.ascontiguousarray(np.stack(centers), dtype=dtype)
+            # A little slack keeps the bounds safe from single-precision rounding
+            self.radii = np.array(radii) + 1e-3
+        self.library = np.ascontiguousarray(L.transpose(), dtype=dtype)
+
+    def _normalize(self, X):
+        """Scale (and for correlation, center) the columns of X to unit norm"""
+        if self.metric == 'correlation':
+            X = X - np.mean(X, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return X / np.sqrt(np.einsum('ij,ij->j', X, X))
+
+    def _scores(self, X̂):
+        """The top-k unit-vector dot products and library indices, as n×k matrices"""
+        n = self.library.shape[0]
+        P = np.ascontiguousarray(X̂.transpose())
+        if not self.index:
+            best, best_ix = None, None
+            for i in range(0, n, self.chunk):
+                scores = np.matmul(P, self.library[i:i + self.chunk].transpose())
+                best, best_ix = _top_k(best, best_ix, scores, i, self.k)
+            return best, best_ix
+
+        # Upper bounds on the scores of the members of each cluster, for each pixel
+        θ = np.arccos(np.clip(np.matmul(P, self.centers.transpose()), -1, 1))
+        bounds = np.cos(np.maximum(θ - self.radii, 0))
+
+        best = np.full((P.shape[0], self.k), -np.inf, dtype=P.dtype)
+        best_ix = np.zeros((P.shape[0], self.k), dtype=np.int64)
+        threshold = best[:,0].copy()
+        for g in np.argsort(-np.nanmean(bounds, axis=0)):
+            # NaN pixels fail every comparison, so are never scored
+            rows = np.flatnonzero(bounds[:,g] > threshold)
+            if len(rows) == 0:
+                continue
+            start, end = self.offsets[g], self.offsets[g + 1]
+            for i in range(start, end, self.chunk):
+                scores = np.matmul(P[rows], self.library[i:min(i + self.chunk, end)].transpose())
+                best[rows], best_ix[rows] = _top_k(best[rows], best_ix[rows], scores, i, self.k)
+            threshold[rows] = np.min(best[rows], axis=1)
+        return best, self.order[best_ix]
+
+    def apply(self, data):
+        """
+        Match a d×n matrix of pixels as columns
+
+        Returns k×n matrices of library indices and scores, best match first; pixels
+        that cannot be scored, such as those holding NaN, have index -1 and score NaN
+        """
+        X = np.asarray(data, dtype=self.dtype)
+        assert X.shape[0] == self.bands, "Input must have one band per library sample"
+        X̂ = self._normalize(X)
+
+        scores, ix = self._scores(X̂)
+        order = np.argsort(-scores, axis=1, kind='stable')
+        scores = np.take_along_axis(scores, order, axis=1).transpose().copy()
+        ix = np.take_along_axis(ix, order, axis=1).transpose().copy()
+
+        # Pixels that could not be scored (such as those holding NaN) have no matches
+        unscored = np.isneginf(scores) | np.isnan(scores)
+        scores[unscored] = np.nan
+        ix[unscored] = -1
+        if self.metric == 'sam':
+            np.clip(scores, -1, 1, out=scores)
+            np.arccos(scores, out=scores)
+        return ix, scores
+
+    def apply_bands(self, data):
+        """
+        Match a b×h×w block of pixels, as read by rasterio
+
+        Returns k×h×w arrays of library indices and scores
+        """
+        b, h, w = data.shape
+        ix, scores = self.apply(data.reshape((b, h * w)))
+        return ix.reshape((self.k, h, w)), scores.reshape((self.k, h, w))
+
+    def run_raster(self, infile, outfile, bands=None, nodata=None):
+        """
+        Label every pixel of a raster with its best library matches, in one read
+
+        The output holds k bands of library indices (as float32; see the library's
+        names or group_vector for labels) followed by k bands of scores, with NaN for
+        invalid or unscored pixels.
+
+        Arguments:
+          infile (str): Path of the input raster
+          outfile (str): Path of the output GeoTIFF
+          bands (optional int list): 1-based indices of the input bands to use; the
+              library's source_bands if omitted
+          nodata (optional float): Input value marking invalid pixels
+        """
+        if bands is None:
+            bands = [b + 1 for b in self.source_bands]
+
+        def score(X):
+            ix, scores = self.apply(X)
+            ix = np.where(ix < 0, np.nan, ix).astype(np.float32)
+            return np.concatenate([ix, scores.astype(np.float32)])
+
+        descriptions = ['match_{}'.format(i + 1) for i in range(self.k)] + \
+            ['{}_{}'.format(self.metric, i + 1) for i in range(self.k)]
+        score_raster(infile, outfile, score, 2 * self.k, bands=bands, nodata=nodata,
+                     descriptions=descriptions)
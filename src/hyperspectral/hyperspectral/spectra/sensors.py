@@ -0,0 +1,280 @@
+from collections import OrderedDict
+import hashlib
+
+import numpy as np
+
+# Band tables follow the STAC metadata written by the activators (centres and full
+# widths at half maximum in micrometres)
+
+# AVIRIS classic band centres in nanometres, bands 1 to 224; see
+# activator/aviris/main.py.  Bands 95–98 overlap where the spectrometers meet.
+AVIRIS_CENTERS_NM = [
+    365.9136593, 375.5776593, 385.2466593, 394.9196593, 404.5966593, 414.2786593, 423.9646593,
+    433.6546593, 443.3496593, 453.0496593, 462.7526593, 472.4606593, 482.1736593, 491.8906593,
+    501.6116593, 511.3376593, 521.0676593, 530.8016593, 540.5406593, 550.2836593, 560.0316593,
+    569.7836593, 579.5396593, 589.3006593, 599.0656593, 608.8356593, 618.6086593, 628.3876593,
+    638.1696593, 647.9576593, 657.7486593, 667.5446593, 655.4756593, 665.2826593, 675.0846593,
+    684.8816593, 694.6726593, 704.4596593, 714.2406593, 724.0166593, 733.7866593, 743.5526593,
+    753.3126593, 763.0676593, 772.8166593, 782.5616593, 792.3006593, 802.0356593, 811.7646593,
+    821.4876593, 831.2066593, 840.9196593, 850.6276593, 860.3306593, 870.0286593, 879.7206593,
+    889.4076593, 899.0906593, 908.7666593, 918.4386593, 928.1046593, 937.7666593, 947.4226593,
+    957.0726593, 966.7186593, 976.3586593, 985.9946593, 995.6246593, 1005.2536593, 1014.8636593,
+    1024.4836593, 1034.0936593, 1043.6936593, 1053.2936593, 1062.8836593, 1072.4736593,
+    1082.0636593, 1091.6336593, 1101.2136593, 1110.7736593, 1120.3436593, 1129.8936593,
+    1139.4436593, 1148.9936593, 1158.5336593, 1168.0736593, 1177.6036593, 1187.1336593,
+    1196.6536593, 1206.1636593, 1215.6736593, 1225.1836593, 1234.6836593, 1244.1736593,
+    1253.6636593, 1263.1436593, 1253.3536593, 1263.3336593, 1273.3036593, 1283.2736593,
+    1293.2436593, 1303.2136593, 1313.1936593, 1323.1636593, 1333.1336593, 1343.1036593,
+    1353.0736593, 1363.0436593, 1373.0136593, 1382.9836593, 1392.9536593, 1402.9236593,
+    1412.8936593, 1422.8636593, 1432.8336593, 1442.7936593, 1452.7636593, 1462.7336593,
+    1472.7036593, 1482.6636593, 1492.6336593, 1502.6036593, 1512.5736593, 1522.5336593,
+    1532.5036593, 1542.4636593, 1552.4336593, 1562.4036593, 1572.3636593, 1582.3336593,
+    1592.2936593, 1602.2636593, 1612.2236593, 1622.1836593, 1632.1536593, 1642.1136593,
+    1652.0736593, 1662.0436593, 1672.0036593, 1681.9636593, 1691.9336593, 1701.8936593,
+    1711.8536593, 1721.8136593, 1731.7736593, 1741.7336593, 1751.6936593, 1761.6636593,
+    1771.6236593, 1781.5836593, 1791.5436593, 1801.5036593, 1811.4536593, 1821.4136593,
+    1831.3736593, 1841.3336593, 1851.2936593, 1861.2536593, 1871.2136593, 1872.3636593,
+    1866.8436593, 1876.9136593, 1886.9636593, 1897.0236593, 1907.0836593, 1917.1336593,
+    1927.1836593, 1937.2336593, 1947.2736593, 1957.3136593, 1967.3636593, 1977.3936593,
+    1987.4336593, 1997.4636593, 2007.5036593, 2017.5236593, 2027.5536593, 2037.5836593,
+    2047.6036593, 2057.6236593, 2067.6436593, 2077.6536593, 2087.6636593, 2097.6836593,
+    2107.6836593, 2117.6936593, 2127.6936593, 2137.7036593, 2147.6936593, 2157.6936593,
+    2167.6936593, 2177.6836593, 2187.6736593, 2197.6636593, 2207.6436593, 2217.6336593,
+    2227.6136593, 2237.5836593, 2247.5636593, 2257.5336593, 2267.5136593, 2277.4836593,
+    2287.4436593, 2297.4136593, 2307.3736593, 2317.3336593, 2327.2936593, 2337.2436593,
+    2347.2036593, 2357.1536593, 2367.0936593, 2377.0436593, 2386.9936593, 2396.9336593,
+    2406.8736593, 2416.8036593, 2426.7436593, 2436.6736593, 2446.6036593, 2456.5336593,
+    2466.4536593, 2476.3836593, 2486.3036593, 2496.2236593
+]
+# The activator table has no widths; AVIRIS classic bands are about 10nm wide
+AVIRIS_FWHM = 0.010
+
+# See activator/sentinel_s2/main.py
+SENTINEL2_BANDS = [
+    ('B01', 0.4439, 0.027),
+    ('B02', 0.4966, 0.098),
+    ('B03', 0.56, 0.045),
+    ('B04', 0.6645, 0.038),
+    ('B05', 0.7039, 0.019),
+    ('B06', 0.7402, 0.018),
+    ('B07', 0.7825, 0.028),
+    ('B08', 0.8351, 0.145),
+    ('B8A', 0.8648, 0.033),
+    ('B09', 0.945, 0.026),
+    ('B11', 1.6137, 0.143),
+    ('B12', 2.22024, 0.242),
+]
+
+# See activator/planet/main.py; 4-band products omit the red edge band
+PLANET_BANDS = [
+    ('B01', 0.490, 0.05),
+    ('B02', 0.565, 0.036),
+    ('B03', 0.665, 0.031),
+    ('B04', 0.705, 0.015),
+    ('B05', 0.865, 0.040),
+]
+
+# Gaussian responses are truncated at this many FWHMs from the band centre, where they
+# have fallen below 1e-10 of the peak
+GAUSSIAN_SUPPORT = 3
+
+_response_cache = OrderedDict()
+RESPONSE_CACHE_SIZE = 32
+
+
+def _digest(*arrays):
+    h = hashlib.sha1()
+    for a in arrays:
+        h.update(np.ascontiguousarray(a, dtype=np.float64).tobytes())
+        h.update(b'|')
+    return h.hexdigest()
+
+
+def _sample_widths(wavelengths):
+    """Trapezoid weights of a (not necessarily sorted) wavelength grid"""
+    order = np.argsort(wavelengths)
+    λ = wavelengths[order]
+    widths = np.empty(len(λ))
+    if len(λ) == 1:
+        widths[:] = 1
+    else:
+        edges = np.concatenate([[λ[0]], (λ[1:] + λ[:-1]) / 2, [λ[-1]]])
+        widths[order] = np.diff(edges)
+    return widths
+
+
+class SensorModel:
+    """
+    The spectral response of a multi- or hyperspectral sensor
+
+    Each band is modelled as a Gaussian response with the given centre and full width
+    at half maximum, or by a tabulated response curve.  Resampling to the sensor
+    integrates each band's response against a source spectrum on a fixed wavelength
+    grid, which for a given grid is a q×p matrix R, so that converting spectra (or
+    pixels) is a single matrix product.  Response matrices are cached per (sensor,
+    source grid).
+
+    Arguments:
+        name (str): Name of the sensor
+        centers (float list): Band centres, in micrometres
+        fwhm (float or float list): Band full widths at half maximum, in micrometres
+        band_names (optional str list): Names of the bands
+        srf (optional (np.array, np.array)): Tabulated responses, as a k-vector of
+            wavelengths and a q×k matrix of the responses of the bands at those
+            wavelengths; used in place of the Gaussian model
+    """
+    def __init__(self, name, centers, fwhm=None, band_names=None, srf=None):
+        self.name = name
+        self.centers = np.array(centers, dtype=np.float64)
+        q = len(self.centers)
+        if fwhm is None:
+            assert srf is not None, 'Either band widths or tabulated responses are required'
+            self.fwhm = None
+        else:
+            self.fwhm = np.broadcast_to(np.array(fwhm, dtype=np.float64), (q,)).copy()
+        self.band_names = list(band_names) if band_names is not None else \
+            [str(i + 1) for i in range(q)]
+        if srf is not None:
+            λ, responses = srf
+            responses = np.asarray(responses, dtype=np.float64)
+            assert responses.shape == (q, len(λ)), 'One tabulated response per band'
+            self.srf = (np.asarray(λ, dtype=np.float64), responses)
+        else:
+            self.srf = None
+        if self.srf is not None:
+            self._key = _digest(self.centers, *self.srf)
+        else:
+            self._key = _digest(self.centers, self.fwhm)
+
+    @property
+    def band_count(self):
+        return len(self.centers)
+
+    def _responses(self, wavelengths):
+        if self.srf is not None:
+            λ, responses = self.srf
+            order = np.argsort(λ)
+            return np.stack([np.interp(wavelengths, λ[order], r[order], left=0, right=0)
+                             for r in responses])
+        d = (wavelengths[None,:] - self.centers[:,None]) / self.fwhm[:,None]
+        r = np.exp(-4 * np.log(2) * d ** 2)
+        r[np.abs(d) > GAUSSIAN_SUPPORT] = 0
+        return r
+
+    def response_matrix(self, wavelengths):
+        """
+        Return the q×p matrix resampling spectra on a wavelength grid to this sensor
+
+        Each row holds the response of one band at the p grid wavelengths, weighted by
+        the width of the grid cell around each wavelength and normalized to sum to 1.
+        Bands whose response does not fall on the grid at all, or whose centre lies
+        outside it, have rows of NaN.  The matrix is cached, read-only.
+
+        Arguments:
+            wavelengths (np.array): The p source wavelengths, in micrometres
+        """
+        wavelengths = np.asarray(wavelengths, dtype=np.float64)
+        key = (self._key, _digest(wavelengths))
+        if key in _response_cache:
+            _response_cache.move_to_end(key)
+            return _response_cache[key]
+
+        R = self._responses(wavelengths) * _sample_widths(wavelengths)[None,:]
+        total = np.sum(R, axis=1, keepdims=True)
+        outside = (self.centers < np.min(wavelengths)) | (self.centers > np.max(wavelengths))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            R = R / total
+        R[outside | (total[:,0] == 0)] = np.nan
+        R.setflags(write=False)
+
+        _response_cache[key] = R
+        if len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+        return R
+
+    def apply(self, values, wavelengths, axis=-1):
+        """
+        Resample spectra on a wavelength grid to the bands of this sensor
+
+        NaN samples only affect the bands whose response covers them.
+
+        Arguments:
+            values (np.array): Spectra, with the p samples of each along the given axis
+            wavelengths (np.array): The p source wavelengths, in micrometres
+            axis (int): The spectral axis of values
+
+        Returns an array shaped as values, with q bands along the spectral axis
+        """
+        V = np.moveaxis(np.asarray(values), axis, -1)
+        # Single-precision spectra stay in single precision
+        Rt = self.response_matrix(wavelengths).transpose().astype(
+            np.result_type(V.dtype, np.float32))
+        nan = np.isnan(V)
+        if np.any(nan):
+            out = np.where(nan, 0, V) @ Rt
+            # Flag outputs whose band response weights any missing sample
+            out[(nan.astype(np.float32) @ (Rt != 0).astype(np.float32)) > 0] = np.nan
+        else:
+            out = V @ Rt
+        return np.moveaxis(out, -1, axis)
+
+    def apply_library(self, library):
+        """
+        Resample a regular SpectralLibrary to the bands of this sensor
+
+        Returns a new library sampled at the band centres
+        """
+        from hyperspectral.spectra.spectra import SpectralLibrary
+
+        y = self.apply(library.y, library.wavelengths)
+        return SpectralLibrary.from_arrays(self.centers, y, library.names, library.types,
+                                           library.classes, library.infos)
+
+    def apply_raster(self, infile, outfile, wavelengths, bands=None, nodata=None):
+        """
+        Resample a raster to the bands of this sensor, one block at a time
+
+        Each block of pixels is converted with a single matrix product.
+
+        Arguments:
+            infile (str): Path of the input raster
+            outfile (str): Path of the output GeoTIFF, with one band per sensor band
+            wavelengths (np.array): The wavelengths of the input bands read, in
+                micrometres
+            bands (optional int list): 1-based indices of the input bands to read
+            nodata (optional float): Input value marking invalid pixels
+        """
+        from hyperspectral.target.raster import score_raster
+
+        R = self.response_matrix(wavelengths)
+        score_raster(infile, outfile, lambda X: R @ X, self.band_count, bands=bands,
+                     nodata=nodata, descriptions=self.band_names)
+
+
+SENSORS = {}
+
+
+def register_sensor(sensor):
+    """Add a SensorModel to the registry, under its name"""
+    SENSORS[sensor.name] = sensor
+    return sensor
+
+
+def get_sensor(name):
+    """Look up a registered SensorModel by name"""
+    if name not in SENSORS:
+        raise ValueError('Unrecognized sensor: {} (known sensors: {})'.format(
+            name, ', '.join(sorted(SENSORS))))
+    return SENSORS[name]
+
+
+def _from_table(name, table):
+    return SensorModel(name, [c for (_, c, _) in table], [w for (_, _, w) in table],
+                       band_names=[b for (b, _, _) in table])
+
+
+register_sensor(SensorModel('aviris-classic', np.array(AVIRIS_CENTERS_NM) * 0.001, AVIRIS_FWHM,
+                            band_names=[str(i + 1) for i in range(len(AVIRIS_CENTERS_NM))]))
+register_sensor(_from_table('sentinel-2', SENTINEL2_BANDS))
+register_sensor(_from_table('planet', PLANET_BANDS))
+register_sensor(_from_table('planet-4band', PLANET_BANDS[:3] + PLANET_BANDS[4:5]))
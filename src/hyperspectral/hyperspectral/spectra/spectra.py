@@ -1,11 +1,9 @@
 from collections import Counter
 from copy import deepcopy
-from functools import reduce
 import re
 
 import numpy as np
 import parsec
-import scipy.interpolate as interpolate
 
 class Spectrum:
     """
@@ -96,13 +94,7 @@ class Spectrum:
         the future.  As a result, new x values which are not contained in the domain of
         the original spectral curve result in NaN values.
         """
-        f = interpolate.interp1d(self.x, self.y)
-        def do(x):
-            try:
-                return f(x)
-            except:
-                return float('nan')
-        resampled = np.array([do(x) for x in new_x])
+        resampled = _interp_rows(self.x[None,:], self.y[None,:], new_x)[0]
         return Spectrum(self.name, self.type_, self.class_, min(new_x), max(new_x), len(resampled), deepcopy(self.info), new_x, resampled)
 
     def drop_bands(self, bands):
@@ -111,9 +103,10 @@ class Spectrum:
 
         This function uses the integer band indices to identify the bands to drop.
         """
-        ixs = list(sorted(set(range(0, self.n_samples)) - set(bands)))
-        x = [self.x[i] for i in ixs]
-        y = [self.y[i] for i in ixs]
+        keep = np.ones(len(self.x), dtype=bool)
+        keep[list(bands)] = False
+        x = self.x[keep]
+        y = self.y[keep]
         return Spectrum(self.name, self.type_, self.class_, min(x), max(x), len(x), deepcopy(self.info), x ,y)
 
     def filter_bands(self, fn):
@@ -196,37 +189,215 @@ class Spectrum:
         return Spectrum(name, type_, class_, x_min, x_max, n_samples, header, x, y)
 
 
+def _interp_rows(x, y, new_x):
+    """
+    Linearly interpolate many sampled curves at common points in one vectorized pass
+
+    Arguments:
+        x (np.array): An n×m matrix of sample locations, one curve per row, padded with
+            NaN for curves with fewer than m samples; rows need not be sorted
+        y (np.array): The matching n×m matrix of sampled values
+        new_x (np.array): The q points to interpolate at
+
+    Returns an n×q float64 matrix, with NaN at points outside the sampled range of a curve
+
+    All curves are laid end to end in one sorted array by shifting each row's
+    locations past the end of the previous row's, so a single np.searchsorted locates
+    every query point in its own curve.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    new_x = np.asarray(new_x, dtype=np.float64)
+    n, m = x.shape
+
+    y = np.asarray(y, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        steps = np.diff(x, axis=1)
+    if not np.any(steps < 0):
+        xs, ys = x, y
+    else:
+        order = np.argsort(x, axis=1)  # NaN padding sorts last
+        xs = np.take_along_axis(x, order, axis=1)
+        ys = np.take_along_axis(y, order, axis=1)
+    valid = ~np.isnan(xs)
+    lengths = np.sum(valid, axis=1)
+    assert np.all(lengths > 0), 'Every curve needs at least one sample'
+
+    origin = min(np.nanmin(xs), np.min(new_x))
+    span = max(np.nanmax(xs), np.max(new_x)) - origin + 1
+    shift = np.arange(n)[:,None] * span
+    flat_x = (xs - origin + shift)[valid]
+    flat_y = ys[valid]
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    q = new_x[None,:] - origin + shift
+    left = np.searchsorted(flat_x, q, side='right') - 1
+    last = (starts + lengths - 1)[:,None]
+    left = np.clip(left, starts[:,None], np.maximum(last - 1, starts[:,None]))
+    right = np.minimum(left + 1, last)
+
+    x0, x1 = flat_x[left], flat_x[right]
+    y0, y1 = flat_y[left], flat_y[right]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(x1 > x0, (q - x0) / (x1 - x0), 0.0)
+    out = y0 + t * (y1 - y0)
+    out[(q < flat_x[starts][:,None]) | (q > flat_x[last[:,0]][:,None])] = np.nan
+    return out
+
+
 class SpectralLibrary:
     """
-    A collection of Spectrum objects
+    A collection of spectra
+
+    A SpectralLibrary maintains a collection of spectra and provides some means for
+    gathering subcollections and normalizing the contained spectra.
 
-    A SpectralLibrary maintains a collection of Spectrum objects and provides some means
-    for gathering subcollections and normalizing the contained spectra.
+    The sampled values are held in one contiguous n×m float32 matrix (one row per
+    spectrum), alongside an n×m matrix of wavelengths and per-spectrum metadata
+    columns; rows of spectra with fewer than m samples are padded with NaN.  Once
+    regularized, all rows share one wavelength vector.  Spectrum objects are only
+    built when the spectra property is read.
 
     Arguments:
         spectra (Spectrum list): The contained spectra
     """
     def __init__(self, spectra):
-        self.spectra = spectra
+        self._set_spectra(spectra)
+        self.source_bands = list(range(0, len(spectra[0].x)))
+
+    def _set_spectra(self, spectra):
+        n = len(spectra)
+        m = max(len(s.x) for s in spectra)
+        x = np.full((n, m), np.nan)
+        y = np.full((n, m), np.nan, dtype=np.float32)
+        for i, s in enumerate(spectra):
+            x[i,:len(s.x)] = s.x
+            y[i,:len(s.y)] = s.y
+
+        self._set(x, y,
+                  names=np.array([s.name for s in spectra], dtype=object),
+                  types=np.array([s.type_ for s in spectra], dtype=object),
+                  classes=np.array([s.class_ for s in spectra], dtype=object),
+                  x_ranges=np.array([s.x_range for s in spectra], dtype=np.float64),
+                  n_samples=np.array([s.n_samples for s in spectra], dtype=object),
+                  infos=np.array([s.info for s in spectra], dtype=object))
+
+    @staticmethod
+    def from_arrays(wavelengths, values, names, types, classes, infos, x_ranges=None,
+                    n_samples=None):
+        """
+        Build a library directly from a matrix of spectra
+
+        Arguments:
+            wavelengths (np.array): An n×m matrix of sample locations, NaN-padded, or
+                a single m-vector shared by all spectra
+            values (np.array): An n×m matrix of sampled values, one spectrum per row
+            names, types, classes (list): Metadata for each spectrum, as for Spectrum
+            infos (dict list): Additional metadata for each spectrum
+            x_ranges (optional np.array): The n×2 admissible x ranges of the spectra;
+                the sampled ranges if omitted
+            n_samples (optional list): The sample counts of the spectra; the number of
+                non-NaN wavelengths in each row if omitted
+        """
+        lib = SpectralLibrary.__new__(SpectralLibrary)
+        values = np.asarray(values, dtype=np.float32)
+        n, m = values.shape
+        wavelengths = np.asarray(wavelengths, dtype=np.float64)
+        if len(wavelengths.shape) == 1:
+            wavelengths = np.broadcast_to(wavelengths, (n, m))
+
+        infos = np.array(list(infos) + [None], dtype=object)[:-1]
+        if x_ranges is None:
+            x_ranges = np.stack([np.nanmin(wavelengths, axis=1),
+                                 np.nanmax(wavelengths, axis=1)], axis=1)
+        if n_samples is None:
+            n_samples = np.sum(~np.isnan(wavelengths), axis=1)
+        lib._set(wavelengths, values,
+                 names=np.array(names, dtype=object),
+                 types=np.array(types, dtype=object),
+                 classes=np.array(classes, dtype=object),
+                 x_ranges=np.asarray(x_ranges, dtype=np.float64),
+                 n_samples=np.array(list(n_samples) + [None], dtype=object)[:-1],
+                 infos=infos)
+        lib.source_bands = list(range(0, m))
+        return lib
+
+    def _set(self, x, y, **columns):
+        self.x = x
+        self.y = y
+        for k, v in columns.items():
+            setattr(self, k, v)
+        self._regular = None
+        self._spectra = None
         self.grp_fn = None
         self.groups = None
-        self.source_bands = list(range(0, len(spectra[0].x)))
+        self._group_keys = None
+
+    def _take(self, rows):
+        """Restrict the library to a subset of its spectra, given by a mask or indices"""
+        self._set(self.x[rows], self.y[rows], names=self.names[rows], types=self.types[rows],
+                  classes=self.classes[rows], x_ranges=self.x_ranges[rows],
+                  n_samples=self.n_samples[rows], infos=self.infos[rows])
 
+    def _copy(self, rows):
+        lib = SpectralLibrary.__new__(SpectralLibrary)
+        lib.__dict__.update(self.__dict__)
+        lib.source_bands = list(self.source_bands)
+        lib._take(rows)
+        return lib
+
+    @property
+    def spectra(self):
+        """
+        The contained spectra, as a list of Spectrum objects
+
+        The objects are built from the library's matrices when first read, and edits
+        to them are not seen by the library; assign a new list of Spectrum objects to
+        this property to change the contents
+        """
+        if self._spectra is None:
+            self._spectra = []
+            for i in range(len(self.names)):
+                valid = ~np.isnan(self.x[i])
+                self._spectra.append(Spectrum(
+                    self.names[i], self.types[i], self.classes[i], self.x_ranges[i,0],
+                    self.x_ranges[i,1], self.n_samples[i], self.infos[i],
+                    self.x[i,valid], self.y[i,valid]))
+        return self._spectra
+
+    @spectra.setter
+    def spectra(self, spectra):
+        self._set_spectra(spectra)
+
+    @property
+    def wavelengths(self):
+        """The wavelengths shared by all spectra of a regular library"""
+        assert self.is_regular(), 'Spectral collection must be regular'
+        return self.x[0]
 
     """
     Determine if all contained spectra are compatible
 
     This test is based on the x-values of the sampled spectra.  All contained spectra
     must have a matching sampling pattern for a library to be considered regular.  Many
-    operations require a regular library.
+    operations require a regular library.  The result is cached until the contents of
+    the library change.
     """
     def is_regular(self, tol=1e-8):
-        m = np.array([s.x for s in self.spectra])
-        return len(m.shape) == 2 and all(np.abs(np.min(m, axis=0) - np.max(m, axis=0)) < tol)
+        if self._regular is not None and self._regular[0] == tol:
+            return self._regular[1]
+        if np.any(np.isnan(self.x)):
+            regular = False
+        else:
+            regular = bool(np.all(np.abs(self.x - self.x[0]) < tol))
+        self._regular = (tol, regular)
+        return regular
 
     """
     Resample all contained spectra to a common basis
 
+    All spectra are linearly interpolated in a single vectorized pass; values at
+    frequencies outside the sampled range of a spectrum are NaN.
+
     Arguments:
         band_frequencies (float list): Frequencies to resample to
         source_bands (int list): The band indexes corresponding to each frequency for
@@ -234,7 +405,14 @@ class SpectralLibrary:
                                  starting from 0 if omitted.
     """
     def regularize(self, band_frequencies, source_bands=None):
-        self.spectra = [s.resample(band_frequencies) for s in self.spectra]
+        band_frequencies = np.asarray(band_frequencies, dtype=np.float64)
+        n, p = len(self.names), len(band_frequencies)
+        y = _interp_rows(self.x, self.y, band_frequencies).astype(np.float32)
+        self._set(np.broadcast_to(band_frequencies, (n, p)), y, names=self.names,
+                  types=self.types, classes=self.classes,
+                  x_ranges=np.tile([np.min(band_frequencies), np.max(band_frequencies)], (n, 1)),
+                  n_samples=np.full(n, p, dtype=object), infos=self.infos)
+        self._regular = (1e-8, True)
         if source_bands:
             assert len(source_bands) == len(band_frequencies)
             self.source_bands = source_bands
@@ -247,7 +425,7 @@ class SpectralLibrary:
     @property
     def band_count(self):
         assert self.is_regular(), 'Spectral collection must be regular'
-        return len(self.spectra[0].x)
+        return self.x.shape[1]
 
     """
     Identify the sample indices for which not all spectra are defined
@@ -258,17 +436,7 @@ class SpectralLibrary:
     """
     def invalid_bands(self):
         assert self.is_regular(), 'Spectral collection must be regular'
-        return set(
-            reduce(lambda a, b: a + b, list(map(lambda s:
-                list(map(lambda x: x[0],
-                    filter(
-                        lambda x: np.isnan(x[1]),
-                        enumerate(s.y)
-                    )
-                )),
-                self.spectra
-            )))
-        )
+        return set(np.flatnonzero(np.any(np.isnan(self.y), axis=0)).tolist())
 
     """
     Counts the number of spectra which are not defined for each sample index
@@ -277,8 +445,7 @@ class SpectralLibrary:
     """
     def invalid_band_count(self):
         assert self.is_regular(), 'Spectral collection must be regular'
-        samples = np.array([s.y for s in self.spectra])
-        return np.sum(np.isnan(samples), 0)
+        return np.sum(np.isnan(self.y), 0)
 
     """
     Returns all spectra which have undefined samples (optionally for a particular band)
@@ -287,10 +454,11 @@ class SpectralLibrary:
     """
     def invalid_spectra(self, band=None):
         assert self.is_regular(), 'Spectral collection must be regular'
-        if band:
-            return list(filter(lambda s: np.isnan(s.y[band]), self.spectra))
+        if band is not None:
+            invalid = np.isnan(self.y[:,band])
         else:
-            return list(filter(lambda s: any(map(lambda x: np.isnan(x), s.y)), self.spectra))
+            invalid = np.any(np.isnan(self.y), axis=1)
+        return [self.spectra[i] for i in np.flatnonzero(invalid)]
 
     """
     Elide bands corresponding to given band indices
@@ -299,10 +467,15 @@ class SpectralLibrary:
     """
     def drop_bands(self, ixs):
         assert self.is_regular(), 'Spectral collection must be regular'
-        self.source_bands = [self.source_bands[i] for i in list(sorted(set(range(0,len(self.spectra[0].x))) - set(ixs)))]
-        self.spectra = [s.drop_bands(ixs) for s in self.spectra]
-        self.grp_fn = None
-        self.groups = None
+        keep = np.ones(self.band_count, dtype=bool)
+        keep[list(ixs)] = False
+        self.source_bands = [b for (b, k) in zip(self.source_bands, keep) if k]
+        x = self.x[:,keep]
+        self._set(x, np.ascontiguousarray(self.y[:,keep]), names=self.names, types=self.types,
+                  classes=self.classes,
+                  x_ranges=np.stack([np.min(x, axis=1), np.max(x, axis=1)], axis=1),
+                  n_samples=np.full(len(self.names), x.shape[1], dtype=object),
+                  infos=self.infos)
 
     """
     Drop all spectra which have undefined sample values
@@ -311,9 +484,7 @@ class SpectralLibrary:
     """
     def drop_invalid_spectra(self):
         assert self.is_regular(), 'Spectral collection must be regular'
-        self.spectra = list(filter(lambda s: not any(map(lambda x: np.isnan(x), s.y)), self.spectra))
-        self.grp_fn = None
-        self.groups = None
+        self._take(~np.any(np.isnan(self.y), axis=1))
 
     """
     Filter the available spectra
@@ -322,19 +493,19 @@ class SpectralLibrary:
     filters based on the results.  Can be in-place, or return a new, filtered library.
     """
     def filter_spectra(self, filter_fn, inplace=False):
+        keep = np.array([bool(filter_fn(s)) for s in self.spectra], dtype=bool)
         if inplace:
-            self.spectra = list(filter(filter_fn, self.spectra))
-            self.grp_fn = None
-            self.groups = None
+            self._take(keep)
         else:
-            return SpectralLibrary(list(filter(filter_fn, self.spectra)))
+            return self._copy(keep)
 
     """
     Puts spectra into groups based on a user-specified function
 
     Given a function from Spectrum to any type, the results of those functions define
     groups to which spectra in the library are assigned.  The groups property of the
-    library gives the assignments corresponding to all spectra.
+    library gives the assignments corresponding to all spectra; group ids follow the
+    order in which the group keys first occur.
 
     Group information is destroyed when the contents of the library change through class
     methods.
@@ -343,9 +514,12 @@ class SpectralLibrary:
     """
     def group_by(self, grp_fn):
         assert self.is_regular(), 'Spectral collection must be regular'
-        groups = set(map(grp_fn, self.spectra))
+        keys = [grp_fn(s) for s in self.spectra]
+        # Keys need not be orderable (or even comparable to each other), so ids are given
+        # in order of first occurrence rather than by sorting
+        self.groups = {key: i for (i, key) in enumerate(dict.fromkeys(keys))}
         self.grp_fn = grp_fn
-        self.groups = dict(sorted(map(lambda x: (x[1], x[0]), enumerate(groups))))
+        self._group_keys = np.array([self.groups[key] for key in keys], dtype=np.int64)
 
     """
     Return a vector of group ids for each library spectra
@@ -356,13 +530,14 @@ class SpectralLibrary:
     def group_vector(self):
         assert self.is_regular(), 'Spectral collection must be regular'
         assert self.groups and self.grp_fn, 'Groups must be assigned'
-        return [self.groups[self.grp_fn(s)] for s in self.spectra]
+        return self._group_keys.tolist()
 
     """
     Assemble library spectra values into a matrix
 
-    Returns an n×p matrix with n samples per spectra and p spectra.  Each column holds
-    the sampled values of the corresponding spectrum.
+    Returns an n×p float64 matrix with n samples per spectra and p spectra.  Each
+    column holds the sampled values of the corresponding spectrum.  The matrix is a
+    copy, so it may be modified freely.
 
     Requires a regularized library.  May contain NaN values if invalid spectra have not
     been dropped.
@@ -370,4 +545,4 @@ class SpectralLibrary:
     @property
     def model_matrix(self):
         assert self.is_regular(), 'Spectral collection must be regular'
-        return np.array([s.y for s in self.spectra]).transpose()
+        return np.array(self.y.transpose(), dtype=np.float64)
@@ -1 +1,4 @@
-from .matched_filter import normalized_matched_filter
+from .matched_filter import normalized_matched_filter, normalized_matched_filter_raster
+from .detector import DetectorOperator
+from .bank import DetectorBank
+from .local import local_matched_filter, local_matched_filter_raster
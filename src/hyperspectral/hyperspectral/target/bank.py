@@ -0,0 +1,184 @@
+import numpy as np
+import scipy.linalg
+
+from hyperspectral.math.whitening import WhiteningOperator, whitening_operator
+from hyperspectral.target.raster import score_raster
+
+DETECTORS = ('amf', 'ace', 'nmf', 'cem', 'sam')
+
+
+class DetectorBank:
+    """
+    A set of target detectors evaluated together against one background model
+
+    Every detector in the bank is reduced to a linear filter plus, where needed, a
+    per-pixel norm:
+
+      'amf': adaptive matched filter, sᵀΣ⁻¹(x - μ) / sᵀΣ⁻¹s, which is 1 at the target
+      'ace': adaptive coherence estimator,
+          (sᵀΣ⁻¹(x - μ))² / (sᵀΣ⁻¹s · (x - μ)ᵀΣ⁻¹(x - μ))
+      'nmf': normalized matched filter, the signed square root of 'ace', as computed by
+          normalized_matched_filter
+      'cem': constrained energy minimization, sᵀR⁻¹x / sᵀR⁻¹s, where R = Σ + μμᵀ is
+          the correlation matrix of the (uncentered) pixels
+      'sam': spectral angle mapper, arccos(sᵀx / ‖s‖‖x‖), in radians
+
+    The filters of all detectors are stacked into one matrix, so a block of pixels is
+    scored with a single matrix product, a single whitening (only if 'ace' or 'nmf' is
+    requested) for the norms ‖W(x - μ)‖, and a single pass for the raw norms ‖x‖
+    (only if 'sam' is requested).  The background is factored once, when the bank is
+    built; R⁻¹ for CEM is derived from Σ⁻¹ by the Sherman–Morrison formula rather than
+    by a second factorization.
+
+    Arguments:
+        detectors (list): (name, target) pairs, where name is one of DETECTORS and
+            target is a d-dimensional spectrum; output row i holds the scores for
+            detectors[i]
+        mean (optional np.array): The d-dimensional background mean μ; zero if omitted
+        covariance (np.array or WhiteningOperator): The d×d background covariance Σ, or
+            a whitening operator built from one
+        dtype (np.dtype): The floating point type for computation
+
+    References:
+
+      Manolakis, D., Marden, D., & Shaw, G. A. (2003). Hyperspectral image processing
+      for automatic target detection applications. Lincoln Laboratory Journal, 14(1),
+      79-116.
+    """
+    def __init__(self, detectors, mean=None, covariance=None, dtype=np.float32):
+        assert covariance is not None, "A background covariance is required"
+        assert len(detectors) > 0, "At least one detector is required"
+        for name, _ in detectors:
+            assert name in DETECTORS, "Unrecognized detector: {}".format(name)
+
+        if isinstance(covariance, WhiteningOperator):
+            white = covariance
+        else:
+            white = whitening_operator(covariance)
+        d = white.bands
+        μ = np.zeros(d) if mean is None else np.asarray(mean, dtype=np.float64)
+
+        self.names = [name for name, _ in detectors]
+        self.dtype = dtype
+        self.bands = d
+        self.mean = μ
+
+        S = np.stack([np.asarray(s, dtype=np.float64) for _, s in detectors], axis=1)
+        assert S.shape[0] == d, "Targets must have one entry per band"
+
+        # Σ⁻¹s = WᵀWs, and likewise for μ
+        W = white.matrix
+        S̃ = white.apply(S)
+        μ̃ = white.apply(μ)
+        Σinv_S = np.matmul(W.transpose(), S̃)
+        Σinv_μ = np.matmul(W.transpose(), μ̃)
+        sΣs = np.einsum('ij,ij->j', S̃, S̃)
+
+        # R⁻¹s = Σ⁻¹s - Σ⁻¹μ(μᵀΣ⁻¹s)/(1 + μᵀΣ⁻¹μ)
+        Rinv_S = Σinv_S - np.outer(Σinv_μ, np.matmul(μ̃, S̃) / (1 + np.dot(μ̃, μ̃)))
+        sRs = np.einsum('ij,ij->j', S, Rinv_S)
+
+        filters = np.empty(S.shape)
+        for i, name in enumerate(self.names):
+            if name == 'amf':
+                filters[:,i] = Σinv_S[:,i] / sΣs[i]
+            elif name in ('ace', 'nmf'):
+                filters[:,i] = Σinv_S[:,i] / np.sqrt(sΣs[i])
+            elif name == 'cem':
+                filters[:,i] = Rinv_S[:,i] / sRs[i]
+            else:
+                filters[:,i] = S[:,i] / np.linalg.norm(S[:,i])
+
+        # Centering is folded into an offset for the detectors that use it
+        centered = np.array([name in ('amf', 'ace', 'nmf') for name in self.names])
+        offset = np.where(centered, np.matmul(μ, filters), 0.0)
+
+        self.filters = np.ascontiguousarray(filters.transpose(), dtype=dtype)
+        self.offset = offset.astype(dtype)[:,None]
+
+        self.whitened_norm = any(name in ('ace', 'nmf') for name in self.names)
+        self.input_norm = 'sam' in self.names
+        if self.whitened_norm:
+            self.cholesky = white.method == 'cholesky'
+            factor = white.factor if self.cholesky else W
+            self.factor = np.ascontiguousarray(factor, dtype=dtype)
+            self.factor_offset = μ̃.astype(dtype)[:,None]
+
+    @staticmethod
+    def from_accumulator(accumulator, detectors, dtype=np.float32):
+        """
+        Build a bank against the mean and covariance of a CovarianceAccumulator
+        """
+        return DetectorBank(detectors, mean=accumulator.mean, covariance=accumulator.covariance,
+                            dtype=dtype)
+
+    def apply_bands(self, data):
+        """
+        Score a b×h×w block of pixels, as read by rasterio
+
+        Returns a k×h×w array of scores for the k detectors in the bank
+        """
+        b, h, w = data.shape
+        return self.apply(data.reshape((b, h * w))).reshape((len(self.names), h, w))
+
+    def apply(self, data):
+        """
+        Score a d-dimensional pixel, a d×n matrix of pixels as columns, or an r×c×d image
+
+        Returns a k-vector, a k×n matrix, or an r×c×k image of scores respectively
+        """
+        k = len(self.names)
+        if len(data.shape) == 3:
+            r, c, d = data.shape
+            scores = self.apply(data.reshape((r * c, d)).transpose())
+            return scores.transpose().reshape((r, c, k))
+        elif len(data.shape) == 1:
+            return self.apply(data.reshape((-1, 1)))[:,0]
+
+        X = np.asarray(data, dtype=self.dtype)
+        scores = np.matmul(self.filters, X)
+        scores -= self.offset
+
+        if self.whitened_norm:
+            if self.cholesky:
+                Z = scipy.linalg.solve_triangular(self.factor, X, lower=True)
+            else:
+                Z = np.matmul(self.factor, X)
+            Z -= self.factor_offset
+            whitened_norms = np.sqrt(np.einsum('ij,ij->j', Z, Z))
+        if self.input_norm:
+            input_norms = np.sqrt(np.einsum('ij,ij->j', X, X))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i, name in enumerate(self.names):
+                if name == 'ace':
+                    scores[i] /= whitened_norms
+                    scores[i] *= scores[i]
+                elif name == 'nmf':
+                    scores[i] /= whitened_norms
+                elif name == 'sam':
+                    scores[i] /= input_norms
+                    np.clip(scores[i], -1, 1, out=scores[i])
+                    np.arccos(scores[i], out=scores[i])
+        return scores
+
+    def run_raster(self, infile, outfile, bands=None, nodata=None):
+        """
+        Run every detector in the bank over a raster with one read of each window
+
+        Output band i holds the scores of detectors[i], as float32, with NaN for invalid
+        pixels, and is described by the detector name and position.
+
+        Arguments:
+          infile (str): Path of the input raster of d bands (after any band selection)
+          outfile (str): Path of the output GeoTIFF
+          bands (optional int list): 1-based indices of the input bands to use
+          nodata (optional float): Input value marking invalid pixels
+        """
+        def score(X):
+            assert X.shape[0] == self.bands, "Input must have one band per target entry"
+            return self.apply(X)
+
+        descriptions = ['{}_{}'.format(name, i) for i, name in enumerate(self.names)]
+        score_raster(infile, outfile, score, len(self.names), bands=bands, nodata=nodata,
+                     descriptions=descriptions)
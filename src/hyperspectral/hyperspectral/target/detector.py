@@ -0,0 +1,183 @@
+import numpy as np
+import scipy.linalg
+
+from hyperspectral.math.whitening import WhiteningOperator, whitening_operator
+
+
+class DetectorOperator:
+    """
+    A linear target detector compiled to the fewest possible per-pixel operations
+
+    Scores have the form
+
+        score(x) = ((x - m)ᵀF - o) / ‖x‖
+
+    where F is a d×t matrix of filters (one column per target), m is a center, o is a
+    per-target offset, and ‖x‖ is one of: no normalization, the Euclidean norm of the
+    raw pixel, or the whitened norm ‖W(x - m)‖ = √((x - m)ᵀΣ⁻¹(x - m)).
+
+    For a matched filter, the whitening of the pixel and the target are folded into
+    F = WᵀWs = Σ⁻¹s, so the numerator costs one multiply-add per band and target, and
+    the centering is folded into a constant offset m·F rather than a pass over the
+    data.  The whitened norm is computed from a triangular solve against the Cholesky
+    factor of Σ (half the cost of a full b×b whitening), or, with low-rank truncation,
+    from a k×d projection onto the leading principal components of Σ.
+
+    Folding the center into constants trades a pass over the data for cancellation
+    error when the center is large relative to the spread of the pixels; use float64
+    (or center the data beforehand) for such data.
+
+    Instances are usually built with matched_filter or from_whitening_matrix.
+
+    Arguments:
+        filters (np.array): A d×t matrix of filters, or a d-dimensional filter
+        center (optional np.array): A d-dimensional center m
+        offset (optional np.array): A t-dimensional offset o subtracted from each score
+        norm (optional str): None, 'input' (‖x‖) or 'whitened' (‖W(x - m)‖)
+        factor (optional np.array): For norm='whitened', either the lower-triangular
+            d×d Cholesky factor of Σ, or a k×d whitening projection
+        low_rank (bool): Whether factor is a k×d projection rather than a Cholesky
+            factor
+        dtype (np.dtype): The floating point type for computation
+    """
+    def __init__(self, filters, center=None, offset=None, norm=None, factor=None,
+                 low_rank=False, dtype=np.float32):
+        assert norm in {None, 'input', 'whitened'}, "Unrecognized normalization: {}".format(norm)
+        assert norm != 'whitened' or factor is not None, "Whitened norm requires a factor"
+
+        if len(filters.shape) == 1:
+            filters = filters.reshape((-1, 1))
+        self.dtype = dtype
+        self.bands, self.targets = filters.shape
+        self.filters = np.ascontiguousarray(filters.transpose(), dtype=dtype)
+        self.center = None if center is None else np.asarray(center, dtype=np.float64)
+
+        offset = np.zeros(self.targets) if offset is None else np.asarray(offset, dtype=np.float64)
+        if self.center is not None:
+            offset = offset + np.matmul(self.center, filters)
+        self.offset = offset.astype(dtype)[:,None]
+
+        self.norm = norm
+        self.low_rank = low_rank
+        if norm == 'whitened':
+            self.factor = np.ascontiguousarray(factor, dtype=dtype)
+            # W(x - m) = Wx - Wm, so the center is subtracted after whitening
+            if self.center is None:
+                self.factor_offset = None
+            elif low_rank:
+                self.factor_offset = np.matmul(factor, self.center).astype(dtype)[:,None]
+            else:
+                self.factor_offset = scipy.linalg.solve_triangular(
+                    factor, self.center, lower=True).astype(dtype)[:,None]
+
+    @staticmethod
+    def matched_filter(targets, clutter_cov, center=None, rank=None, dtype=np.float32):
+        """
+        Compile a normalized matched filter
+
+        Scores are the cosines of the angles between the whitened, centered pixels and
+        the whitened targets, as computed by normalized_matched_filter.
+
+        Arguments:
+            targets (np.array): A d×t matrix of target spectra as columns, or a single
+                d-dimensional target
+            clutter_cov (np.array or WhiteningOperator): The d×d clutter covariance, or
+                a whitening operator built from one; a covariance is factored by
+                Cholesky, falling back to eigh when it is not positive definite
+            center (optional np.array): A d-dimensional center for the pixels
+            rank (optional int): If given, whiten within the span of the leading rank
+                principal components of the covariance only
+            dtype (np.dtype): The floating point type for computation
+        """
+        if len(targets.shape) == 1:
+            targets = targets.reshape((-1, 1))
+
+        if isinstance(clutter_cov, WhiteningOperator):
+            white = clutter_cov
+        elif rank is None:
+            try:
+                white = whitening_operator(clutter_cov, method='cholesky')
+            except np.linalg.LinAlgError:
+                # Rank-deficient covariances (such as from fewer pixels than bands) have
+                # no Cholesky factor; the eigh operator floors their eigenvalues
+                white = whitening_operator(clutter_cov)
+        else:
+            white = whitening_operator(clutter_cov)
+
+        if white.method == 'cholesky':
+            assert rank is None, "Low-rank filters require an eigh whitening operator"
+            L = white.factor
+            s̃ = scipy.linalg.solve_triangular(L, targets, lower=True)
+            filters = scipy.linalg.solve_triangular(L.transpose(), s̃, lower=False)
+            return DetectorOperator(filters / np.linalg.norm(s̃, axis=0), center=center,
+                                    norm='whitened', factor=L, dtype=dtype)
+
+        if rank is None:
+            P = white.matrix
+        else:
+            # eigh orders eigenvalues from smallest to largest
+            w = white.eigenvalues[-rank:]
+            V = white.eigenvectors[:,-rank:]
+            P = (V / np.sqrt(w)).transpose()
+
+        s̃ = np.matmul(P, targets)
+        filters = np.matmul(P.transpose(), s̃ / np.linalg.norm(s̃, axis=0))
+        return DetectorOperator(filters, center=center, norm='whitened', factor=P,
+                                low_rank=True, dtype=dtype)
+
+    @staticmethod
+    def from_whitening_matrix(W, spectra, normalize=True, dtype=np.float32):
+        """
+        Compile the detector (x/‖x‖)ᵀWs used by the target detection activator
+
+        Arguments:
+            W (np.array): A d×d whitening matrix, applied to pixels as row vectors
+            spectra (np.array): A d×t matrix of spectra, or a single spectrum
+            normalize (bool): Whether to divide by the norm of the raw pixel
+            dtype (np.dtype): The floating point type for computation
+        """
+        return DetectorOperator(np.matmul(W, spectra), norm='input' if normalize else None,
+                                dtype=dtype)
+
+    def apply_bands(self, data):
+        """
+        Score a b×h×w block of pixels, as read by rasterio
+
+        Returns a t×h×w array of scores
+        """
+        b, h, w = data.shape
+        return self.apply(data.reshape((b, h * w))).reshape((self.targets, h, w))
+
+    def apply(self, data):
+        """
+        Score a d-dimensional pixel, a d×n matrix of pixels as columns, or an r×c×d image
+
+        Returns a t-vector, a t×n matrix, or an r×c×t image of scores respectively
+        """
+        if len(data.shape) == 3:
+            r, c, d = data.shape
+            scores = self.apply(data.reshape((r * c, d)).transpose())
+            return scores.transpose().reshape((r, c, self.targets))
+        elif len(data.shape) == 1:
+            return self.apply(data.reshape((-1, 1)))[:,0]
+
+        X = np.asarray(data, dtype=self.dtype)
+        scores = np.matmul(self.filters, X)
+        scores -= self.offset
+
+        if self.norm == 'input':
+            norms = np.sqrt(np.einsum('ij,ij->j', X, X))
+        elif self.norm == 'whitened':
+            if self.low_rank:
+                Z = np.matmul(self.factor, X)
+            else:
+                Z = scipy.linalg.solve_triangular(self.factor, X, lower=True)
+            if self.factor_offset is not None:
+                Z -= self.factor_offset
+            norms = np.sqrt(np.einsum('ij,ij->j', Z, Z))
+        else:
+            return scores
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores /= norms
+        return scores
@@ -0,0 +1,359 @@
+import numpy as np
+
+LOCAL_DETECTORS = ('amf', 'ace', 'nmf')
+
+
+def _box_sums(S, lo, hi):
+    """
+    The sums of S[lo[j]:hi[j]] along the first axis, for each j
+
+    When the window ends are sparse, prefix sums are only formed at them, by one
+    np.add.reduceat pass over S, so no prefix-sum array the size of S is allocated.
+    """
+    edges, inverse = np.unique(np.concatenate([[0], lo, hi]), return_inverse=True)
+    cuts = edges[edges < len(S)]
+    if 2 * len(cuts) > len(S):
+        # reduceat over many short segments is slower than a full cumsum
+        prefix = np.concatenate([np.zeros((1,) + S.shape[1:]), np.cumsum(S, axis=0)])
+        return prefix[hi] - prefix[lo]
+    prefix = np.concatenate([np.zeros((1,) + S.shape[1:]),
+                             np.cumsum(np.add.reduceat(S, cuts, axis=0), axis=0)])
+    inverse = inverse[1:]
+    return prefix[inverse[len(lo):]] - prefix[inverse[:len(lo)]]
+
+
+class _StripSums:
+    """
+    Running sums of x, xxᵀ and pixel counts over a moving strip of image rows
+
+    Column sums over rows [i - h, i + h] are kept up to date by adding the row
+    entering the strip and subtracting the row leaving it, and box sums over
+    (2h + 1)×(2h + 1) windows are then differences of prefix sums along the row.
+    Each window sum costs O(b²) per pixel regardless of the window size.
+    """
+    def __init__(self, half, c, b):
+        self.half = half
+        self.n = np.zeros(c)
+        self.x = np.zeros((c, b))
+        self.xx = np.zeros((c, b, b))
+
+    def add(self, row, valid, sign=1):
+        self.n += sign * valid
+        self.x += sign * row
+        self.xx += sign * (row[:,:,None] * row[:,None,:])
+
+    def boxes(self, columns=None):
+        """
+        Sums over the windows centered on the given columns (all columns if omitted),
+        clipped to the image; the sums of xxᵀ are only formed if columns are given
+        """
+        c = len(self.n)
+        lo = np.maximum(np.arange(c) - self.half, 0)
+        hi = np.minimum(np.arange(c) + self.half + 1, c)
+        n, x = _box_sums(self.n, lo, hi), _box_sums(self.x, lo, hi)
+        if columns is None:
+            return n, x, None
+        return n, x, _box_sums(self.xx, lo[columns], hi[columns])
+
+
+def _woodbury(Q, entering, leaving, Sx_old, n_old, Sx_new, n_new):
+    """
+    Update a batch of inverses Q = (C + ρI)⁻¹ of regularized scatter matrices
+    C = Σxxᵀ - (Σx)(Σx)ᵀ/n for pixels entering and leaving their windows
+
+    The change in C is UUᵀ - DDᵀ - (Σx')(Σx')ᵀ/n' + (Σx)(Σx)ᵀ/n for g×m×b stacks of
+    entering pixels U and leaving pixels D (zero-padded), so of rank m + 2 at most, and
+    the inverse follows by the Woodbury identity in O(b²m) rather than O(b³).
+    """
+    W = np.concatenate([entering, leaving, Sx_new[:,None,:] / np.sqrt(n_new)[:,None,None],
+                        Sx_old[:,None,:] / np.sqrt(n_old)[:,None,None]], axis=1)
+    σ = np.concatenate([np.ones(entering.shape[1]), -np.ones(leaving.shape[1]), [-1, 1]])
+    QW = np.matmul(Q, W.transpose((0, 2, 1)))
+    K = np.matmul(W, QW) + np.diag(σ)
+    Q = Q - np.matmul(QW, np.linalg.solve(K, QW.transpose((0, 2, 1))))
+    # Keep rounding from breaking symmetry over long runs of updates
+    return (Q + Q.transpose((0, 2, 1))) / 2
+
+
+def _local_rows(read_row, r, c, b, window, guard, refresh, regularization, incremental):
+    """
+    Yield the local means and inverse covariances for each row of pixels
+
+    read_row(i) returns row i as a c×b array and a c-element validity mask.  Yields,
+    for each row, the row, its mask, the c×b local means, and a sequence of (columns,
+    inverses) pairs covering the row, where the inverses are g×b×b (each up to a
+    positive scale, which no detector depends on) for the g columns given.
+    """
+    outer = _StripSums(window // 2, c, b)
+    inner = _StripSums(guard // 2, c, b) if guard > 0 else None
+    strips = [s for s in (outer, inner) if s is not None]
+    h, q = outer.half, (guard // 2 if guard > 0 else -1)
+
+    rows = {}
+
+    def row(i):
+        if i not in rows:
+            x, valid = read_row(i)
+            rows[i] = (np.where(valid[:,None], x, 0).astype(np.float64), valid)
+        return rows[i]
+
+    def pixels(i0, i1, j0, j1):
+        """
+        A g×m×b stack of the pixels of rows i0..i1 and columns j0..j1 of g windows,
+        given as scalars or g-element arrays, zero-padded where clipped to the image
+        """
+        i0, i1, j0, j1 = np.broadcast_arrays(i0, i1, j0, j1)
+        ii = i0[:,None] + np.arange(np.max(i1 - i0) + 1)
+        jj = j0[:,None] + np.arange(np.max(j1 - j0) + 1)
+        ii, jj = np.broadcast_arrays(ii, jj)
+        inside = (ii <= i1[:,None]) & (jj <= j1[:,None]) & (ii >= 0) & (ii < r) & \
+            (jj >= 0) & (jj < c)
+        out = np.zeros(ii.shape + (b,))
+        for k in np.unique(ii[inside]):
+            at = inside & (ii == k)
+            out[at] = row(k)[0][jj[at]]
+        return out
+
+    def statistics(columns=None):
+        n, Sx, Sxx = outer.boxes(columns)
+        if inner is not None:
+            n_g, Sx_g, Sxx_g = inner.boxes(columns)
+            n, Sx = n - n_g, Sx - Sx_g
+            if columns is not None:
+                Sxx = Sxx - Sxx_g
+        return np.maximum(n, 2), Sx, Sxx
+
+    def exact(n, Sx, Sxx):
+        """Regularized inverse scatter matrices, with the load ρ = λ·tr(C)/b"""
+        C = Sxx - Sx[:,:,None] * Sx[:,None,:] / n[:,None,None]
+        load = regularization * np.trace(C, axis1=1, axis2=2) / b
+        return np.linalg.inv(C + load[:,None,None] * np.eye(b))
+
+    for s in strips:
+        for i in range(min(s.half, r)):
+            s.add(*row(i))
+
+    anchors = np.arange(0, c, refresh)
+    Q = None
+    for i in range(r):
+        for s in strips:
+            if i + s.half < r:
+                s.add(*row(i + s.half))
+            if i - s.half - 1 >= 0:
+                s.add(*row(i - s.half - 1), sign=-1)
+
+        n_all, Sx_all, _ = statistics()
+        μ = Sx_all / n_all[:,None]
+        x, valid = row(i)
+        if i % refresh == 0:
+            # The covariances are only formed and inverted at the anchor columns
+            _, _, Sxx = statistics(anchors)
+            Q = exact(n_all[anchors], Sx_all[anchors], Sxx)
+        elif incremental:
+            # Move each anchor's window down a row: the outer window gains row i + h
+            # and loses row i - h - 1, and the guard window releases row i - q - 1
+            # back into the background and takes in row i + q
+            a = anchors
+            entering = [pixels(i + h, i + h, a - h, a + h)]
+            leaving = [pixels(i - h - 1, i - h - 1, a - h, a + h)]
+            if inner is not None:
+                entering.append(pixels(i - q - 1, i - q - 1, a - q, a + q))
+                leaving.append(pixels(i + q, i + q, a - q, a + q))
+            Q = _woodbury(Q, np.concatenate(entering, axis=1), np.concatenate(leaving, axis=1),
+                          Sx_prev, n_prev, Sx_all[a], n_all[a])
+        n_prev, Sx_prev = n_all[anchors], Sx_all[anchors]
+
+        def steps(Q=Q):
+            if not incremental:
+                # Each anchor's inverse is held for the following refresh - 1 rows and
+                # columns
+                for t in range(refresh):
+                    cols = anchors[anchors + t < c] + t
+                    yield cols, Q[:len(cols)]
+                return
+            # Move each window right a column at a time from its anchor: the outer
+            # window gains column j + h + 1 and loses column j - h, and the guard
+            # window releases column j - q and takes in column j + q + 1
+            yield anchors, Q
+            j = anchors
+            for _ in range(1, refresh):
+                # Windows that would move past the last column are finished
+                live = j + 1 < c
+                j, Q = j[live], Q[live]
+                if len(j) == 0:
+                    return
+                entering = [pixels(i - h, i + h, j + h + 1, j + h + 1)]
+                leaving = [pixels(i - h, i + h, j - h, j - h)]
+                if inner is not None:
+                    entering.append(pixels(i - q, i + q, j - q, j - q))
+                    leaving.append(pixels(i - q, i + q, j + q + 1, j + q + 1))
+                Q = _woodbury(Q, np.concatenate(entering, axis=1),
+                              np.concatenate(leaving, axis=1), Sx_all[j], n_all[j],
+                              Sx_all[j + 1], n_all[j + 1])
+                j = j + 1
+                yield j, Q
+
+        yield x, valid, μ, steps()
+        # Rows are only needed until the row above leaves the outer strip
+        rows.pop(i - h - 1, None)
+
+
+def _local_scores(rows, targets, detector):
+    """Score rows of pixels against their local backgrounds"""
+    for x, valid, μ, steps in rows:
+        x̄ = x - μ
+        num = np.empty((len(x), targets.shape[1]))
+        sPs = np.empty_like(num)
+        q = np.empty(len(x))
+        for cols, P in steps:
+            PS = np.matmul(P, targets)
+            sPs[cols] = np.einsum('bt,jbt->jt', targets, PS)
+            num[cols] = np.matmul(x̄[cols,None,:], PS)[:,0,:]
+            if detector != 'amf':
+                q[cols] = np.einsum('jb,jb->j', np.matmul(x̄[cols,None,:], P)[:,0,:], x̄[cols])
+
+        if detector == 'amf':
+            scores = num / sPs
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores = num / np.sqrt(sPs * q[:,None])
+            if detector == 'ace':
+                scores *= scores
+        scores[~valid] = np.nan
+        yield scores
+
+
+def local_matched_filter(image, targets, window=15, guard=0, refresh=1, regularization=1e-3,
+                         detector='nmf', incremental=True):
+    """
+    Perform target detection against a local background estimated around each pixel
+
+    The background mean and covariance for each pixel are estimated from the pixels
+    in a window×window box centered on it (clipped at the image edges), less an
+    optional guard×guard box that keeps the pixel and its immediate neighbours (and so
+    the target itself) out of its own background.  The box statistics are kept as
+    running sums of x and xxᵀ over a moving strip of rows, so the cost per pixel is
+    O(b²) for the statistics, independent of the window size, rather than O(w²b²).
+
+    Inverting the local covariance costs O(b³), and dominates for all but the smallest
+    b; with refresh = k the inverse is only computed afresh at every k-th pixel of
+    every k-th row.  With incremental updates, the inverse for every other pixel is
+    carried over from its neighbour (down the anchor columns, then along each row)
+    by a Woodbury update for the pixels entering and leaving the window, a change of
+    rank about 2·window (2·(window + guard) with a guard), at O(b²·window) rather
+    than O(b³).  The diagonal loading is held from the last fresh inverse, so scores
+    differ from refresh = 1 only by the drift of the loading and by rounding; refreshes
+    bound both.  Without incremental updates, each inverse is instead held for the k×k
+    block of pixels that follows, which is cheaper still but approximate, and suits
+    backgrounds that change slowly relative to the window size.  The local mean is
+    exact for every pixel either way.
+
+    Pixels with NaN in any band are excluded from the backgrounds and scored NaN.
+
+    Arguments:
+      image (numpy.array): An r×c×d image of d-dimensional spectra
+      targets (numpy.array): A d×t matrix whose columns are target spectra, or a single
+        d-dimensional target
+      window (int): Side length of the (odd-sized) background window
+      guard (int): Side length of the (odd-sized) guard window excluded from the
+        background, or 0 for none
+      refresh (int): Pixel stride at which local inverse covariances are recomputed
+      incremental (bool): Whether to update the inverse covariance from pixel to pixel
+        between refreshes, rather than holding it
+      regularization (float): Diagonal loading for each local covariance, as a
+        fraction of its mean eigenvalue; windows with fewer than d pixels are singular
+        without it
+      detector (str): 'nmf' for the normalized matched filter of
+        normalized_matched_filter, 'ace' for its square, or 'amf' for the adaptive
+        matched filter sᵀΣ⁻¹(x - μ) / sᵀΣ⁻¹s
+
+    Returns an r×c×t image of scores, or r×c for a single target.
+
+    References:
+
+      Manolakis, D., Marden, D., & Shaw, G. A. (2003). Hyperspectral image processing
+      for automatic target detection applications. Lincoln Laboratory Journal, 14(1),
+      79-116.
+    """
+    assert window % 2 == 1 and (guard == 0 or guard % 2 == 1), "Windows must have odd sizes"
+    assert guard < window, "The guard window must be smaller than the background window"
+    assert detector in LOCAL_DETECTORS, "Unrecognized detector: {}".format(detector)
+
+    single = len(targets.shape) == 1
+    if single:
+        targets = targets.reshape((-1, 1))
+    r, c, d = image.shape
+    assert targets.shape[0] == d, "Targets must have one entry per band"
+
+    def read_row(i):
+        x = image[i]
+        return x, ~np.any(np.isnan(x), axis=1)
+
+    rows = _local_rows(read_row, r, c, d, window, guard, refresh, regularization,
+                       incremental)
+    scores = np.stack(list(_local_scores(rows, targets.astype(np.float64), detector)))
+    return scores[:,:,0] if single else scores
+
+
+def local_matched_filter_raster(infile, outfile, targets, window=15, guard=0, refresh=1,
+                                regularization=1e-3, detector='nmf', bands=None, nodata=None,
+                                incremental=True):
+    """
+    Run local_matched_filter over a raster too large to hold in memory
+
+    The input is read one row at a time, and only the rows inside the moving window
+    are held, so memory use is O(window·c·b + c·b²) for a c-column, b-band raster.
+    Output band i holds the scores for target column i, as float32, with NaN for
+    invalid pixels.
+
+    Arguments:
+      infile (str): Path of the input raster of d bands (after any band selection)
+      outfile (str): Path of the output GeoTIFF
+      targets (numpy.array): A d×t matrix whose columns are target spectra
+      bands (optional int list): 1-based indices of the input bands to use
+      nodata (optional float): Input value marking invalid pixels
+      Other arguments are as for local_matched_filter
+    """
+    import rasterio as rio
+    from rasterio.windows import Window
+
+    from hyperspectral.target.raster import invalid_pixels
+
+    assert detector in LOCAL_DETECTORS, "Unrecognized detector: {}".format(detector)
+    if len(targets.shape) == 1:
+        targets = targets.reshape((-1, 1))
+    t = targets.shape[1]
+
+    with rio.open(infile, 'r') as in_ds:
+        r, c = in_ds.height, in_ds.width
+        d = len(bands) if bands is not None else in_ds.count
+        assert targets.shape[0] == d, "Targets must have one entry per input band"
+
+        def read_row(i):
+            X = in_ds.read(bands, window=Window(0, i, c, 1)).reshape((d, c))
+            return X.transpose(), ~invalid_pixels(X, nodata)
+
+        profile = in_ds.profile.copy()
+        profile.pop('blockxsize', None)
+        profile.pop('blockysize', None)
+        profile.update({
+            'driver': 'GTiff',
+            'count': t,
+            'dtype': np.float32,
+            'nodata': np.nan,
+            'compress': 'lzw',
+            'tiled': 'yes',
+            'bigtiff': 'yes',
+        })
+        rows = _local_rows(read_row, r, c, d, window, guard, refresh, regularization,
+                               incremental)
+        with rio.open(outfile, 'w', **profile) as out_ds:
+            # Rows are written in strips of the output block height
+            strip = out_ds.block_shapes[0][0]
+            buf = []
+            for i, scores in enumerate(_local_scores(rows, targets.astype(np.float64), detector)):
+                buf.append(scores.transpose())
+                if len(buf) == strip or i == r - 1:
+                    block = np.stack(buf, axis=1).astype(np.float32)
+                    out_ds.write(block, window=Window(0, i + 1 - len(buf), c, len(buf)))
+                    buf = []
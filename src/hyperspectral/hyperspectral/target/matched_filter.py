@@ -1,8 +1,8 @@
-import math
-
 import numpy as np
 
-from hyperspectral.math.rpca import whitening_matrix, whiten
+from hyperspectral.math.sampling import raster_blocks, reservoir_sample
+from hyperspectral.target.detector import DetectorOperator
+from hyperspectral.target.raster import score_raster
 
 def normalized_matched_filter(image, target, clutter_cov, center=False):
     """
@@ -16,7 +16,9 @@ def normalized_matched_filter(image, target, clutter_cov, center=False):
     Arguments:
       image (numpy.array): An r×c×d matrix representing an image of d-dimensional spectra
       target (numpy.array): A d-dimensional vector representing the target spectrum
-      clutter_cov (numpy.array): A d×d matrix describing the error model for the spectral bands
+      clutter_cov (numpy.array or WhiteningOperator): A d×d matrix describing the error
+        model for the spectral bands, or a whitening operator built from one; operators
+        for matrices are cached, so repeated calls with the same matrix factor it once
       center (bool): Whether to median-center the data before running the filter
 
     References:
@@ -26,13 +28,55 @@ def normalized_matched_filter(image, target, clutter_cov, center=False):
       Cambridge University Press.
 
     """
-    white = whitening_matrix(clutter_cov)
-
+    m = None
     if center:
         r,c,d = image.shape
-        image = image - np.median(image.reshape((r * c, d)), axis=0)
+        m = np.median(image.reshape((r * c, d)), axis=0)
+
+    detector = DetectorOperator.matched_filter(target, clutter_cov, center=m, dtype=np.float64)
+    return detector.apply(image)[:,:,0]
+
+
+def normalized_matched_filter_raster(infile, outfile, targets, clutter_cov, center=False,
+                                     bands=None, nodata=None, sample_size=100000, seed=None):
+    """
+    Run the normalized matched filter for several targets over a raster, window by window
+
+    The raster is read one internal block at a time, and the scores for all targets
+    are computed with one matrix product per block plus the whitened pixel norms.  At
+    most a single block of whitened data is held in memory, so this can run on full
+    flight lines.  Output band i holds the scores for target column i, as float32, with NaN
+    for invalid pixels.  Scores are computed in float32 with a DetectorOperator.
+
+    Arguments:
+      infile (str): Path of the input raster of d bands (after any band selection)
+      outfile (str): Path of the output GeoTIFF
+      targets (numpy.array): A d×t matrix whose columns are target spectra
+      clutter_cov (numpy.array or WhiteningOperator): The d×d clutter covariance, or a
+        whitening operator built from one
+      center (bool or numpy.array): Whether to median-center the data; the median is
+        estimated from a reservoir sample of sample_size pixels, which costs one extra
+        pass over the raster.  A d-dimensional vector may also be given to center on.
+      bands (optional int list): 1-based indices of the input bands to use
+      nodata (optional float): Input value marking invalid pixels
+      sample_size (int): Number of pixels sampled to estimate the median
+      seed (optional int): Seed for the median sample
+    """
+    if len(targets.shape) == 1:
+        targets = targets.reshape((-1, 1))
+    d, t = targets.shape
+
+    if center is True:
+        samples, _ = reservoir_sample(raster_blocks(infile, bands), sample_size,
+                                      nodata=nodata, seed=seed)
+        center = np.median(samples, axis=1)
+    elif center is False:
+        center = None
+
+    detector = DetectorOperator.matched_filter(targets, clutter_cov, center=center)
 
-    X̃ = whiten(image, white_matrix=white)
-    s̃ = whiten(target, white_matrix=white)
+    def score(X):
+        assert X.shape[0] == d, "Targets must have one entry per input band"
+        return detector.apply(X)
 
-    return np.divide(np.einsum('i,rci->rc', s̃, X̃), np.sqrt(np.einsum('rci,rci->rc',X̃, X̃)))/math.sqrt(np.inner(s̃, s̃))
+    score_raster(infile, outfile, score, t, bands=bands, nodata=nodata)
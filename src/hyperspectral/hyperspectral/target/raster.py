@@ -0,0 +1,65 @@
+import numpy as np
+
+
+def invalid_pixels(X, nodata=None):
+    """
+    Flag the columns of a d×n matrix of pixels holding NaN, or nodata, in any band
+    """
+    invalid = np.any(np.isnan(X), axis=0)
+    if nodata is not None:
+        invalid |= np.any(X == nodata, axis=0)
+    return invalid
+
+
+def score_raster(infile, outfile, score, count, bands=None, nodata=None, descriptions=None,
+                 windowed=False):
+    """
+    Apply a per-pixel scoring function to a raster, window by window
+
+    Each internal block of the input is read once, flattened to a d×n matrix of pixels,
+    and passed to `score`, so any work shared between output bands is done once per
+    block.  Invalid pixels are written as NaN.
+
+    Arguments:
+      infile (str): Path of the input raster
+      outfile (str): Path of the output GeoTIFF
+      score (function): Maps a d×n matrix of pixels to a count×n matrix of scores
+      count (int): Number of output bands
+      bands (optional int list): 1-based indices of the input bands to use
+      nodata (optional float): Input value marking invalid pixels
+      descriptions (optional str list): Descriptions of the output bands
+      windowed (bool): Pass the rasterio Window of each block to `score` as a second
+          argument
+    """
+    import rasterio as rio
+
+    with rio.open(infile, 'r') as in_ds:
+        profile = in_ds.profile.copy()
+        if not profile.get('tiled', False):
+            # Strip sizes are not valid tile sizes; let GDAL choose the tiling
+            profile.pop('blockxsize', None)
+            profile.pop('blockysize', None)
+        profile.update({
+            'driver': 'GTiff',
+            'count': count,
+            'dtype': np.float32,
+            'nodata': np.nan,
+            'compress': 'lzw',
+            'tiled': 'yes',
+            'bigtiff': 'yes',
+        })
+        with rio.open(outfile, 'w', **profile) as out_ds:
+            if descriptions is not None:
+                for i, description in enumerate(descriptions):
+                    out_ds.set_band_description(i + 1, description)
+
+            for _, window in in_ds.block_windows(1):
+                data = in_ds.read(bands, window=window)
+                b, h, w = data.shape
+                X = data.reshape((b, h * w))
+                invalid = invalid_pixels(X, nodata)
+
+                scores = score(X, window) if windowed else score(X)
+                scores[:,invalid] = np.nan
+
+                out_ds.write(scores.reshape((count, h, w)).astype(np.float32), window=window)
@@ -0,0 +1 @@
+from .sunsal import SparseUnmixer, sunsal
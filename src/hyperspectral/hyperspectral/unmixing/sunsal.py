@@ -0,0 +1,230 @@
+import numpy as np
+import scipy.linalg
+
+from hyperspectral.target.raster import score_raster
+
+
+class SparseUnmixer:
+    """
+    Sparse unmixing by variable splitting and augmented Lagrangian (SUnSAL)
+
+    Solves, for every pixel y, the sparse regression
+
+        min ½‖y - Rα‖² + λ‖α‖₁
+        subject to α ≥ 0 (ANC) and, optionally, 1ᵀα = 1 (ASC)
+
+    for the abundances α of the m endmembers in the columns of R, by the alternating
+    direction method of multipliers (ADMM).  Splitting α = z leaves a least squares step
+    with the fixed matrix (RᵀR + μI)⁻¹, which is factored once when the unmixer is
+    built, and a proximal step that is a (non-negative) soft threshold.  Both steps are
+    applied to a whole m×n matrix of abundances at once, so every iteration over a
+    block of pixels is a pair of matrix products and some elementwise work.
+
+    The solution for one block can seed the iterations for the next (see apply), which
+    for neighbouring blocks of a scene saves most of the iterations.
+
+    Arguments:
+        endmembers (np.array or SpectralLibrary): The d×m matrix R, or a regular
+            library whose model matrix is R
+        λ (float): Weight of the ℓ₁ penalty; 0 gives (fully) constrained least squares
+        μ (optional float): ADMM penalty parameter; by default a tenth of the mean
+            squared endmember norm, which scales with the data
+        positivity (bool): Apply the abundance non-negativity constraint
+        sum_to_one (bool): Apply the abundance sum-to-one constraint
+        max_iters (int): Largest number of ADMM iterations per block
+        tol (float): Stop once the primal and dual residuals, per abundance, fall below
+            tol times the RMS abundance
+        relaxation (float): Over-relaxation factor for the ADMM iterations, in (0, 2);
+            values of 1.5–1.8 typically converge in a third fewer iterations than 1
+        dtype (np.dtype): The floating point type for computation
+
+    References:
+
+      Bioucas-Dias, J. M., & Figueiredo, M. A. T. (2010). Alternating direction
+      algorithms for constrained sparse regression: Application to hyperspectral
+      unmixing. 2nd Workshop on Hyperspectral Image and Signal Processing: Evolution in
+      Remote Sensing (WHISPERS).
+
+      Iordache, M.-D., Bioucas-Dias, J. M., & Plaza, A. (2011). Sparse unmixing of
+      hyperspectral data. IEEE Transactions on Geoscience and Remote Sensing, 49(6),
+      2014-2039.
+    """
+    def __init__(self, endmembers, λ=0.0, μ=None, positivity=True, sum_to_one=False,
+                 max_iters=500, tol=1e-4, relaxation=1.6, dtype=np.float32):
+        if hasattr(endmembers, 'model_matrix'):
+            self.source_bands = list(endmembers.source_bands)
+            endmembers = endmembers.model_matrix
+        else:
+            self.source_bands = None
+        R = np.asarray(endmembers, dtype=np.float64)
+        assert not np.any(np.isnan(R)), "Endmembers must not hold NaN"
+        d, m = R.shape
+
+        RtR = np.matmul(R.transpose(), R)
+        if μ is None:
+            μ = 0.1 * np.trace(RtR) / m
+        self.λ = λ
+        self.μ = μ
+        self.positivity = positivity
+        self.sum_to_one = sum_to_one
+        self.max_iters = max_iters
+        self.tol = tol
+        self.relaxation = relaxation
+        self.dtype = dtype
+        self.bands = d
+        self.endmembers = m
+
+        # The one factorization: B = (RᵀR + μI)⁻¹, applied as a matrix product
+        factor = scipy.linalg.cho_factor(RtR + μ * np.eye(m))
+        B = scipy.linalg.cho_solve(factor, np.eye(m))
+        if sum_to_one:
+            # Project the least squares step onto 1ᵀα = 1: α = Bw - C(1ᵀBw - 1)
+            B1 = np.sum(B, axis=1)
+            self.C = (B1 / np.sum(B1)).astype(dtype)[:,None]
+        self.B = np.ascontiguousarray(B, dtype=dtype)
+        self.Rt = np.ascontiguousarray(R.transpose(), dtype=dtype)
+        self.R = np.ascontiguousarray(R, dtype=dtype)
+        self.iterations = None
+
+    def _proximal(self, V):
+        """The proximal step: soft thresholding, clipped at zero under the ANC"""
+        t = self.λ / self.μ
+        if self.positivity:
+            return np.maximum(V - t, 0)
+        if t == 0:
+            return V
+        return np.sign(V) * np.maximum(np.abs(V) - t, 0)
+
+    def apply(self, data, init=None):
+        """
+        Unmix a d×n matrix of pixels as columns
+
+        Arguments:
+            data (np.array): The pixels
+            init (optional (np.array, np.array)): Starting m×n abundances and scaled
+                dual variables, such as returned for a neighbouring block; a starting
+                m-vector of abundances may also be given for every pixel
+
+        Returns the m×n abundances, and the (abundances, duals) pair to pass as init to
+        a later call.  The number of iterations taken is left in self.iterations.
+        """
+        Y = np.asarray(data, dtype=self.dtype)
+        assert Y.shape[0] == self.bands, "Input must have one band per endmember sample"
+        n = Y.shape[1]
+        RtY = np.matmul(self.Rt, Y)
+
+        if init is None:
+            Z = self._proximal(np.matmul(self.B, RtY))
+            D = np.zeros_like(Z)
+        else:
+            Z, D = init
+            Z = np.array(np.broadcast_to(np.reshape(Z, (self.endmembers, -1)),
+                                         (self.endmembers, n)), dtype=self.dtype)
+            D = np.array(np.broadcast_to(np.reshape(D, (self.endmembers, -1)),
+                                         (self.endmembers, n)), dtype=self.dtype)
+
+        # Residuals are compared per abundance, so the tolerance does not depend on n
+        scale = self.tol * np.sqrt(self.endmembers * n)
+        for i in range(self.max_iters):
+            X = np.matmul(self.B, RtY + self.μ * (Z + D))
+            if self.sum_to_one:
+                X -= self.C * (np.sum(X, axis=0) - 1)[None,:]
+            Z_prev = Z
+            # Over-relaxation
+            X = self.relaxation * X + (1 - self.relaxation) * Z_prev
+            Z = self._proximal(X - D)
+            D -= X - Z
+
+            if i % 10 == 9 or i == self.max_iters - 1:
+                size = max(np.sqrt(np.mean(np.square(Z))) * scale, np.finfo(self.dtype).eps)
+                primal = np.linalg.norm(X - Z)
+                dual = self.μ * np.linalg.norm(Z - Z_prev)
+                if primal < size and dual < size:
+                    break
+        self.iterations = i + 1
+        return Z, (Z, D)
+
+    def apply_bands(self, data, init=None):
+        """
+        Unmix a b×h×w block of pixels, as read by rasterio
+
+        Returns an m×h×w array of abundances, and the state for a later call to seed
+        from, as for apply
+        """
+        b, h, w = data.shape
+        Z, state = self.apply(data.reshape((b, h * w)), init)
+        return Z.reshape((self.endmembers, h, w)), state
+
+    def run_raster(self, infile, outfile, bands=None, nodata=None, warm_start=True,
+                   descriptions=None, residual=True):
+        """
+        Unmix a raster block by block, streaming abundance bands to disk
+
+        Each block of the input is read once and unmixed as a whole.  With warm_start,
+        each pixel starts from the solution at the nearest pixel already solved in a
+        neighbouring block: the last column of the block to its left, or for the first
+        block of a row, the bottom row of the block above.
+
+        Arguments:
+          infile (str): Path of the input raster
+          outfile (str): Path of the output GeoTIFF, with one band per endmember and,
+              if residual is set, a final band of the RMS fitting residual per pixel
+          bands (optional int list): 1-based indices of the input bands to use; the
+              library's source_bands if the unmixer was built from a library
+          nodata (optional float): Input value marking invalid pixels
+          warm_start (bool): Seed each block from its neighbours
+          descriptions (optional str list): Descriptions of the endmember bands
+          residual (bool): Add a band of RMS residuals
+        """
+        if bands is None and self.source_bands is not None:
+            bands = [b + 1 for b in self.source_bands]
+        m = self.endmembers
+        # Edges of solved blocks: last columns by row offset, bottom rows by column offset
+        right_edges, bottom_edges = {}, {}
+
+        def seed(window):
+            h, w = window.height, window.width
+            left = right_edges.get(window.row_off)
+            if left is not None and left[0].shape[1] == h:
+                return tuple(np.repeat(v[:,:,None], w, axis=2).reshape((m, h * w))
+                             for v in left)
+            above = bottom_edges.get(window.col_off)
+            if above is not None and above[0].shape[1] == w:
+                return tuple(np.repeat(v[:,None,:], h, axis=1).reshape((m, h * w))
+                             for v in above)
+            return None
+
+        def score(Y, window):
+            Y = np.asarray(Y, dtype=self.dtype)
+            valid = np.all(np.isfinite(Y), axis=0)
+            Y = np.where(valid[None,:], Y, 0)
+            Z, state = self.apply(Y, seed(window) if warm_start else None)
+            if warm_start:
+                h, w = window.height, window.width
+                blocks = [v.reshape((m, h, w)) for v in state]
+                right_edges[window.row_off] = tuple(v[:,:,-1].copy() for v in blocks)
+                bottom_edges[window.col_off] = tuple(v[:,-1,:].copy() for v in blocks)
+            if residual:
+                fit = Y - np.matmul(self.R, Z)
+                rms = np.sqrt(np.mean(np.square(fit), axis=0))[None,:]
+                return np.concatenate([Z, rms])
+            return Z
+
+        if descriptions is None:
+            descriptions = ['abundance_{}'.format(i) for i in range(m)]
+        descriptions = list(descriptions) + (['rms_residual'] if residual else [])
+        score_raster(infile, outfile, score, m + (1 if residual else 0), bands=bands,
+                     nodata=nodata, descriptions=descriptions, windowed=True)
+
+
+def sunsal(endmembers, data, λ=0.0, positivity=True, sum_to_one=False, **kwargs):
+    """
+    Unmix a d×n matrix of pixels against the d×m endmember matrix with SUnSAL
+
+    Arguments are as for SparseUnmixer
+
+    Returns the m×n abundances
+    """
+    unmixer = SparseUnmixer(endmembers, λ, positivity=positivity, sum_to_one=sum_to_one,
+                            **kwargs)
+    return unmixer.apply(data)[0]
@@ -0,0 +1,42 @@
+import unittest
+
+import numpy as np
+
+from hyperspectral.math.whitening import whitening_operator
+from hyperspectral.target.detector import DetectorOperator
+from hyperspectral.target.matched_filter import normalized_matched_filter
+
+
+class MatchedFilterTest(unittest.TestCase):
+    def test_singular_covariance(self):
+        # Fewer pixels than bands give a rank-deficient covariance with no Cholesky factor
+        rng = np.random.default_rng(0)
+        d = 20
+        pixels = rng.normal(size=(8, d))
+        cov = np.cov(pixels, rowvar=False)
+        image = rng.normal(size=(4, 5, d))
+        target = rng.normal(size=d)
+
+        scores = normalized_matched_filter(image, target, cov)
+        self.assertEqual(scores.shape, (4, 5))
+        self.assertTrue(np.all(np.isfinite(scores)))
+
+        detector = DetectorOperator.matched_filter(target, cov, dtype=np.float64)
+        self.assertEqual(detector.apply(image).shape, (4, 5, 1))
+
+    def test_cholesky_matches_eigh(self):
+        rng = np.random.default_rng(1)
+        d = 10
+        A = rng.normal(size=(100, d))
+        cov = np.cov(A, rowvar=False)
+        image = rng.normal(size=(3, 4, d))
+        target = rng.normal(size=d)
+
+        cholesky = DetectorOperator.matched_filter(target, cov, dtype=np.float64)
+        eigh = DetectorOperator.matched_filter(target, whitening_operator(cov),
+                                               dtype=np.float64)
+        np.testing.assert_allclose(cholesky.apply(image), eigh.apply(image), atol=1e-8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+import unittest
+
+import numpy as np
+
+from hyperspectral.math.dispersion import HistogramMAD, PartitionMAD
+
+
+class HistogramMADTest(unittest.TestCase):
+    def test_constant_columns(self):
+        rng = np.random.default_rng(0)
+        M = np.stack([np.zeros(1000), np.full(1000, 3.5), rng.normal(size=1000)], axis=1)
+
+        exact = PartitionMAD()(M)
+        approx = HistogramMAD()(M)
+        np.testing.assert_array_equal(approx[:2], [0, 0])
+        self.assertAlmostEqual(approx[2], exact[2], delta=1e-2)
+        self.assertEqual(HistogramMAD()(np.full(10, 2.0)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from hyperspectral.target.local import local_matched_filter
+
+
+class LocalMatchedFilterTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.image = np.cumsum(rng.normal(size=(23, 29, 8)), axis=0)
+        self.image[3, 4, 2] = np.nan
+        self.targets = rng.normal(size=(8, 2))
+
+    def brute_force(self, window, guard, regularization):
+        """Scores from a covariance estimated afresh in every pixel's window"""
+        r, c, d = self.image.shape
+        h, g = window // 2, guard // 2
+        valid = ~np.any(np.isnan(self.image), axis=2)
+        scores = np.full((r, c, self.targets.shape[1]), np.nan)
+        for i in range(r):
+            for j in range(c):
+                mask = np.zeros((r, c), dtype=bool)
+                mask[max(i - h, 0):i + h + 1, max(j - h, 0):j + h + 1] = True
+                if guard > 0:
+                    mask[max(i - g, 0):i + g + 1, max(j - g, 0):j + g + 1] = False
+                X = self.image[mask & valid]
+                μ = np.mean(X, axis=0)
+                Σ = np.cov(X, rowvar=False)
+                Σ += regularization * np.trace(Σ) / d * np.eye(d)
+                P = np.linalg.inv(Σ)
+                x̄ = self.image[i, j] - μ
+                scores[i, j] = np.matmul(x̄, np.matmul(P, self.targets)) / np.sqrt(
+                    np.einsum('bt,bt->t', self.targets, np.matmul(P, self.targets)) *
+                    np.matmul(x̄, np.matmul(P, x̄)))
+        scores[~valid] = np.nan
+        return scores
+
+    def test_exact(self):
+        for guard in [0, 3]:
+            expected = self.brute_force(7, guard, 1e-3)
+            scores = local_matched_filter(self.image, self.targets, window=7, guard=guard)
+            np.testing.assert_allclose(scores, expected, atol=1e-10)
+
+    def test_incremental(self):
+        # With negligible loading, updated inverses only differ from fresh ones by rounding
+        for guard in [0, 3]:
+            for detector in ['nmf', 'amf']:
+                expected = local_matched_filter(self.image, self.targets, window=7, guard=guard,
+                                                regularization=1e-9, detector=detector)
+                for refresh in [3, 4, 40]:
+                    scores = local_matched_filter(self.image, self.targets, window=7,
+                                                  guard=guard, refresh=refresh,
+                                                  regularization=1e-9, detector=detector)
+                    np.testing.assert_allclose(scores, expected, atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
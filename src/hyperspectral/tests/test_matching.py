@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+
+from hyperspectral.spectra import SpectralLibrary, SpectralMatcher
+
+
+def make_library(S):
+    n = S.shape[1]
+    return SpectralLibrary.from_arrays(np.linspace(0.4, 2.4, S.shape[0]), S.transpose(),
+                                       ['s'] * n, ['t'] * n, ['c'] * n, [{}] * n)
+
+
+def brute_force(S, X, metric, k):
+    """The top-k library indices and scores of each pixel, by a full argsort"""
+    if metric == 'correlation':
+        S = S - np.mean(S, axis=0)
+        X = X - np.mean(X, axis=0)
+    S = S / np.linalg.norm(S, axis=0)
+    X = X / np.linalg.norm(X, axis=0)
+    cos = np.matmul(S.transpose(), X)
+    ix = np.argsort(-cos, axis=0, kind='stable')[:k]
+    scores = np.take_along_axis(cos, ix, axis=0)
+    if metric == 'sam':
+        scores = np.arccos(np.clip(scores, -1, 1))
+    return ix, scores
+
+
+class SpectralMatcherTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        base = np.abs(np.cumsum(rng.normal(size=(40, 12)), axis=0)) + 1
+        self.S = base[:, rng.integers(0, 12, 500)] * (1 + 0.05 * rng.normal(size=(40, 500)))
+        truth = rng.integers(0, 500, 300)
+        self.X = self.S[:, truth] * rng.uniform(0.5, 2, 300) + 0.05 * rng.normal(size=(40, 300))
+
+    def test_brute_force(self):
+        library = make_library(self.S)
+        for metric in ['sam', 'correlation']:
+            for k in [1, 3, 10]:
+                expected_ix, expected = brute_force(self.S, self.X, metric, k)
+                for components in [None, 8]:
+                    matcher = SpectralMatcher(library, metric, k, components=components,
+                                              chunk=64, dtype=np.float64)
+                    ix, scores = matcher.apply(self.X)
+                    np.testing.assert_allclose(scores, expected, atol=1e-7)
+                    # Indices can only differ between (near) ties
+                    self.assertGreater(np.mean(ix == expected_ix), 0.999)
+
+    def test_unscored_pixels(self):
+        X = self.X[:, :5].copy()
+        X[3, 1] = np.nan
+        ix, scores = SpectralMatcher(make_library(self.S), k=2).apply(X)
+        np.testing.assert_array_equal(ix[:, 1], [-1, -1])
+        self.assertTrue(np.all(np.isnan(scores[:, 1])))
+        self.assertTrue(np.all(ix[:, [0, 2, 3, 4]] >= 0))
+
+    def test_zero_spectrum(self):
+        S = self.S.copy()
+        S[:, 7] = 0
+        with self.assertRaises(AssertionError):
+            SpectralMatcher(make_library(S), k=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
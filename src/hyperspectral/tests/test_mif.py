@@ -0,0 +1,20 @@
+import unittest
+
+import numpy as np
+
+from hyperspectral.decorrelation import mif_decorrelate
+
+
+class BatchedTest(unittest.TestCase):
+    def test_matches_per_band(self):
+        rng = np.random.default_rng(0)
+        shape = (4, 32, 32)
+        img = np.cumsum(np.cumsum(rng.normal(size=shape), 1), 2) + 5 * rng.normal(size=shape)
+        img = img.astype(np.float32)
+
+        batched = mif_decorrelate(img, dev='cpu', batched=True)
+        np.testing.assert_array_equal(batched, mif_decorrelate(img, dev='cpu', batched=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
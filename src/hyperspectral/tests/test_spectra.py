@@ -0,0 +1,37 @@
+import unittest
+
+import numpy as np
+
+from hyperspectral.spectra import SpectralLibrary
+
+
+class SpectralLibraryTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.library = SpectralLibrary.from_arrays(
+            np.linspace(0.4, 2.4, 5), rng.random((4, 5)), ['a', 'b', 'c', 'd'], ['t'] * 4,
+            ['x', 'y', 'x', None], [{}] * 4)
+
+    def test_group_by_unorderable_keys(self):
+        self.library.group_by(lambda s: None)
+        self.assertEqual(self.library.group_vector, [0, 0, 0, 0])
+
+        self.library.group_by(lambda s: s.class_)
+        self.assertEqual(self.library.groups, {'x': 0, 'y': 1, None: 2})
+        self.assertEqual(self.library.group_vector, [0, 1, 0, 2])
+
+    def test_model_matrix_is_a_copy(self):
+        M = self.library.model_matrix
+        self.assertEqual(M.shape, (5, 4))
+        self.assertEqual(M.dtype, np.float64)
+        M[:] = 0
+        self.assertFalse(np.any(self.library.model_matrix == 0))
+
+    def test_assign_spectra(self):
+        self.library.spectra = self.library.spectra[:2]
+        self.assertEqual(list(self.library.names), ['a', 'b'])
+        self.assertEqual(self.library.model_matrix.shape, (5, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
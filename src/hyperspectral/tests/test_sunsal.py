@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+import scipy.optimize
+from scipy.ndimage import gaussian_filter
+
+from hyperspectral.unmixing import SparseUnmixer, sunsal
+
+
+class SunsalTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.R = rng.uniform(size=(30, 5))
+        A = rng.dirichlet(np.ones(5), size=40).transpose()
+        self.Y = np.matmul(self.R, A) + 0.05 * rng.normal(size=(30, 40))
+
+    def test_anc(self):
+        Z = sunsal(self.R, self.Y, dtype=np.float64, tol=1e-7, max_iters=20000)
+        expected = np.stack([scipy.optimize.nnls(self.R, y)[0] for y in self.Y.T], axis=1)
+        np.testing.assert_allclose(Z, expected, atol=1e-6)
+
+    def test_anc_asc(self):
+        R = self.R
+        Z = sunsal(R, self.Y, sum_to_one=True, dtype=np.float64, tol=1e-7, max_iters=20000)
+
+        simplex = [{'type': 'eq', 'fun': lambda a: np.sum(a) - 1}]
+
+        def slsqp(y):
+            return scipy.optimize.minimize(
+                lambda a: 0.5 * np.sum(np.square(y - np.matmul(R, a))), np.full(5, 0.2),
+                jac=lambda a: np.matmul(R.T, np.matmul(R, a) - y), method='SLSQP',
+                bounds=[(0, None)] * 5, constraints=simplex,
+                options={'ftol': 1e-12, 'maxiter': 1000}).x
+
+        expected = np.stack([slsqp(y) for y in self.Y.T], axis=1)
+        np.testing.assert_allclose(Z, expected, atol=1e-5)
+        np.testing.assert_allclose(np.sum(Z, axis=0), 1, atol=1e-6)
+
+    def test_warm_start(self):
+        # Rows of a scene whose abundances vary smoothly, as run_raster sees them
+        rng = np.random.default_rng(0)
+        m = 20
+        R = np.abs(np.cumsum(rng.normal(size=(50, m)), axis=0)) + 1
+        F = np.zeros((m, 2, 64))
+        for i in rng.choice(m, size=4, replace=False):
+            F[i] = gaussian_filter(rng.exponential(size=(2, 64)), 8, mode='wrap')
+        F /= np.sum(F, axis=0, keepdims=True)
+        scene = np.tensordot(R, F, 1) + 0.001 * rng.normal(size=(50, 2, 64))
+
+        for sum_to_one in [False, True]:
+            unmixer = SparseUnmixer(R, sum_to_one=sum_to_one)
+            _, state = unmixer.apply(scene[:,0,:])
+            unmixer.apply(scene[:,1,:])
+            cold = unmixer.iterations
+            unmixer.apply(scene[:,1,:], state)
+            self.assertLess(unmixer.iterations, cold / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+import unittest
+
+import numpy as np
+
+from hyperspectral.decorrelation.tiled import mif_schedule, seam_error
+
+
+class SeamTest(unittest.TestCase):
+    def test_default_halo(self):
+        rng = np.random.default_rng(0)
+        y, x = np.mgrid[0:96, 0:96] / 20
+        img = np.stack([np.sin(x + y) * np.cos(2 * y) + 0.3 * rng.normal(size=x.shape)])
+        schedule = mif_schedule(img[0], max_imfs=3)
+
+        # The halo defaults to HALO_SUPPORTS times the largest mask support
+        self.assertLess(seam_error(img, [schedule], 32), 1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -152,6 +152,27 @@ def cli_parser():
     parser.add_argument(
         "--target", type=str, required=True, choices=['oil', 'plastic'],
     )
+    parser.add_argument(
+        "--pyramid-factor",
+        type=int,
+        default=None,
+        help="If provided, only compute tiles with hits at this decimation factor at full "
+        "resolution.",
+    )
+    parser.add_argument(
+        "--pyramid-threshold",
+        type=float,
+        default=None,
+        help="Coarse score above which a tile is computed at full resolution (required with "
+        "--pyramid-factor).",
+    )
+    parser.add_argument(
+        "--pyramid-margin",
+        type=int,
+        default=None,
+        help="Full resolution pixels by which coarse hits are dilated (defaults to the "
+        "pyramid factor).",
+    )
 
     return parser
 
@@ -164,7 +185,10 @@ def main():
     except TypeError:
         warpMemoryLimit = None
 
-    args = cli_parser().parse_args()
+    parser = cli_parser()
+    args = parser.parse_args()
+    if args.pyramid_factor and args.pyramid_threshold is None:
+        parser.error("--pyramid-threshold is required with --pyramid-factor")
     args = pipeline_arguments(args)
 
     if not args.aviris_stac_id.startswith(args.aviris_collection_id):
@@ -235,6 +259,11 @@ def main():
         if not os.path.exists(in_filename):
             os.system(f"aws s3 cp {s3_in} {in_filename}")
         inference_args = f"--infile={in_filename} --outfile={out_filename} --npz-load /usr/local/src/activator/target_detection/{args.target}.npz"
+        if args.pyramid_factor:
+            inference_args += f" --pyramid-factor {args.pyramid_factor}"
+            inference_args += f" --pyramid-threshold {args.pyramid_threshold}"
+            if args.pyramid_margin is not None:
+                inference_args += f" --pyramid-margin {args.pyramid_margin}"
         args2 = inference_parser().parse_args(inference_args.split())
         compute(args2)
         os.system(f"gdaladdo {out_filename}")
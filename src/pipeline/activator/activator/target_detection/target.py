@@ -9,6 +9,7 @@ import warnings
 import numpy as np
 import rasterio as rio
 import tqdm
+from rasterio.enums import Resampling
 from rasterio.windows import Window
 
 
@@ -18,16 +19,51 @@ def cli_parser():
     parser.add_argument("--outfile", required=True, type=str, nargs="+")
     parser.add_argument("--npz-load", required=True, type=str)
     parser.add_argument("--stride", required=False, type=int, default=512)
+    parser.add_argument("--pyramid-factor", required=False, type=int, default=None,
+                        help="Score a decimated read (served from overviews where available) "
+                             "first, and only compute tiles with coarse hits at full resolution")
+    parser.add_argument("--pyramid-threshold", required=False, type=float, default=None,
+                        help="Coarse score above which a tile is computed at full resolution "
+                             "(required with --pyramid-factor)")
+    parser.add_argument("--pyramid-margin", required=False, type=int, default=None,
+                        help="Full resolution pixels by which coarse hits are dilated "
+                             "(defaults to the pyramid factor)")
     return parser
 
 
-def whiten(m, W, mean):
-    old_shape = m.shape
-    m = m.reshape(-1, old_shape[-1])
-    m = m - mean
-    m = np.matmul(m, W)
-    m = m.reshape(*old_shape)
-    return m
+def score(data, filt):
+    """Score a b×h×w block of pixels, giving an h×w block"""
+    b, height, width = data.shape
+    data = data.reshape(b, -1).astype(np.float32)
+    norm = np.sqrt(np.einsum('ij,ij->j', data, data))
+    data = np.matmul(filt, data) / norm
+    data[np.isnan(data)] = 0
+    return data.reshape(height, width)
+
+
+def coarse_hits(in_ds, filt, args):
+    """
+    Score the scene at 1/pyramid_factor resolution, and threshold
+
+    Each stride×stride tile is read with a decimated (averaging) out_shape, which GDAL
+    serves from the closest overview level when the file has one.  The stride is
+    rounded up to a multiple of pyramid_factor, so that every tile starts on a coarse
+    cell boundary and the coarse cells of neighbouring tiles do not overlap.
+    """
+    assert args.pyramid_threshold is not None, "A pyramid threshold must be given"
+    f = args.pyramid_factor
+    stride = -(-args.stride // f) * f
+    hits = np.zeros((-(-in_ds.height // f), -(-in_ds.width // f)), dtype=bool)
+    for col in range(0, in_ds.width, stride):
+        width = min(col + stride, in_ds.width) - col
+        for row in range(0, in_ds.height, stride):
+            height = min(row + stride, in_ds.height) - row
+            window = Window(col, row, width, height)
+            shape = (in_ds.count, -(-height // f), -(-width // f))
+            data = in_ds.read(window=window, out_shape=shape, resampling=Resampling.average)
+            hits[row // f:row // f + shape[1], col // f:col // f + shape[2]] |= \
+                score(data, filt) > args.pyramid_threshold
+    return hits
 
 
 def compute(args):
@@ -37,6 +73,10 @@ def compute(args):
     bias = dictionary.get('bias').astype(np.float32)
     spectrum = dictionary.get('spectrum').astype(np.float32)
 
+    # The score (x/‖x‖)ᵀWs only needs the single vector Ws, so fold the whitening
+    # into the spectrum once rather than whitening every pixel
+    filt = np.matmul(W, spectrum)
+
     for (infile, outfile) in zip(args.infile, args.outfile):
         with rio.open(infile, 'r') as in_ds:
             profile = copy.deepcopy(in_ds.profile)
@@ -49,24 +89,42 @@ def compute(args):
                 'dtype': np.float32,
                 'sparse_ok': 'yes'
             })
+
+            if args.pyramid_factor:
+                f = args.pyramid_factor
+                margin = f if args.pyramid_margin is None else args.pyramid_margin
+                hits = coarse_hits(in_ds, filt, args)
+            computed = 0
+            total = 0
+
             with rio.open(outfile, 'w', **profile) as out_ds:
                 for col in tqdm.tqdm(range(0, in_ds.width, args.stride), position=0):
                     width = min(col + args.stride, in_ds.width) - col
                     for row in tqdm.tqdm(range(0, in_ds.height, args.stride), position=1, leave=False):
                         height = min(row + args.stride, in_ds.height) - row
+                        total += 1
+                        if args.pyramid_factor:
+                            # Dilating the hits by the margin is the same as growing
+                            # the tile by the margin before looking for hits
+                            r0 = max(row - margin, 0) // f
+                            r1 = -(-(row + height + margin) // f)
+                            c0 = max(col - margin, 0) // f
+                            c1 = -(-(col + width + margin) // f)
+                            if not np.any(hits[r0:r1, c0:c1]):
+                                # Unwritten tiles of a sparse GeoTIFF are never
+                                # allocated, and read back as zero
+                                continue
+                        computed += 1
                         window = Window(col, row, width, height)
-                        data = in_ds.read(window=window)
-                        data = np.transpose(data, (1,2,0))
-                        data = data.astype(np.float32)
-                        norm = np.linalg.norm(data, ord=2, axis=2)[..., None].astype(np.float32)
-                        data /= norm
-                        data = whiten(data, W, 0)
-                        data = np.dot(data, spectrum)
-                        data[np.isnan(data)] = 0
-                        data = data.reshape(1, height, width).astype(np.float32)
-                        out_ds.write(data, window=window)
+                        data = score(in_ds.read(window=window), filt)
+                        out_ds.write(data.reshape(1, height, width), window=window)
+
+            logging.info(f"{outfile}: computed {computed} of {total} tiles at full resolution")
 
 
 if __name__ == "__main__":
-    args = cli_parser().parse_args()
+    parser = cli_parser()
+    args = parser.parse_args()
+    if args.pyramid_factor and args.pyramid_threshold is None:
+        parser.error("--pyramid-threshold is required with --pyramid-factor")
     compute(args)